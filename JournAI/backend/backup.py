@@ -0,0 +1,245 @@
+"""
+Portable dump of the whole journal as NDJSON, and the matching bulk import:
+
+    python backup.py export journal.ndjson.gz        # .gz -> gzip, "-" -> stdout
+    python backup.py import journal.ndjson.gz        # into an empty database
+    python backup.py import journal.ndjson.gz --replace
+
+The file is one JSON value per line: a header, then per table a {"table", "columns"}
+line followed by one array per row, then a trailer with the row counts (a file without
+it was cut short and is refused). Export walks each table with a cursor from one read
+snapshot, import inserts with executemany in a single transaction and checks the
+foreign keys once at the end; both run in constant memory.
+"""
+import argparse
+import gzip
+import json
+import logging
+import sqlite3
+import sys
+import time
+from typing import Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from db import DB_PATH, connect, create_tables
+from migrations import migrate, schema_version
+from rollups import ROLLUP_TABLES
+
+logger = logging.getLogger("uvicorn.error")
+
+FORMAT = "journai-ndjson"
+FORMAT_VERSION = 1
+BATCH_ROWS = 5000
+
+# checked to decide whether a database already holds a journal (Sessions alone do not count,
+# the server creates today's session on startup)
+JOURNAL_TABLES = ("User", "Conversations", "Messages", "Metrics", "Notes")
+
+
+class BackupError(ValueError):
+    """The file is not a (complete) journal export or does not fit the database."""
+
+
+class JournalExists(BackupError):
+    """Import into a database that already holds a journal, without replace."""
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def data_tables(db: sqlite3.Connection) -> List[str]:
+    # sqlite_sequence is not exported: inserting explicit ids moves it along; the rollups
+    # are derived, their triggers refill them while the raw rows are imported
+    return [r[0] for r in db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    ) if r[0] not in ROLLUP_TABLES]
+
+
+def _columns(db: sqlite3.Connection, table: str) -> List[str]:
+    return [r[1] for r in db.execute(f"PRAGMA table_info({_quote(table)})")]
+
+
+def has_journal(db: sqlite3.Connection) -> bool:
+    return any(db.execute(f"SELECT 1 FROM {t} LIMIT 1").fetchone() for t in JOURNAL_TABLES)
+
+
+# ------------------------------------ export ------------------------------------
+
+def export_lines(db: sqlite3.Connection, batch_rows: int = 1000) -> Iterator[str]:
+    """
+    -> chunks of NDJSON text (batch_rows lines each). All tables come from one read
+    transaction, so the dump is consistent even while the server keeps writing.
+    """
+    db.execute("BEGIN")
+    try:
+        yield _dumps({"format": FORMAT, "version": FORMAT_VERSION, "schema_version": schema_version(db),
+                      "exported_at": time.strftime("%Y-%m-%d %H:%M:%S")}) + "\n"
+        counts: Dict[str, int] = {}
+        for table in data_tables(db):
+            columns = _columns(db, table)
+            yield _dumps({"table": table, "columns": columns}) + "\n"
+            cursor = db.execute(f"SELECT {', '.join(map(_quote, columns))} FROM {_quote(table)} ORDER BY rowid")
+            n = 0
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                n += len(rows)
+                yield "".join(_dumps(row) + "\n" for row in rows)
+            counts[table] = n
+        yield _dumps({"end": counts}) + "\n"
+    finally:
+        db.rollback()
+
+
+# ------------------------------------ import ------------------------------------
+
+def _clear(db: sqlite3.Connection) -> None:
+    for table in data_tables(db):
+        db.execute(f"DELETE FROM {_quote(table)}")
+    db.execute("DELETE FROM sqlite_sequence")
+
+
+def import_lines(db: sqlite3.Connection, lines: Iterable[str], replace: bool = False,
+                 batch_rows: int = BATCH_ROWS) -> Dict[str, int]:
+    """
+    Load an export into `db` (the writer) -> rows inserted per table. Everything happens in
+    one transaction: a bad or truncated file leaves the database as it was. Columns the
+    current schema does not know are dropped, missing ones take their defaults.
+    """
+    if db.in_transaction:
+        db.commit()
+    # checked once at the end instead of per row; can only be switched outside a transaction
+    db.execute("PRAGMA foreign_keys = OFF")
+    try:
+        db.execute("BEGIN")
+        try:
+            counts, exported_version = _load(db, iter(lines), replace, batch_rows)
+            violations = db.execute("PRAGMA foreign_key_check").fetchmany(5)
+            if violations:
+                raise BackupError(f"foreign key violations (table, rowid, parent): {[tuple(v[:3]) for v in violations]}")
+            if exported_version < schema_version(db):
+                # the rows are as old as the export: run the newer migrations over them
+                db.execute(f"PRAGMA user_version = {int(exported_version)}")
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+    finally:
+        db.execute("PRAGMA foreign_keys = ON")
+    migrate(db)
+    return counts
+
+
+def _load(db: sqlite3.Connection, lines: Iterator[str], replace: bool, batch_rows: int) -> Tuple[Dict[str, int], int]:
+    header = json.loads(next(lines, "null") or "null")
+    if not isinstance(header, dict) or header.get("format") != FORMAT:
+        raise BackupError("not a journal export (missing header)")
+    if header.get("version", 0) > FORMAT_VERSION:
+        raise BackupError(f"export format {header['version']} is newer than this code ({FORMAT_VERSION})")
+
+    if has_journal(db) and not replace:
+        raise JournalExists("the database already holds a journal, import with replace to overwrite it")
+    _clear(db)
+
+    known = {t: set(_columns(db, t)) for t in data_tables(db)}
+    counts: Dict[str, int] = {}
+    insert: Optional[str] = None
+    keep: Optional[List[int]] = None   # column positions to insert, None = all of them
+    table = None
+    trailer = None
+
+    def flush(batch: List[list]) -> None:
+        if insert and batch:
+            db.executemany(insert, [[row[i] for i in keep] for row in batch] if keep is not None else batch)
+            counts[table] = counts.get(table, 0) + len(batch)
+
+    batch: List[list] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        value = json.loads(line)
+        if isinstance(value, list):
+            if table is None:
+                raise BackupError("row before any table line")
+            if insert:
+                batch.append(value)
+                if len(batch) >= batch_rows:
+                    flush(batch)
+                    batch = []
+            continue
+        flush(batch)
+        batch = []
+        if "end" in value:
+            trailer = value["end"]
+            break
+        table, columns = value["table"], value["columns"]
+        if table not in known:
+            logger.warning("[backup] skipping table %s: not in this schema", table)
+            insert = None
+            continue
+        keep = [i for i, c in enumerate(columns) if c in known[table]]
+        names = [columns[i] for i in keep]
+        keep = None if len(keep) == len(columns) else keep
+        insert = f"INSERT INTO {_quote(table)} ({', '.join(map(_quote, names))}) VALUES ({', '.join('?' * len(names))})"
+
+    if trailer is None:
+        raise BackupError("export is incomplete (no end line)")
+    for name, expected in trailer.items():
+        if name in known and counts.get(name, 0) != expected:
+            raise BackupError(f"{name}: {counts.get(name, 0)} rows read, the export has {expected}")
+    return counts, header.get("schema_version", 0)
+
+
+# ------------------------------------ CLI ------------------------------------
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path == "-":
+        return sys.stdout if "w" in mode else sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    p = argparse.ArgumentParser(description="Export / import the whole journal as NDJSON.")
+    p.add_argument("--db", default=DB_PATH)
+    sub = p.add_subparsers(dest="command", required=True)
+    e = sub.add_parser("export", help="write every table to a file (.gz: compressed, -: stdout)")
+    e.add_argument("path")
+    i = sub.add_parser("import", help="load an export (.gz: compressed, -: stdin)")
+    i.add_argument("path")
+    i.add_argument("--replace", action="store_true", help="overwrite the journal already in the database")
+    args = p.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.command == "export":
+        # WAL: the server can keep writing while this reads
+        db = connect(args.db, read_only=True)
+        rows = 0
+        with _open(args.path, "w") as out:
+            for chunk in export_lines(db):
+                out.write(chunk)
+                rows += chunk.count("\n")
+        db.close()
+        print(f"[backup] exported {rows} lines in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    else:
+        db = connect(args.db)
+        create_tables(db)
+        try:
+            with _open(args.path, "r") as src:
+                counts = import_lines(db, src, replace=args.replace)
+        except (ValueError, KeyError) as err:   # BackupError, or a line that is not json
+            sys.exit(f"[backup] import failed: {err!r}")
+        finally:
+            db.close()
+        print(f"[backup] imported {sum(counts.values())} rows in {time.perf_counter() - started:.1f}s: {counts}",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Query plan check: runs the read paths of the routers (every filter branch) and of the
+analysis / chat pipeline against a scratch database with the current schema + migrations,
+records the SQL they issue and fails if EXPLAIN QUERY PLAN shows a filtered statement
+scanning a table (directly or by walking a whole index) instead of searching an index.
+Unfiltered listings may scan, they return the whole table anyway; so may the first page of a
+keyset listing (index walk in ORDER BY order, stopped by a trailing LIMIT).
+
+    python check_query_plans.py          # exit code 1 + the offending plans if a scan is found
+    python check_query_plans.py -v       # print every statement with its plan
+"""
+import argparse
+import asyncio
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+from db import connect, create_tables
+from endpoints import chat, jobs, metrics, notes, sentiment_analysis, themeriver, user
+from graphs.activity_registry import ACTIVITIES
+from graphs.base import fetch_last_user_message_id, fetch_session_id, fetch_user_text, fetch_watermarks
+from graphs.cache import cache_get
+from inference.chat_context import load_summary
+
+_FILTERED = re.compile(r"\bWHERE\b", re.I)
+_LIMITED = re.compile(r"\bLIMIT\s+(\?|\d+)\s*$", re.I)
+
+
+def _seed(db: sqlite3.Connection) -> None:
+    db.execute("INSERT INTO Sessions (date) VALUES ('2026-01-01')")
+    db.execute("INSERT INTO Conversations (session_id, title, timestamp) VALUES (1, 't', '2026-01-01 10:00:00')")
+    db.execute("INSERT INTO Messages (entry_id, sender, content) VALUES (1, 'user', 'hello')")
+    db.execute("INSERT INTO analysis_jobs (entry_id, mode, created_at) VALUES (1, 'combined', '2026-01-01')")
+    db.commit()
+
+
+async def _exercise(db: sqlite3.Connection, writer: sqlite3.Connection) -> None:
+    views = ("day", "week", "month", None)
+    for view in views:
+        for entry_id, session_id in ((1, None), (None, 1), (None, None)):
+            await metrics.get_activity_histogram(None, view=view, entry_id=entry_id, session_id=session_id, db=db)
+            await sentiment_analysis.get_va_results(None, view=view, entry_id=entry_id, session_id=session_id, db=db)
+            await sentiment_analysis.get_spider_results(None, view=view, entry_id=entry_id, session_id=session_id, db=db)
+            for source in ("ai", "user", None):
+                await sentiment_analysis.get_plutchik_results(None, view=view, source=source, entry_id=entry_id,
+                                                              session_id=session_id, db=db)
+                await sentiment_analysis.get_plutchik_dyads(None, view=view, source=source, entry_id=entry_id,
+                                                            session_id=session_id, db=db)
+        await sentiment_analysis.get_va_daily(None, view=view, db=db)
+        for source in ("ai", "user", None):
+            await sentiment_analysis.get_plutchik_daily(None, view=view, source=source, db=db)
+    for view in ("day", "week", "month"):
+        for entry_id, session_id in ((1, None), (None, 1), (None, None)):
+            await themeriver.get_theme_river(None, view=view, session_id=session_id, entry_id=entry_id, db=db)
+    await metrics.get_mood_histogram(None, db=db)
+    await chat.get_history(None, entry_id=None, db=db)
+    await chat.get_history(None, entry_id=1, db=db)
+    await chat.get_conversations(None, limit=1, cursor=None, include_empty=True, db=db)
+    await chat.get_conversations(None, limit=1, cursor=chat._encode_cursor("2026-01-02", 1), include_empty=False, db=db)
+    await notes.get_note(None, db=db)
+    await user.user_exists(None, db=db)
+    await user.user_data(None, db=db)
+    await jobs.get_analysis_job(None, job_id=1, db=db)
+    await jobs.list_analysis_jobs(None, entry_id=1, limit=20, db=db)
+    await jobs.list_analysis_jobs(None, entry_id=None, limit=20, db=db)
+
+    # analysis / chat pipeline reads
+    fetch_session_id(db, 1)
+    fetch_user_text(db, 1)
+    fetch_user_text(db, 1, after_id=0, upto_id=10)
+    fetch_last_user_message_id(db, 1)
+    fetch_watermarks(db, 1)
+    cache_get(db, "0" * 64)
+    load_summary(db, 1)
+    db.execute("SELECT id, sender, content FROM Messages WHERE entry_id = ? AND id > ? AND id < ? ORDER BY id ASC",
+               (1, 0, 10)).fetchall()
+
+    # activity registry: load, lookups of new names, merge
+    ACTIVITIES.invalidate()
+    ACTIVITIES.resolve(writer, ["Hiking", "gaming"])
+    ACTIVITIES.resolve(writer, ["Hiking", "reading"])
+    ACTIVITIES.merge(writer, ["game"], "gaming")
+    writer.rollback()
+    ACTIVITIES.invalidate()
+
+
+def _bad_steps(db: sqlite3.Connection, sql: str) -> List[str]:
+    if not _FILTERED.search(sql):
+        return []
+    plan = [row[-1] for row in db.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+    if _LIMITED.search(sql) and not any("TEMP B-TREE" in step for step in plan):
+        # first page of a keyset listing: walks the index in ORDER BY order and stops at the LIMIT
+        plan = [step for step in plan if not re.match(r"SCAN \w+ USING (COVERING )?INDEX", step)]
+    return [step for step in plan if step.startswith("SCAN ")]
+
+
+def check(verbose: bool = False) -> List[Tuple[str, List[str]]]:
+    path = os.path.join(tempfile.mkdtemp(), "plans.db")
+    writer = connect(path)
+    create_tables(writer)
+    _seed(writer)
+    db = connect(path, read_only=True)
+
+    statements: Dict[str, None] = {}
+    trace = lambda sql: statements.setdefault(sql.strip(), None)
+    db.set_trace_callback(trace)
+    writer.set_trace_callback(trace)
+    asyncio.run(_exercise(db, writer))
+    db.set_trace_callback(None)
+    writer.set_trace_callback(None)
+
+    failures = []
+    for sql in statements:
+        if not re.match(r"(SELECT|UPDATE|DELETE)\b", sql, re.I):
+            continue
+        bad = _bad_steps(db, sql)
+        if verbose:
+            plan = [r[-1] for r in db.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+            print(("FAIL " if bad else "ok   ") + " ".join(sql.split())[:140] + "\n       " + " | ".join(plan))
+        if bad:
+            failures.append((sql, bad))
+    return failures
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Check that the routers' queries use indexes.")
+    p.add_argument("-v", "--verbose", action="store_true")
+    args = p.parse_args()
+    failures = check(verbose=args.verbose)
+    for sql, bad in failures:
+        print(f"[plans] full scan ({', '.join(bad)}):\n  {' '.join(sql.split())}")
+    print(f"[plans] {'FAILED' if failures else 'ok'}: {len(failures)} statement(s) scanning a table")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
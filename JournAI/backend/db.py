@@ -1,13 +1,108 @@
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
+from typing import AsyncIterator, Iterator, List
+import asyncio
 import sqlite3
+import threading
 
-def init_db():
-    conn =  sqlite3.connect("./databases/journai.db", check_same_thread=False)
+from fastapi import Request
+
+from migrations import migrate
+from telemetry import TimedConnection
+
+DB_PATH = "./databases/journai.db"
+BUSY_TIMEOUT_S = 30.0
+
+
+def connect(path: str = DB_PATH, read_only: bool = False) -> sqlite3.Connection:
+    # TimedConnection: per-statement timings for /metrics
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT_S, factory=TimedConnection)
     conn.execute("PRAGMA foreign_keys = ON")
+    # ON CONFLICT REPLACE deletes must reach the rollup triggers (rollups.py)
+    conn.execute("PRAGMA recursive_triggers = ON")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    else:
+        # WAL: readers keep reading the last commit while a write is in progress
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
     return conn
 
-def close_db(db):
-    db.close()
+
+class Database:
+    """
+    The server's connections: one writer, used by one request / task at a time
+    (async with database.write()), and a pool of read-only connections
+    (with database.read()). In WAL mode a reader never waits for the writer, it just sees
+    the last committed state. Writes that surround an llm call should use two short
+    write blocks instead of holding the writer during the generation.
+    """
+
+    def __init__(self, path: str = DB_PATH, readers: int = 4):
+        self.path = path
+        self.max_idle_readers = readers
+        self.writer = connect(path)
+        self._write_lock = asyncio.Lock()
+        self._idle: List[sqlite3.Connection] = []
+        self._idle_lock = threading.Lock()
+        self._readers_open = 0
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        # never blocks: a busy pool opens one more connection, extra ones are closed on return
+        with self._idle_lock:
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._readers_open += 1
+        if conn is None:
+            conn = connect(self.path, read_only=True)
+        try:
+            yield conn
+        finally:
+            with self._idle_lock:
+                keep = len(self._idle) < self.max_idle_readers
+                if keep:
+                    self._idle.append(conn)
+                else:
+                    self._readers_open -= 1
+            if not keep:
+                conn.close()
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[sqlite3.Connection]:
+        # commits when the block ends, rolls back if it raises
+        async with self._write_lock:
+            try:
+                yield self.writer
+                self.writer.commit()
+            except BaseException:
+                self.writer.rollback()
+                raise
+
+    def status(self) -> dict:
+        with self._idle_lock:
+            return {"readers_open": self._readers_open, "readers_idle": len(self._idle),
+                    "writer_busy": self._write_lock.locked()}
+
+    def close(self) -> None:
+        with self._idle_lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle.clear()
+        self.writer.close()
+
+
+# ---- FastAPI dependencies: every request gets a connection of its own ----
+
+async def get_db(request: Request) -> AsyncIterator[sqlite3.Connection]:
+    # read-only routes
+    with request.app.state.database.read() as conn:
+        yield conn
+
+async def get_write_db(request: Request) -> AsyncIterator[sqlite3.Connection]:
+    # routes that write (and do not wait on the model): the writer for the whole request
+    async with request.app.state.database.write() as conn:
+        yield conn
 
 def create_tables(db):
 
@@ -143,6 +238,86 @@ def create_tables(db):
     """)
 
 
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            key          TEXT PRIMARY KEY,          -- sha256(text, analyzer, version)
+            analyzer     TEXT NOT NULL,
+            version      TEXT NOT NULL,
+            result       TEXT NOT NULL,             -- parsed model JSON of the section
+            created_at   TEXT NOT NULL DEFAULT (datetime('now')),
+            last_used_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_analysis_cache_used ON analysis_cache(last_used_at);
+    """)
+
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            entry_id    INTEGER NOT NULL,
+            status      TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued','running','done','failed')),
+            mode        TEXT NOT NULL DEFAULT 'combined',
+            refresh     INTEGER NOT NULL DEFAULT 0,
+            incremental INTEGER NOT NULL DEFAULT 0,
+            error       TEXT,
+            created_at  TEXT NOT NULL DEFAULT (datetime('now')),
+            started_at  TEXT,
+            finished_at TEXT,
+            FOREIGN KEY (entry_id) REFERENCES Conversations(entry_id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS analysis_job_steps (
+            job_id      INTEGER NOT NULL,
+            analyzer    TEXT NOT NULL,              -- BaseAnalysis.name
+            position    INTEGER NOT NULL,
+            status      TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending','running','done','failed')),
+            started_at  TEXT,
+            finished_at TEXT,
+            duration_ms REAL,
+            error       TEXT,
+            PRIMARY KEY (job_id, analyzer),
+            FOREIGN KEY (job_id) REFERENCES analysis_jobs(id) ON DELETE CASCADE
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_analysis_jobs_entry ON analysis_jobs(entry_id, status);
+
+        CREATE TABLE IF NOT EXISTS analysis_watermarks (
+            entry_id        INTEGER NOT NULL,
+            analyzer        TEXT NOT NULL,          -- BaseAnalysis.name
+            last_message_id INTEGER NOT NULL,       -- highest Messages.id already analyzed
+            updated_at      TEXT NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (entry_id, analyzer),
+            FOREIGN KEY (entry_id) REFERENCES Conversations(entry_id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS reanalysis_runs (
+            name          TEXT PRIMARY KEY,         -- reanalyze.py --run
+            params        TEXT NOT NULL,            -- JSON of the options it was started with
+            last_entry_id INTEGER NOT NULL DEFAULT 0,  -- checkpoint: entries up to here are committed
+            entries_done  INTEGER NOT NULL DEFAULT 0,
+            entries_failed INTEGER NOT NULL DEFAULT 0,
+            started_at    TEXT NOT NULL DEFAULT (datetime('now')),
+            updated_at    TEXT NOT NULL DEFAULT (datetime('now')),
+            finished_at   TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS reanalysis_failures (
+            run       TEXT NOT NULL,                -- reanalysis_runs.name
+            entry_id  INTEGER NOT NULL,             -- retried first when the run is resumed
+            error     TEXT,
+            failed_at TEXT NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (run, entry_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS entry_summaries (
+            entry_id        INTEGER PRIMARY KEY,
+            summary         TEXT NOT NULL,          -- running summary of the turns left out of the chat prompt
+            upto_message_id INTEGER NOT NULL,       -- highest Messages.id folded into it
+            updated_at      TEXT NOT NULL DEFAULT (datetime('now')),
+            FOREIGN KEY (entry_id) REFERENCES Conversations(entry_id) ON DELETE CASCADE
+        );
+    """)
+
     db.executescript("""
         CREATE TABLE IF NOT EXISTS themeriver (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -166,7 +341,11 @@ def create_tables(db):
 
     db.commit()
 
+    # indexes + later schema changes, also on databases created by older versions
+    migrate(db)
+
 def get_or_create_session_id(db):
+    # no commit: called with the writer inside a write block
     today = datetime.now().strftime("%Y-%m-%d")
 
     # check if a session already exists 4 today
@@ -181,7 +360,6 @@ def get_or_create_session_id(db):
         "INSERT INTO Sessions (date) VALUES (?)",
         (today,)
     )
-    db.commit()
 
     # get id of newly created session
     cursor = db.execute("SELECT id FROM Sessions WHERE date = ?", (today,))
@@ -1,24 +1,33 @@
+import base64
 from datetime import datetime
+import json
 import sqlite3
-from typing import Optional
+from typing import List, Optional
 
-from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi import APIRouter, Depends, Query, Request, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
+from db import Database, get_db, get_write_db
+from inference.scheduler import PRIORITY_CHAT
+from inference.chat_context import PROMPT_MARGIN, count_tokens, fit_history
+from endpoints.inference import require_llm
+from inference.prompts import PROMPTS
+
 chat_router = APIRouter()
 entries_router = APIRouter()
 
 
-def load_system_prompt(path: str = "prompts/system_prompt.txt") -> str:
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read().strip()
+def load_system_prompt() -> str:
+    # prompts/system_prompt.txt, from the template registry (no disk read per call)
+    return PROMPTS.get("system_prompt").text
 
 
 class ChatRequest(BaseModel):
     message: str
     entry_id: int | None = None
     bot_enabled: bool = False  
+    stream: bool = False     # reply as Server-Sent Events, token by token
 
 
 def fetch_user_info(db: sqlite3.Connection) -> dict:
@@ -36,21 +45,107 @@ def fetch_user_info(db: sqlite3.Connection) -> dict:
 
 # ---------------------- /chat endpoint (NO in-memory session) ----------------------
 
+CHAT_GEN_KWARGS = dict(
+    max_tokens=400,
+    temperature=0.7,
+    top_p=0.9,
+    repeat_penalty=1.1,
+    stop=["User", "System:", "JournAI:"],
+)
+
+
+async def _build_chat_prompt(app, entry_id: int, message: str, message_id: int) -> str:
+    """
+    System prompt + user info + history + the new message, within the model context.
+    History = messages before message_id (the one just stored); whatever does not fit
+    next to the reply budget lives on in the entry's running summary.
+    """
+    database: Database = app.state.database
+    llm = require_llm(app)
+    # prompts/chat.txt with the system prompt pre-rendered in (once per template version)
+    system = PROMPTS.get("system_prompt")
+    template = PROMPTS.bind(system.version, "chat", system_prompt=system.text)
+    with database.read() as db:
+        user_info = fetch_user_info(db)
+    render = lambda history: template.render(user_info=user_info, history=history, message=message)
+
+    budget = llm.n_ctx - CHAT_GEN_KWARGS["max_tokens"] - PROMPT_MARGIN - count_tokens(llm, render(""))
+    summary, turns = await fit_history(database, app.state.inference, llm, entry_id, message_id, max(budget, 0))
+
+    earlier = f"Earlier in this conversation: {summary}\n" if summary else ""
+    history = "History:\n" + "".join(f"{t}\n" for t in turns) if turns else ""
+    return render(earlier + history)
+
+
+def _sse(event: str, data: dict) -> str:
+    # one Server-Sent Event frame
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream_chat_reply(app, entry_id: int, user_message: str, message_id: int, now: str):
+    """
+    Forwards llama_cpp tokens as SSE frames while they are generated and stores the
+    full bot message once the stream ends. Generation runs on the inference executor,
+    so the event loop keeps serving other requests meanwhile.
+    """
+    database: Database = app.state.database
+    parts: List[str] = []
+    saved = False
+    try:
+        yield _sse("start", {"entry_id": entry_id, "user": user_message})
+        prompt = await _build_chat_prompt(app, entry_id, user_message, message_id)
+
+        # chat_cache restores this entry's KV state so only the new turn gets evaluated
+        llm = app.state.chat_cache.for_entry(require_llm(app), entry_id)
+        async for chunk in app.state.inference.stream(llm, prompt, priority=PRIORITY_CHAT, tag="chat", **CHAT_GEN_KWARGS):
+            token = chunk["choices"][0].get("text", "")
+            if not parts:
+                token = token.lstrip()   # drop the leading space after "Bot:"
+            if not token:
+                continue
+            parts.append(token)
+            yield _sse("token", {"text": token})
+
+        full_reply = "".join(parts).strip()
+        async with database.write() as db:
+            db.execute(
+                "INSERT INTO Messages (entry_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
+                (entry_id, "bot", full_reply, now)
+            )
+        saved = True
+        yield _sse("done", {"entry_id": entry_id, "bot": full_reply})
+    except Exception as e:
+        print(f" Bot reply skipped: {e}")
+        yield _sse("error", {"entry_id": entry_id, "detail": str(e)})
+    finally:
+        # client went away mid-stream -> keep what was generated so history stays consistent
+        if not saved and parts:
+            try:
+                async with database.write() as db:
+                    db.execute(
+                        "INSERT INTO Messages (entry_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
+                        (entry_id, "bot", "".join(parts).strip(), now)
+                    )
+            except Exception as e:
+                print(f" Partial bot reply not saved: {e}")
+
+
 @chat_router.post("/chat")
 async def chat_handler(request: Request, chat_request: ChatRequest):
     print("bot_enabled from client:", chat_request.bot_enabled, "entry_id:", chat_request.entry_id)
-    #check if a msg is already being processed
-    if getattr(request.app.state, "is_processing", False):
-        raise HTTPException(status_code=429, detail="Wait for the bot to reply before sending another message.")
+    # concurrent messages are no longer rejected: llm calls queue up in the inference
+    # scheduler, with chat served ahead of background analysis. The writer is only held
+    # around the inserts, not while the model answers
+    database: Database = request.app.state.database
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    session_id = request.app.state.session_id
+    entry_id = chat_request.entry_id
 
-    request.app.state.is_processing = True  # lock
-
-    try:
-        db = request.app.state.db
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        session_id = request.app.state.session_id
-        entry_id = chat_request.entry_id
+    # model still loading -> 503 before anything is stored, so the client can simply retry
+    if chat_request.bot_enabled:
+        require_llm(request.app)
 
+    async with database.write() as db:
         # always create an entry_id if missing
         if not entry_id:
             cursor = db.execute(
@@ -60,77 +155,58 @@ async def chat_handler(request: Request, chat_request: ChatRequest):
             entry_id = cursor.lastrowid
 
         # always insert the user’s message
-        db.execute(
+        message_id = db.execute(
             "INSERT INTO Messages (entry_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
             (entry_id, "user", chat_request.message, now)
+        ).lastrowid
+
+    # ---------------- streamed bot reply (SSE) ----------------
+    if chat_request.bot_enabled and chat_request.stream:
+        return StreamingResponse(
+            _stream_chat_reply(request.app, entry_id, chat_request.message, message_id, now),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
-        db.commit()
 
-        # ---------------- bot reply (optional) ----------------
-        full_reply = None
-        if chat_request.bot_enabled:   # <-- only call LLM if enabled
-            try:
-                history_rows = db.execute("""
-                    SELECT sender, content FROM Messages
-                    WHERE entry_id = ?
-                    ORDER BY timestamp ASC
-                """, (entry_id,)).fetchall()
-
-                history_str = "\n".join(
-                    f"{'User' if sender == 'user' else 'Bot'}: {content}"
-                    for sender, content in history_rows
-                )
+    # ---------------- bot reply (optional) ----------------
+    full_reply = None
+    if chat_request.bot_enabled:   # <-- only call LLM if enabled
+        try:
+            prompt = await _build_chat_prompt(request.app, entry_id, chat_request.message, message_id)
 
-                user_info = fetch_user_info(request.app.state.db)
-                prompt = f"""System: {load_system_prompt()}
-                        User Information: {user_info}
-                        History: {history_str} 
-                        User: {chat_request.message}
-                        Bot:"""
-
-                result = request.app.state.llm(
-                    prompt,
-                    max_tokens=400,
-                    temperature=0.7,
-                    top_p=0.9,
-                    repeat_penalty=1.1,
-                    stop=["User", "System:", "JournAI:"],
-                    stream=False
-                )
-                full_reply = result["choices"][0]["text"].strip()
+            llm = request.app.state.chat_cache.for_entry(require_llm(request.app), entry_id)
+            result = await request.app.state.inference.complete(
+                llm, prompt, priority=PRIORITY_CHAT, tag="chat", **CHAT_GEN_KWARGS, stream=False
+            )
+            full_reply = result["choices"][0]["text"].strip()
 
+            async with database.write() as db:
                 db.execute(
                     "INSERT INTO Messages (entry_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
                     (entry_id, "bot", full_reply, now)
                 )
-                db.commit()
-            except Exception as e:
-                print(f" Bot reply skipped: {e}")
-                full_reply = None
-        else:
-            # bot disabled
+        except Exception as e:
+            print(f" Bot reply skipped: {e}")
             full_reply = None
+    else:
+        # bot disabled
+        full_reply = None
 
-        # always return entry_id!!! even if bot is disabled
-        return JSONResponse(content={
-            "user": chat_request.message,
-            "bot": full_reply,
-            "entry_id": entry_id
-        })
-
-    finally:
-        request.app.state.is_processing = False  # unlock
+    # always return entry_id!!! even if bot is disabled
+    return JSONResponse(content={
+        "user": chat_request.message,
+        "bot": full_reply,
+        "entry_id": entry_id
+    })
 
 # ------------------------------------ /history -----------------------------------
 
 @chat_router.get("/history")
-async def get_history(request: Request, entry_id: Optional[int] = None):
+async def get_history(request: Request, entry_id: Optional[int] = None,
+                      db: sqlite3.Connection = Depends(get_db)):
     """
     Returns messages for the given entry_id. If entry_id not provided, returns messages for the last conversation.
     """
-    db: sqlite3.Connection = request.app.state.db
-    if db is None:
-        db = sqlite3.connect("backend/databases/journai.db", check_same_thread=False)
 
     if entry_id is None:
         row = db.execute("SELECT entry_id FROM Conversations ORDER BY timestamp DESC LIMIT 1").fetchone()
@@ -152,8 +228,7 @@ class EndSessionRequest(BaseModel):
     entry_id: int | None = None
 
 @chat_router.post("/end-entry")
-async def end_entry(request: Request, data: EndSessionRequest):
-    db = request.app.state.db
+async def end_entry(request: Request, data: EndSessionRequest, db: sqlite3.Connection = Depends(get_write_db)):
     session_id = request.app.state.session_id
 
     if data.entry_id:
@@ -166,60 +241,87 @@ async def end_entry(request: Request, data: EndSessionRequest):
                   AND entry_id IS NULL
                   AND timestamp >= datetime('now', '-5 minutes')
             """, (data.entry_id, session_id))
-            db.commit()
             return PlainTextResponse("Session entry finalized and metrics linked.", status_code=200)
 
         except Exception as e:
-            db.rollback()
-            return PlainTextResponse(f"Error linking metrics: {e}", status_code=500)
+            # raised, so get_write_db rolls the update back
+            raise HTTPException(status_code=500, detail=f"Error linking metrics: {e}")
     
     return PlainTextResponse("No entry_id provided to link metrics.", status_code=400)
 
 # ------------------------------- entries listing / delete -----------------------------------
 
+ENTRIES_PAGE_MAX = 100
+PREVIEW_CHARS = 160
+
+
+def _encode_cursor(timestamp: str, entry_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([timestamp, entry_id]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        timestamp, entry_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(timestamp), int(entry_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @entries_router.get("/entries")
-async def get_conversations(request: Request):
-    db = request.app.state.db
-    if db is None:
-        db = sqlite3.connect("backend/databases/journai.db", check_same_thread=False)
-        request.app.state.db = db
-
-    conversations = db.execute("""
-        SELECT entry_id, title, timestamp
-        FROM Conversations
-        ORDER BY timestamp DESC
-    """).fetchall()
-
-    result = []
-    for convo in conversations:
-        entry_id, title, ts = convo
-        messages = db.execute("""
-            SELECT sender, content, timestamp
-            FROM Messages
-            WHERE entry_id = ?
-            ORDER BY timestamp ASC
-        """, (entry_id,)).fetchall()
-
-        result.append({
+async def get_conversations(request: Request, limit: int = Query(20, ge=1, le=ENTRIES_PAGE_MAX),
+                            cursor: Optional[str] = None, include_empty: bool = False,
+                            db: sqlite3.Connection = Depends(get_db)):
+    """
+    One page of entries, newest first: title, message count and a preview of the last message,
+    from a single query. Pass next_cursor back as ?cursor= for the next page; the messages
+    themselves come from /history?entry_id=.
+    """
+    where, params = [], []
+    if not include_empty:
+        where.append("c.title != 'empty_entry'")
+    if cursor:
+        # keyset on (timestamp, entry_id): the page costs the same however deep it is
+        where.append("(c.timestamp, c.entry_id) < (?, ?)")
+        params.extend(_decode_cursor(cursor))
+
+    rows = db.execute(f"""
+        SELECT c.entry_id, c.title, c.timestamp,
+               (SELECT COUNT(*) FROM Messages m WHERE m.entry_id = c.entry_id) AS message_count,
+               last.sender, substr(last.content, 1, {PREVIEW_CHARS})
+        FROM Conversations c
+        LEFT JOIN Messages last ON last.id = (
+            SELECT m.id FROM Messages m WHERE m.entry_id = c.entry_id
+            ORDER BY m.timestamp DESC, m.id DESC LIMIT 1)
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY c.timestamp DESC, c.entry_id DESC
+        LIMIT ?
+    """, (*params, limit + 1)).fetchall()
+
+    entries = []
+    for entry_id, title, ts, count, sender, preview in rows[:limit]:
+        entries.append({
             "entry_id": entry_id,
             "title": title,
             "timestamp": ts,
-            "messages": [
-                {"sender": sender, "content": content, "timestamp": msg_ts}
-                for sender, content, msg_ts in messages
-            ]
+            "message_count": count,
+            "last_message": {"sender": sender, "preview": preview} if sender else None,
         })
 
-    return result
+    next_cursor = None
+    if len(rows) > limit:
+        last_entry = entries[-1]
+        next_cursor = _encode_cursor(last_entry["timestamp"], last_entry["entry_id"])
+    return {"entries": entries, "next_cursor": next_cursor}
 
 
 @entries_router.delete("/entries/{entry_id}")
-async def delete_entry(entry_id: int, request: Request):
-    db: sqlite3.Connection = request.app.state.db
-    db.execute("PRAGMA foreign_keys = ON;")
+async def delete_entry(entry_id: int, request: Request, db: sqlite3.Connection = Depends(get_write_db)):
+    db.execute("PRAGMA foreign_keys = ON;")   # before the first write opens the transaction
     try:
-        db.execute("BEGIN")
-        # delete children 
+        # delete children (get_write_db commits them together, or rolls back on an error)
+        db.execute("DELETE FROM analysis_jobs       WHERE entry_id = ?", (entry_id,))
+        db.execute("DELETE FROM analysis_watermarks WHERE entry_id = ?", (entry_id,))
+        db.execute("DELETE FROM entry_summaries     WHERE entry_id = ?", (entry_id,))
         db.execute("DELETE FROM plutchik_dyads      WHERE entry_id = ?", (entry_id,))
         db.execute("DELETE FROM plutchik_events     WHERE entry_id = ?", (entry_id,))
         db.execute("DELETE FROM Metrics             WHERE entry_id = ?", (entry_id,))
@@ -229,13 +331,11 @@ async def delete_entry(entry_id: int, request: Request):
 
         # delete parent
         db.execute("DELETE FROM Conversations       WHERE entry_id = ?", (entry_id,))
-        db.commit()
+        request.app.state.chat_cache.forget(entry_id)
         return {"status": "ok", "deleted_entry_id": entry_id, "message": "Entry and associated data deleted."}
     except sqlite3.IntegrityError as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Foreign key integrity error: {e}")
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
     
     
@@ -244,8 +344,8 @@ class RenamePayload(BaseModel):
     new_title: str
 
 @chat_router.put("/entries/{entry_id}/rename")
-async def rename_chat_entry(entry_id: int, payload: RenamePayload, request: Request):
-    db: sqlite3.Connection = request.app.state.db
+async def rename_chat_entry(entry_id: int, payload: RenamePayload, request: Request,
+                            db: sqlite3.Connection = Depends(get_write_db)):
     new_title = payload.new_title.strip()
 
     if not new_title:
@@ -256,8 +356,6 @@ async def rename_chat_entry(entry_id: int, payload: RenamePayload, request: Requ
             "UPDATE Conversations SET title = ? WHERE entry_id = ?",
             (new_title, entry_id)
         )
-        db.commit()
         return JSONResponse({"status": "ok", "message": "Entry renamed successfully"})
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
\ No newline at end of file
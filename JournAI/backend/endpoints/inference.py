@@ -0,0 +1,70 @@
+import time
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+import telemetry
+
+from inference.prompts import PROMPTS
+
+inference_router = APIRouter()
+
+STARTED_AT = time.time()
+
+
+def require_llm(app, model: str = "chat"):
+    # models load in the background -> llm routes answer 503 until theirs is ready
+    loader = app.state.models.loader(model)
+    if loader.ready:
+        return loader.backend
+    if loader.state == "failed":
+        raise HTTPException(status_code=503, detail=f"LLM not available: {loader.error}")
+    raise HTTPException(status_code=503, detail=f"LLM {loader.state}", headers={"Retry-After": "5"})
+
+
+def analysis_runtime(app, names):
+    # -> (inference, {model name: llm}) for the analysis pipeline: the worker process pool
+    # when one is configured, otherwise the in-process scheduler and models
+    pool = getattr(app.state, "analysis_pool", None)
+    if pool is not None:
+        return pool, {name: pool.handle(name) for name in names}
+    return app.state.inference, {name: require_llm(app, name) for name in names}
+
+
+@inference_router.get("/inference/status")
+async def inference_status(request: Request):
+    # queue depth + wait times of the llm scheduler (+ the analysis worker pool if any)
+    status = request.app.state.inference.status()
+    status["prompts"] = PROMPTS.versions()
+    pool = getattr(request.app.state, "analysis_pool", None)
+    if pool is not None:
+        status["analysis_pool"] = pool.status()
+    status["db"] = request.app.state.database.status()
+    return status
+
+
+@inference_router.get("/metrics")
+async def metrics():
+    # prometheus text exposition: llm calls, analyzer sections, http requests, sqlite statements
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
+
+
+@inference_router.get("/healthz")
+async def healthz():
+    # liveness: the process is up and the event loop answers
+    return {"status": "ok", "uptime_s": round(time.time() - STARTED_AT, 1)}
+
+
+@inference_router.get("/readyz")
+async def readyz(request: Request):
+    # readiness: db reachable and every model loaded + warmed up
+    models = request.app.state.models
+    try:
+        with request.app.state.database.read() as db:
+            db.execute("SELECT 1").fetchone()
+        db_ok = True
+    except Exception:
+        db_ok = False
+    ready = db_ok and models.ready
+    return JSONResponse(status_code=200 if ready else 503,
+                        content={"ready": ready, "db": db_ok, "models": models.status()})
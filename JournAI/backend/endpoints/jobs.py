@@ -0,0 +1,253 @@
+#BACKGROUND ANALYSIS JOBS: submit -> job id right away, poll for per-analyzer progress
+from __future__ import annotations
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Literal, Optional
+
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+
+from db import Database, get_db, get_write_db
+from graphs.base import fetch_session_id
+from endpoints.inference import analysis_runtime
+from endpoints.sentiment_analysis import (
+    build_analyzers, plan_analysis, prepare_analysis_text, required_models, run_analyzers, save_analyzer_section,
+)
+
+logger = logging.getLogger("uvicorn.error")
+jobs_router = APIRouter()
+
+UNFINISHED = ("queued", "running")
+
+
+class JobBody(BaseModel):
+    entry_id: int = Field(..., ge=1)
+    mode: Literal["combined", "separate"] = "combined"
+    refresh: bool = False
+    incremental: bool = False   # only the messages added since each analyzer's last run
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ------------------------------------ worker ------------------------------------
+# the job holds the writer only for its short write blocks, never while the model runs
+
+async def _set_steps(database: Database, job_id: int, names: List[str], status: str) -> None:
+    async with database.write() as db:
+        db.executemany(
+            "UPDATE analysis_job_steps SET status = ?, started_at = ? WHERE job_id = ? AND analyzer = ?",
+            [(status, _now(), job_id, n) for n in names],
+        )
+
+
+def _finish_step(db: sqlite3.Connection, job_id: int, name: str, started: float, error: Optional[str] = None) -> None:
+    db.execute(
+        """
+        UPDATE analysis_job_steps
+        SET status = ?, finished_at = ?, duration_ms = ?, error = ?
+        WHERE job_id = ? AND analyzer = ?
+        """,
+        ("failed" if error else "done", _now(), round((time.perf_counter() - started) * 1000, 1), error, job_id, name),
+    )
+
+
+async def _save_step(database: Database, job_id: int, analyzer: Any, section: Any,
+                     session_id: int, entry_id: int, started: float,
+                     upto_id: Optional[int] = None, merge: bool = False) -> None:
+    # every analyzer commits on its own -> finished sections survive a later failure/restart
+    try:
+        async with database.write() as db:
+            save_analyzer_section(db, analyzer, section, session_id, entry_id, upto_id=upto_id, merge=merge)
+            _finish_step(db, job_id, analyzer.name, started)
+    except Exception as e:
+        logger.warning("[jobs] job %s analyzer %s failed: %s", job_id, analyzer.name, e)
+        async with database.write() as db:
+            _finish_step(db, job_id, analyzer.name, started, error=str(e))
+
+
+async def _run_job(app: FastAPI, job_id: int) -> None:
+    database: Database = app.state.database
+    with database.read() as db:
+        entry_id, mode, refresh, incremental = db.execute(
+            "SELECT entry_id, mode, refresh, incremental FROM analysis_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        done = {r[0] for r in db.execute(
+            "SELECT analyzer FROM analysis_job_steps WHERE job_id = ? AND status = 'done'", (job_id,)
+        )}
+
+    async with database.write() as db:
+        db.execute("UPDATE analysis_jobs SET status = 'running', started_at = COALESCE(started_at, ?) WHERE id = ?",
+                   (_now(), job_id))
+
+    try:
+        with database.read() as db:
+            session_id = fetch_session_id(db, entry_id)
+            todo = [a for a in build_analyzers() if a.name not in done]
+            # a resumed job continues incrementally: steps committed before the restart moved their watermark
+            upto_id, plan = plan_analysis(db, entry_id, todo, incremental=bool(incremental))
+        # jobs resumed at startup wait here for the background model load
+        for name in required_models(todo):
+            if getattr(app.state, "analysis_pool", None) is None and await app.state.models.wait(name) is None:
+                raise RuntimeError(f"LLM not available: {app.state.models.loader(name).error}")
+        inference, models = analysis_runtime(app, required_models(todo))
+
+        planned = {a.name for _, group in plan for a in group}
+        for a in todo:
+            if a.name not in planned:   # already up to date
+                await _set_steps(database, job_id, [a.name], "running")
+                async with database.write() as db:
+                    _finish_step(db, job_id, a.name, time.perf_counter())
+
+        for after_id, group in plan:
+            with database.read() as db:
+                text = prepare_analysis_text(db, entry_id, after_id=after_id, upto_id=upto_id)
+            merge = after_id is not None
+            if mode == "combined":
+                await _set_steps(database, job_id, [a.name for a in group], "running")
+                started = time.perf_counter()
+                merged = await run_analyzers(inference, models, text, group, mode="combined",
+                                             database=database, refresh=bool(refresh))
+                for a in group:
+                    await _save_step(database, job_id, a, merged.get(a.name), session_id, entry_id, started,
+                                     upto_id=upto_id, merge=merge)
+            else:
+                for a in group:
+                    await _set_steps(database, job_id, [a.name], "running")
+                    started = time.perf_counter()
+                    merged = await run_analyzers(inference, models, text, [a], mode="separate",
+                                                 database=database, refresh=bool(refresh))
+                    await _save_step(database, job_id, a, merged.get(a.name), session_id, entry_id, started,
+                                     upto_id=upto_id, merge=merge)
+
+        async with database.write() as db:
+            failed = db.execute(
+                "SELECT COUNT(*) FROM analysis_job_steps WHERE job_id = ? AND status = 'failed'", (job_id,)
+            ).fetchone()[0]
+            db.execute("UPDATE analysis_jobs SET status = ?, finished_at = ? WHERE id = ?",
+                       ("failed" if failed else "done", _now(), job_id))
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e)
+        logger.exception("[jobs] job %s failed", job_id)
+        async with database.write() as db:
+            db.execute("UPDATE analysis_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                       (detail, _now(), job_id))
+
+
+def _spawn(app: FastAPI, job_id: int) -> None:
+    tasks = getattr(app.state, "job_tasks", None)
+    if tasks is None:
+        tasks = app.state.job_tasks = set()
+    task = asyncio.create_task(_run_job(app, job_id))
+    tasks.add(task)   # keep a reference until it finishes
+    task.add_done_callback(tasks.discard)
+
+
+def resume_unfinished_jobs(app: FastAPI) -> None:
+    # jobs cut off by a restart continue where they stopped (done steps are skipped)
+    with app.state.database.read() as db:
+        rows = db.execute(
+            f"SELECT id FROM analysis_jobs WHERE status IN ({','.join('?' * len(UNFINISHED))}) ORDER BY id",
+            UNFINISHED,
+        ).fetchall()
+    for (job_id,) in rows:
+        logger.info("[jobs] resuming job %s", job_id)
+        _spawn(app, job_id)
+
+
+# ------------------------------------ endpoints ------------------------------------
+
+def _job_json(db: sqlite3.Connection, job_id: int) -> Optional[Dict[str, Any]]:
+    row = db.execute(
+        """
+        SELECT id, entry_id, status, mode, error, created_at, started_at, finished_at
+        FROM analysis_jobs WHERE id = ?
+        """,
+        (job_id,),
+    ).fetchone()
+    if not row:
+        return None
+    steps = db.execute(
+        """
+        SELECT analyzer, status, started_at, finished_at, duration_ms, error
+        FROM analysis_job_steps WHERE job_id = ? ORDER BY position ASC
+        """,
+        (job_id,),
+    ).fetchall()
+    return {
+        "job_id": row[0],
+        "entry_id": row[1],
+        "status": row[2],
+        "mode": row[3],
+        "error": row[4],
+        "created_at": row[5],
+        "started_at": row[6],
+        "finished_at": row[7],
+        "progress": {"done": sum(1 for s in steps if s[1] == "done"), "total": len(steps)},
+        "steps": [{
+            "analyzer": s[0],
+            "status": s[1],
+            "started_at": s[2],
+            "finished_at": s[3],
+            "duration_ms": s[4],
+            "error": s[5],
+        } for s in steps],
+    }
+
+
+@jobs_router.post("/analysis-jobs", status_code=202)
+async def submit_analysis_job(request: Request, body: JobBody, db: sqlite3.Connection = Depends(get_write_db)):
+    fetch_session_id(db, body.entry_id)   # 404 for unknown entries
+
+    # double clicks / retries join the job that is already running for this entry
+    row = db.execute(
+        f"""
+        SELECT id FROM analysis_jobs
+        WHERE entry_id = ? AND status IN ({','.join('?' * len(UNFINISHED))})
+        ORDER BY id DESC LIMIT 1
+        """,
+        (body.entry_id, *UNFINISHED),
+    ).fetchone()
+    if row:
+        return JSONResponse(_job_json(db, row[0]), status_code=202)
+
+    cur = db.execute(
+        "INSERT INTO analysis_jobs (entry_id, mode, refresh, incremental, created_at) VALUES (?, ?, ?, ?, ?)",
+        (body.entry_id, body.mode, int(body.refresh), int(body.incremental), _now()),
+    )
+    job_id = cur.lastrowid
+    db.executemany(
+        "INSERT INTO analysis_job_steps (job_id, analyzer, position) VALUES (?, ?, ?)",
+        [(job_id, a.name, i) for i, a in enumerate(build_analyzers())],
+    )
+    db.commit()   # before the job task starts reading it
+
+    _spawn(request.app, job_id)
+    return JSONResponse(_job_json(db, job_id), status_code=202)
+
+
+@jobs_router.get("/analysis-jobs/{job_id}")
+async def get_analysis_job(request: Request, job_id: int, db: sqlite3.Connection = Depends(get_db)):
+    job = _job_json(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return JSONResponse(job)
+
+
+@jobs_router.get("/analysis-jobs")
+async def list_analysis_jobs(
+    request: Request,
+    entry_id: Optional[int] = Query(default=None),
+    limit: int = Query(default=20, ge=1, le=200),
+    db: sqlite3.Connection = Depends(get_db),
+):
+    if entry_id is not None:
+        rows = db.execute("SELECT id FROM analysis_jobs WHERE entry_id = ? ORDER BY id DESC LIMIT ?",
+                          (entry_id, limit)).fetchall()
+    else:
+        rows = db.execute("SELECT id FROM analysis_jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return JSONResponse([_job_json(db, r[0]) for r in rows])
@@ -1,17 +1,18 @@
 import logging
 import sqlite3
-from fastapi import Query, APIRouter, Request
+from fastapi import Depends, HTTPException, Query, APIRouter, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 import datetime as dt
 from datetime import datetime
 from collections import defaultdict
 from typing import Literal, Optional, List
-import re
 from datetime import datetime, date, timedelta
 from itertools import combinations
 
 
+from db import get_db, get_write_db
+from graphs.activity_registry import ACTIVITIES, normalize_activity
 from graphs.base import  _range_from_view
 from graphs.plutchik import canonical_sub, level_from_intensity, DYAD_NAME
 
@@ -28,39 +29,9 @@ class MetricForm(BaseModel):
 
 
 
-def _normalize_activity(name: str) -> str:
-    s = (name or "").strip().lower()
-    s = re.sub(r"\s+", " ", s)
-    return s
-
-def _resolve_activity_id(db: sqlite3.Connection, raw_name: str) -> int:
-    """
-    Resolve 'raw_name' to a canonical Activities.id.
-    - If it exists and is an alias, follow alias_of chain to canonical.
-    - If not found, create a new *canonical* row (alias_of=NULL).
-    """
-    norm = _normalize_activity(raw_name)
-    row = db.execute(
-        "SELECT id, alias_of FROM Activities WHERE lower(name) = ?",
-        (norm,)
-    ).fetchone()
-
-    if row:
-        act_id, alias_of = row
-        while alias_of is not None:
-            act_id, alias_of = db.execute(
-                "SELECT id, alias_of FROM Activities WHERE id = ?",
-                (alias_of,)
-            ).fetchone()
-        return act_id
-
-    cur = db.execute("INSERT INTO Activities (name, alias_of) VALUES (?, NULL)", (norm,))
-    return cur.lastrowid
-
 #------------------------------------endpoint--------------------------------
 @metrics_router.post("/submit-metric")
-async def submit_metric(data: MetricForm, request: Request):
-    db = request.app.state.db
+async def submit_metric(data: MetricForm, request: Request, db: sqlite3.Connection = Depends(get_write_db)):
     db.execute("PRAGMA foreign_keys = ON;")
 
     if not (1 <= data.rating <= 10):
@@ -71,7 +42,7 @@ async def submit_metric(data: MetricForm, request: Request):
 
     if data.tag == "activity":
         # resolve canonical id (creates if missing; respects aliases)
-        activity_id = _resolve_activity_id(db, data.description)
+        activity_id = ACTIVITIES.resolve_one(db, data.description)
 
         db.execute("""
             INSERT INTO Metrics (session_id, entry_id, metric_type, activity_id, description, rating, comment, source)
@@ -90,8 +61,6 @@ async def submit_metric(data: MetricForm, request: Request):
             VALUES (?, ?, ?, ?, ?, ?,'user')
         """, (session_id, entry_id, data.tag, data.description, data.rating, data.comment))
 
-    db.commit()
-
     return {"status": "ok", "entry_id": entry_id}
 
 
@@ -108,8 +77,8 @@ async def get_activity_histogram(
     view: Optional[Literal["day","week","month"]] = Query(default="week"),
     entry_id: Optional[int] = Query(default=None),
     session_id: Optional[int] = Query(default=None),
+    db: sqlite3.Connection = Depends(get_db),
 ):
-    db = request.app.state.db
     start, end = _range_from_view(view)
 
     base = """
@@ -122,6 +91,12 @@ async def get_activity_histogram(
         JOIN Activities a ON m.activity_id = a.id
         WHERE m.metric_type = 'activity'
     """
+    # date views read the daily rollup (rollups.py), one row per day and activity
+    rollup = """
+        SELECT r.day, a.name, r.n, CASE WHEN r.rated_n > 0 THEN r.rating_sum / r.rated_n END
+        FROM activity_daily r
+        JOIN Activities a ON r.activity_id = a.id
+    """
     params: list = []
 
     #priority: entry-> session-> date-range-> all
@@ -132,10 +107,10 @@ async def get_activity_histogram(
         q = base + " AND m.session_id = ? GROUP BY day, name ORDER BY day ASC"
         params = [session_id]
     elif start and end:
-        q = base + " AND m.timestamp >= ? AND m.timestamp < ? GROUP BY day, name ORDER BY day ASC"
-        params = [start, end]
+        q = rollup + " WHERE r.day >= ? AND r.day < ? ORDER BY r.day ASC"
+        params = [start[:10], end[:10]]
     else:
-        q = base + " GROUP BY day, name ORDER BY day ASC"
+        q = rollup + " ORDER BY r.day ASC"
 
     rows = db.execute(q, params).fetchall()
 
@@ -157,22 +132,16 @@ async def get_activity_histogram(
 
 
 @metrics_router.get("/metrics/mood-histogram")
-async def get_mood_histogram(request: Request):
-    db = request.app.state.db
+async def get_mood_histogram(request: Request, db: sqlite3.Connection = Depends(get_db)):
 
+    # all time, from the daily rollup: days x activities rather than every metric row
     query = """
-    SELECT 
-        date(m.timestamp) as day,
-        a.name as activity_name,
-        COUNT(*) as count,
-        AVG(m.rating) as avg_rating
-    FROM Metrics m
-    JOIN Activities a ON m.activity_id = a.id
-    WHERE m.metric_type = 'activity' AND m.rating IS NOT NULL
-    GROUP BY day, activity_name
-    ORDER BY day ASC, avg_rating DESC
+    SELECT r.day, a.name, r.rated_n, r.rating_sum / r.rated_n AS avg_rating
+    FROM activity_daily r
+    JOIN Activities a ON r.activity_id = a.id
+    ORDER BY r.day ASC, avg_rating DESC
     """
-    rows = db.execute(query).fetchall()
+    rows = [row for row in db.execute(query).fetchall() if row[2] > 0]
 
     grouped_by_day = defaultdict(list)
     all_dates = set()
@@ -220,66 +189,26 @@ class MergeActivitiesBody(BaseModel):
     target: str        = Field(..., description="Canonical label to use (e.g., 'gaming')")
 
 @metrics_router.post("/metrics/activities/merge")
-async def merge_activities(body: MergeActivitiesBody, request: Request):
-    db: sqlite3.Connection = request.app.state.db
+async def merge_activities(body: MergeActivitiesBody, request: Request,
+                           db: sqlite3.Connection = Depends(get_write_db)):
     sources = [s.strip() for s in body.sources if s and s.strip()]
     target  = (body.target or "").strip()
     if not sources or not target:
         return {"error": "sources and target are required"}
 
-    norm_sources = [_normalize_activity(s) for s in sources]
-    norm_target  = _normalize_activity(target)
-
     try:
-        db.execute("BEGIN")
-
-        # ensure target exists & is canonical
-        row = db.execute(
-            "SELECT id, alias_of FROM Activities WHERE lower(name) = ?",
-            (norm_target,)
-        ).fetchone()
-
-        if row:
-            target_id, alias_of = row
-            if alias_of is not None:
-                db.execute("UPDATE Activities SET alias_of = NULL WHERE id = ?", (target_id,))
-        else:
-            cur = db.execute("INSERT INTO Activities (name, alias_of) VALUES (?, NULL)", (norm_target,))
-            target_id = cur.lastrowid
-
-        # alias each source to target + collect ids for repointing them
-        src_ids = []
-        for src in norm_sources:
-            srow = db.execute("SELECT id, alias_of FROM Activities WHERE lower(name) = ?", (src,)).fetchone()
-            if srow:
-                sid, _ = srow
-            else:
-                cur = db.execute("INSERT INTO Activities (name, alias_of) VALUES (?, ?)", (src, target_id))
-                sid = cur.lastrowid
-
-            if sid != target_id:
-                db.execute("UPDATE Activities SET alias_of = ? WHERE id = ?", (target_id, sid))
-                src_ids.append(sid)
-
-        # repoint historical metrics to the target canonical id
-        if src_ids:
-            qmarks = ",".join("?" for _ in src_ids)
-            db.execute(
-                f"UPDATE Metrics SET activity_id = ? WHERE activity_id IN ({qmarks})",
-                (target_id, *src_ids)
-            )
-
-        db.commit()
+        # aliases are re-pointed straight at the target, so lookups never walk a chain
+        target_id, src_ids = ACTIVITIES.merge(db, sources, target)
         return {
             "status": "ok",
             "target_id": target_id,
-            "canonical": norm_target,
+            "canonical": normalize_activity(target),
             "aliased_count": len(src_ids)
         }
 
     except Exception as e:
-        db.rollback()
-        return {"error": f"merge failed: {e}"}
+        ACTIVITIES.invalidate()
+        raise HTTPException(status_code=500, detail=f"merge failed: {e}")
     
 
 
@@ -303,19 +232,18 @@ class ManualPlutchikBody(BaseModel):
 # ------------------------------------------------------------------------------
 
 @metrics_router.post("/manual/plutchik")
-async def manual_plutchik(request: Request, body: ManualPlutchikBody):
-    db: sqlite3.Connection = request.app.state.db
+async def manual_plutchik(request: Request, body: ManualPlutchikBody,
+                          db: sqlite3.Connection = Depends(get_write_db)):
     session_id = request.app.state.journal.get_or_create_session_id(db)
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     try:
-        db.execute("BEGIN")
-        inserted = 0
-
         # ts -> primary -> {id, intensity}
         events_by_ts: dict[str, dict[str, dict]] = defaultdict(dict)
 
-        # 1) insert events
+        # 1) insert events in one executemany, then read their ids back (the writer is ours,
+        # so the new rows are exactly the ones above the previous max id)
+        rows = []
         for emo in body.emotions:
             primary_raw = (emo.primary_emotion or "").strip().lower()
             if not primary_raw:
@@ -327,23 +255,29 @@ async def manual_plutchik(request: Request, body: ManualPlutchikBody):
 
             #per emotion timestamps in payload, else use 'now'
             ts = getattr(emo, "timestamp", None) or now
-
-            cur = db.execute(
-                """
-                INSERT INTO plutchik_events
-                    (entry_id, session_id, source, primary_emotion, level, intensity, sub_label, confidence, timestamp)
-                VALUES (NULL, ?, 'user', ?, ?, ?, ?, NULL, ?)
-                """,
-                (session_id, primary_raw, level, intensity, sub, ts),
-            )
-            eid = cur.lastrowid
+            rows.append((session_id, primary_raw, level, intensity, sub, ts))
+
+        before = db.execute("SELECT COALESCE(MAX(id), 0) FROM plutchik_events").fetchone()[0]
+        db.executemany(
+            """
+            INSERT INTO plutchik_events
+                (entry_id, session_id, source, primary_emotion, level, intensity, sub_label, confidence, timestamp)
+            VALUES (NULL, ?, 'user', ?, ?, ?, ?, NULL, ?)
+            """,
+            rows,
+        )
+        for eid, primary_raw, intensity, ts in db.execute(
+            "SELECT id, primary_emotion, intensity, timestamp FROM plutchik_events WHERE id > ? ORDER BY id",
+            (before,),
+        ):
             events_by_ts[ts][primary_raw] = {"id": eid, "intensity": intensity}
-            inserted += 1
+        inserted = len(rows)
 
         logger.info("[manual_plutchik] inserted %d events; timestamps: %s",
                     inserted, list(events_by_ts.keys()))
 
         # 2)build dyads within each timestamp group 
+        dyads = []
         for ts, prim_map in events_by_ts.items():
             primaries = list(prim_map.keys())
             logger.info("[manual_plutchik] TS=%s primaries=%s", ts, primaries)
@@ -367,26 +301,25 @@ async def manual_plutchik(request: Request, body: ManualPlutchikBody):
                 ev1, ev2 = (eid_a, eid_b) if eid_a < eid_b else (eid_b, eid_a)
                 weight = (ia + ib) / 2.0
 
-                db.execute(
-                    """
-                    INSERT INTO plutchik_dyads
-                        (entry_id, session_id, source, event_a_id, event_b_id, dyad_label, weight, confidence, timestamp)
-                    VALUES (NULL, ?, 'user', ?, ?, ?, ?, NULL, ?)
-                    ON CONFLICT(entry_id, source, event_a_id, event_b_id) DO UPDATE SET
-                        dyad_label = excluded.dyad_label,
-                        weight     = excluded.weight,
-                        confidence = excluded.confidence,
-                        timestamp  = excluded.timestamp
-                    """,
-                    (session_id, ev1, ev2, label, weight, ts),
-                )
-                logger.info("[manual_plutchik]  INSERT dyad=%s ev1=%s ev2=%s ts=%s weight=%.2f",
+                dyads.append((session_id, ev1, ev2, label, weight, ts))
+                logger.info("[manual_plutchik]  dyad=%s ev1=%s ev2=%s ts=%s weight=%.2f",
                             label, ev1, ev2, ts, weight)
 
-        db.commit()
+        db.executemany(
+            """
+            INSERT INTO plutchik_dyads
+                (entry_id, session_id, source, event_a_id, event_b_id, dyad_label, weight, confidence, timestamp)
+            VALUES (NULL, ?, 'user', ?, ?, ?, ?, NULL, ?)
+            ON CONFLICT(entry_id, source, event_a_id, event_b_id) DO UPDATE SET
+                dyad_label = excluded.dyad_label,
+                weight     = excluded.weight,
+                confidence = excluded.confidence,
+                timestamp  = excluded.timestamp
+            """,
+            dyads,
+        )
         return {"status": "ok", "inserted_events": inserted}
 
     except Exception as e:
-        db.rollback()
         logger.exception("manual plutchik failed")
-        return {"error": f"manual plutchik failed: {e}"}
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"manual plutchik failed: {e}")
\ No newline at end of file
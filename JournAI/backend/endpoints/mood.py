@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Request, HTTPException
+import sqlite3
+from fastapi import APIRouter, Depends, Request, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
 
+from db import get_write_db
+
 mood_router = APIRouter()
 
 class MoodLog(BaseModel):
@@ -11,11 +14,10 @@ class MoodLog(BaseModel):
     entry_id: Optional[int] = None #optional unless messages are associated
 
 @mood_router.post("/mood")
-async def submit_mood(log: MoodLog, request: Request):
+async def submit_mood(log: MoodLog, request: Request, db: sqlite3.Connection = Depends(get_write_db)):
     #phq = [v for v in log.phq4_answers if v is not None]
     #feelings = [v for v in log.state_feelings if v is not None]
 
-    db = request.app.state.db
     session_id = request.app.state.journal.get_or_create_session_id(db)
     entry_id = log.entry_id if log.entry_id else None
     
@@ -36,27 +38,22 @@ async def submit_mood(log: MoodLog, request: Request):
         "f7": "Lonely"
     }
 
+    rows = []
     for i, value in enumerate(log.phq4_answers):
         if value is not None:
             qid = f"q{i+1}"
-            db.execute(
-                "INSERT INTO Metrics (session_id, entry_id, metric_type, description, comment, rating) VALUES (?, ?, ?, ?, ?, ?)",
-                (session_id, entry_id, "quiz", qid, phq_comments.get(qid, ""), value)
-            )
+            rows.append((session_id, entry_id, "quiz", qid, phq_comments.get(qid, ""), value))
 
     for i, value in enumerate(log.state_feelings):
         if value is not None:
             fid = f"f{i+1}"
-            db.execute(
-                "INSERT INTO Metrics (session_id, entry_id, metric_type, description, comment, rating) VALUES (?, ?, ?, ?, ?, ?)",
-                (session_id, entry_id, "quiz", fid, feelings_comments.get(fid, ""), value)
-            )
+            rows.append((session_id, entry_id, "quiz", fid, feelings_comments.get(fid, ""), value))
 
     if log.note:
-        db.execute(
-            "INSERT INTO Metrics (session_id, entry_id, metric_type, description, comment, rating) VALUES (?, ?, ?, ?, ?, ?)",
-            (session_id, entry_id, "quiz", "note", log.note, None)
-        )
+        rows.append((session_id, entry_id, "quiz", "note", log.note, None))
 
-    db.commit()
+    db.executemany(
+        "INSERT INTO Metrics (session_id, entry_id, metric_type, description, comment, rating) VALUES (?, ?, ?, ?, ?, ?)",
+        rows
+    )
     return {"message": "Mood log saved"}
@@ -1,21 +1,21 @@
-from fastapi import APIRouter, Request
+import sqlite3
+from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
 
+from db import get_db, get_write_db
+
 notes_router = APIRouter()
 
 class NoteData(BaseModel):
     content: str
 
 @notes_router.get("/note")
-async def get_note(request: Request):
-    db = request.app.state.db
+async def get_note(request: Request, db: sqlite3.Connection = Depends(get_db)):
     cursor = db.execute("SELECT content FROM Notes WHERE id = 1")
     row = cursor.fetchone()
     return {"content": row[0]} if row else {"content": ""}
 
 @notes_router.post("/note")
-async def save_note(data: NoteData, request: Request):
-    db = request.app.state.db
+async def save_note(data: NoteData, request: Request, db: sqlite3.Connection = Depends(get_write_db)):
     db.execute("REPLACE INTO Notes (id, content) VALUES (1, ?)", (data.content,))
-    db.commit()
     return {"status": "saved"}
\ No newline at end of file
@@ -1,19 +1,33 @@
 # analysis_optimized.py
 from __future__ import annotations
+import asyncio
+import copy
 import json
 import logging
+import re
 import sqlite3
-from typing import Any, List, Dict, Optional, Literal
+from typing import Any, List, Dict, Optional, Literal, Tuple
 
-from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi import APIRouter, Depends, Request, HTTPException, Query
 from fastapi.responses import JSONResponse
 
+import telemetry
+
 from graphs.valence_arousal import ValenceArousalAnalysis
 from graphs.spider import SpiderAnalysis
 from graphs.plutchik import PlutchikAnalysis
 from graphs.activity import ActivityAnalysis
 from graphs.themeriver import ThemeriverAnalysis
-from graphs.base import fetch_user_text, fetch_session_id, _range_from_view
+from graphs.base import (
+    fetch_user_text, fetch_session_id, _range_from_view,
+    fetch_last_user_message_id, fetch_watermarks, set_watermark,
+)
+from db import Database, get_db
+from graphs.cache import analysis_cache_key, cache_get, cache_put
+from inference.scheduler import PRIORITY_ANALYSIS
+from inference.grammar import grammar_kwargs, combined_schema
+from inference.prompts import PROMPTS
+from endpoints.inference import analysis_runtime
 
 analysis_router = APIRouter()
 logger = logging.getLogger("uvicorn.error")
@@ -72,15 +86,15 @@ def _extract_all_parsable_json(s: str, prefer_last: bool = True) -> List[Any]:
         except Exception: pass
     return out
 
+def _loads_or_none(s: str) -> Any:
+    # grammar constrained output is plain JSON -> one json.loads, no chunk scanning
+    try: return json.loads(s)
+    except Exception: return None
+
 def _shape_wants_array(shape: Any) -> bool:
     if isinstance(shape, str): return shape.lstrip().startswith("[")
     return isinstance(shape, (list, tuple))
 
-def _shape_to_text(shape: Any) -> str:
-    if isinstance(shape, str): return shape.strip()
-    try: return json.dumps(shape, ensure_ascii=False, indent=2)
-    except Exception: return str(shape)
-
 def _unwrap_if_wrapped(parsed: Any, *keys: str):
     if isinstance(parsed, dict):
         for k in keys:
@@ -118,24 +132,59 @@ def _normalize_themeriver_rows(obj: Any) -> List[dict]:
 
 # -----------------------  LLM runner -----------------------
 
-def _run_single_analyzer(llm, text: str, a: Any) -> Any:
+def _empty_fragment(a: Any) -> Any:
+    try: return [] if _shape_wants_array(a.json_shape()) else {}
+    except Exception: return {}
+
+# editing any of these prompt files invalidates the analysis cache
+ANALYSIS_TEMPLATES = ("analysis_section", "analysis_single", "analysis_combined")
+
+def _cache_version(a: Any, llm: Any) -> str:
+    # a section is only reusable for the same prompt answered by the same weights
+    return f"{PROMPTS.version(*ANALYSIS_TEMPLATES)}:{a.prompt_version()}:{getattr(llm, 'model_id', '')}"
+
+async def _run_single_analyzer(inference, llm, text: str, a: Any,
+                               database: Optional[Database] = None, refresh: bool = False) -> Any:
+    # with a database, unchanged text is answered from the analysis cache instead of the model
+    if database is None:
+        return await _generate_single_section(inference, llm, text, a)
+
+    version = _cache_version(a, llm)
+    key = analysis_cache_key(text, a.name, version)
+    if not refresh:
+        with database.read() as db:
+            hit = cache_get(db, key)
+        if hit is not None:
+            logger.info("[analysis] cache hit for '%s'", a.name)
+            telemetry.observe_section(a.name, "cache_hit")
+            return hit
+
+    section = await _generate_single_section(inference, llm, text, a)
+    # empty fragments are also what a failed parse returns -> never cache those
+    if section != _empty_fragment(a) and _section_parses(a, section):
+        async with database.write() as db:
+            cache_put(db, key, a.name, version, section)
+    return section
+
+async def _generate_single_section(inference, llm, text: str, a: Any) -> Any:
     shape_raw = (a.json_shape() or "")
     wants_array = _shape_wants_array(shape_raw)
     empty_fragment = [] if wants_array else {}
-    prompt = (
-        "Respond ONLY in JSON. No prose. No comments.\n\n"
-        f'Key "{a.name}"\n'
-        f"Instructions:\n{(a.instructions() or '').strip()}\n\n"
-        f'JSON schema for "{a.name}":\n{_shape_to_text(shape_raw)}\n\n'
-        "If you cannot infer anything, return an empty array [] or empty object {} matching the shape.\n\n"
-        "<<<BEGIN_OF_JOURNAL_ENTRY>>>\n"
-        f"{text}\n"
-        "<<<END_OF_JOURNAL_ENTRY>>>\n"
-    )
+    prompt = a.build_prompt(text)
 
-    resp = llm(prompt, max_tokens=500, temperature=0.0, top_p=1.0)
+    # schema -> grammar: the model can only emit matching JSON and stops when it closes
+    constrained = grammar_kwargs(a.json_schema())
+    resp = await inference.complete(llm, prompt, priority=PRIORITY_ANALYSIS, tag=f"analysis:{a.name}",
+                                    max_tokens=500, temperature=0.0, top_p=1.0,
+                                    stop_at_json="[" if wants_array else "{", **constrained)
     raw = _extract_llm_text(resp)
 
+    if constrained:
+        parsed = _loads_or_none(raw)
+        if parsed is not None:
+            telemetry.observe_section(a.name, "json")
+            return parsed
+
     if wants_array:
         rows: List[dict] = []
         for f in _extract_all_parsable_json(raw, prefer_last=True):
@@ -145,14 +194,121 @@ def _run_single_analyzer(llm, text: str, a: Any) -> Any:
                 rows += [x for x in frag if isinstance(x, dict)]
             elif isinstance(frag, dict):
                 rows.append(frag)
+        telemetry.observe_section(a.name, "recovered" if rows else "failed")
         return rows
 
     json_str = _extract_parsable_json(raw, prefer_last=True)
-    if not json_str: return empty_fragment
     try:
-        return json.loads(json_str)
+        section = json.loads(json_str) if json_str else empty_fragment
     except Exception:
-        return empty_fragment
+        section = empty_fragment
+    telemetry.observe_section(a.name, "recovered" if section else "failed")
+    return section
+
+# -----------------------  combined (single pass) runner -----------------------
+
+COMBINED_MAX_TOKENS = 1500
+
+def _shape_wrapper_key(shape: Any) -> Optional[str]:
+    # '{ "activities": [ ... ] }' -> 'activities' (shapes that wrap one list under one key)
+    m = re.match(r'\s*\{\s*"(\w+)"\s*:\s*\[', shape) if isinstance(shape, str) else None
+    return m.group(1) if m else None
+
+def _pick_combined_object(raw: str, names: List[str]) -> Dict[str, Any]:
+    # the model may echo fragments; keep the parsed object that covers the most sections
+    best: Dict[str, Any] = {}
+    for obj in _extract_all_parsable_json(raw, prefer_last=True):
+        if isinstance(obj, dict) and sum(n in obj for n in names) > sum(n in best for n in names):
+            best = obj
+    return best
+
+def _coerce_combined_section(a: Any, section: Any) -> Any:
+    # align a section from the combined answer with what the per-analyzer runner returns
+    shape_raw = a.json_shape() or ""
+    if _shape_wants_array(shape_raw):
+        section = _unwrap_if_wrapped(section, a.name, "items", "data", "rows", "values")
+        if isinstance(section, dict): section = [section]
+        return [x for x in section if isinstance(x, dict)] if isinstance(section, list) else None
+    key = _shape_wrapper_key(shape_raw)
+    if key and isinstance(section, list):
+        section = {key: section}
+    return section if isinstance(section, dict) else None
+
+def _section_parses(a: Any, section: Any) -> bool:
+    try:
+        if str(a.name).lower() == "themeriver":
+            section = _normalize_themeriver_rows(section)
+        a.parse_output(copy.deepcopy(section))
+        return True
+    except Exception:
+        return False
+
+async def _run_combined_analyzers(inference, llm, text: str, analyzers: List[Any],
+                                  database: Optional[Database] = None, refresh: bool = False) -> Dict[str, Any]:
+    """
+    One generation for all analyzers: the journal text is sent (and prompt-evaluated) once,
+    the answer is split by analyzer name. Sections that are missing or fail to parse are
+    re-run through _run_single_analyzer. Sections found in the analysis cache are skipped.
+    """
+    merged: Dict[str, Any] = {}
+    if database is not None and not refresh:
+        with database.read() as db:
+            for a in analyzers:
+                hit = cache_get(db, analysis_cache_key(text, a.name, _cache_version(a, llm)))
+                if hit is not None:
+                    merged[a.name] = hit
+                    telemetry.observe_section(a.name, "cache_hit")
+        analyzers = [a for a in analyzers if a.name not in merged]
+        if merged:
+            logger.info("[analysis] cache hits for %s", list(merged))
+    if len(analyzers) <= 1:
+        for a in analyzers:
+            try:
+                merged[a.name] = await _run_single_analyzer(inference, llm, text, a, database=database, refresh=refresh)
+            except Exception:
+                # like the other paths: an empty section for this analyzer, not a failed request
+                logger.exception("[analysis] '%s' failed", a.name)
+                telemetry.observe_section(a.name, "failed")
+                merged[a.name] = _empty_fragment(a)
+        return merged
+
+    names = [a.name for a in analyzers]
+    prompt = PROMPTS.render(
+        "analysis_combined",
+        keys=", ".join(f'"{n}"' for n in names),
+        sections="\n\n".join(a.section_prompt() for a in analyzers),
+        text=text,
+    )
+
+    constrained = grammar_kwargs(combined_schema({a.name: a.json_schema() for a in analyzers}))
+    combined: Dict[str, Any] = {}
+    try:
+        resp = await inference.complete(llm, prompt, priority=PRIORITY_ANALYSIS, tag="analysis:combined",
+                                        max_tokens=COMBINED_MAX_TOKENS, temperature=0.0, top_p=1.0,
+                                        stop_at_json="{", **constrained)
+        raw = _extract_llm_text(resp)
+        parsed = _loads_or_none(raw) if constrained else None
+        combined = parsed if isinstance(parsed, dict) else _pick_combined_object(raw, names)
+    except Exception:
+        logger.exception("combined analysis call failed, falling back to per-analyzer calls")
+
+    for a in analyzers:
+        section = _coerce_combined_section(a, combined.get(a.name)) if a.name in combined else None
+        if section is not None and _section_parses(a, section):
+            merged[a.name] = section
+            telemetry.observe_section(a.name, "combined")
+            if database is not None:
+                version = _cache_version(a, llm)
+                async with database.write() as db:
+                    cache_put(db, analysis_cache_key(text, a.name, version), a.name, version, section)
+            continue
+        logger.info("[analysis] section '%s' missing/unparsable in combined output -> single run", a.name)
+        telemetry.observe_section(a.name, "fallback")
+        try:
+            merged[a.name] = await _run_single_analyzer(inference, llm, text, a, database=database, refresh=True)
+        except Exception:
+            merged[a.name] = _empty_fragment(a)
+    return merged
 
 # ---------------------- GET endpoints ----------------------
 
@@ -162,22 +318,29 @@ async def get_va_results(
     view: Optional[Literal["day","week","month"]] = Query(default="day"),
     entry_id: Optional[int] = Query(default=None),
     session_id: Optional[int] = Query(default=None),
-
+    db: sqlite3.Connection = Depends(get_db),
 ):
-    db: sqlite3.Connection = request.app.state.db
     start, end = _range_from_view(view)
     data = ValenceArousalAnalysis.get_results(db, start=start, end=end, entry_id=entry_id, session_id=session_id)
     return JSONResponse(data)
 
+@analysis_router.get("/va-daily")
+async def get_va_daily(
+    request: Request,
+    view: Optional[Literal["day","week","month"]] = Query(default="month"),
+    db: sqlite3.Connection = Depends(get_db),
+):
+    start, end = _range_from_view(view)
+    return JSONResponse(ValenceArousalAnalysis.get_daily(db, start=start, end=end))
+
 @analysis_router.get("/metrics/spider-results")
 async def get_spider_results(
     request: Request,
     view: Optional[Literal["day","week","month"]] = Query(default="day"),
     entry_id: Optional[int] = Query(default=None),
     session_id: Optional[int] = Query(default=None),
-
+    db: sqlite3.Connection = Depends(get_db),
 ):
-    db: sqlite3.Connection = request.app.state.db
     start, end = _range_from_view(view)
     data = SpiderAnalysis.get_results(db, start=start, end=end, entry_id=entry_id, session_id=session_id)
     return JSONResponse(data)
@@ -189,13 +352,22 @@ async def get_plutchik_results(
     source: Optional[Literal["ai","user"]] = Query(default=None),
    entry_id: Optional[int] = Query(default=None),
     session_id: Optional[int] = Query(default=None),
-
+    db: sqlite3.Connection = Depends(get_db),
 ):
-    db = request.app.state.db
     start, end = _range_from_view(view)
     data = PlutchikAnalysis.get_results(db, start=start, end=end, source=source, entry_id=entry_id, session_id=session_id)
     return JSONResponse(data)
 
+@analysis_router.get("/plutchik-daily")
+async def get_plutchik_daily(
+    request: Request,
+    view: Optional[Literal["day","week","month"]] = Query(default="month"),
+    source: Optional[Literal["ai","user"]] = Query(default=None),
+    db: sqlite3.Connection = Depends(get_db),
+):
+    start, end = _range_from_view(view)
+    return JSONResponse(PlutchikAnalysis.get_daily(db, start=start, end=end, source=source))
+
 @analysis_router.get("/plutchik-dyads")
 async def get_plutchik_dyads(
     request: Request,
@@ -203,9 +375,8 @@ async def get_plutchik_dyads(
     source: Optional[Literal["ai","user"]] = Query(default=None),
     entry_id: Optional[int] = Query(default=None),
     session_id: Optional[int] = Query(default=None),
-
+    db: sqlite3.Connection = Depends(get_db),
 ):
-    db = request.app.state.db
     start, end = _range_from_view(view)
     try:
         data = PlutchikAnalysis.get_dyads(db, start=start, end=end, source=source, entry_id=entry_id, session_id=session_id)
@@ -213,26 +384,13 @@ async def get_plutchik_dyads(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"plutchik-dyads query failed: {e}")
 
-# ---------------------- POST: per-analyzer run ----------------------
-
-@analysis_router.post("/analyze-all")
-async def analyze_all_and_save(request: Request, payload: dict):
-    db: sqlite3.Connection = request.app.state.db
-    llm = request.app.state.llm
-
-    entry_id = payload.get("entry_id")
-    if not entry_id:
-        raise HTTPException(status_code=400, detail="entry_id is required")
-
-    text = fetch_user_text(db, entry_id)
-    if not text:
-        raise HTTPException(status_code=400, detail="No user messages for this entry_id")
+# ---------------------- pipeline pieces (shared with jobs) ----------------------
 
-    MAX_TEXT_CHARS = 4000
-    if len(text) > MAX_TEXT_CHARS:
-        text = text[:MAX_TEXT_CHARS] + "…"
+MAX_TEXT_CHARS = 4000
+ANALYSIS_MODES = ("combined", "separate")
 
-    analyzers: List[Any] = [
+def build_analyzers() -> List[Any]:
+    return [
         ValenceArousalAnalysis(),
         SpiderAnalysis(),
         PlutchikAnalysis(),
@@ -240,39 +398,141 @@ async def analyze_all_and_save(request: Request, payload: dict):
         ThemeriverAnalysis(),
     ]
 
-    merged: Dict[str, Any] = {}
+def prepare_analysis_text(db: sqlite3.Connection, entry_id: int,
+                          after_id: Optional[int] = None, upto_id: Optional[int] = None) -> str:
+    text = fetch_user_text(db, entry_id, after_id=after_id, upto_id=upto_id)
+    if not text:
+        raise HTTPException(status_code=400, detail="No user messages for this entry_id")
+    if len(text) > MAX_TEXT_CHARS:
+        text = text[:MAX_TEXT_CHARS] + "…"
+    return text
+
+def required_models(analyzers: List[Any]) -> List[str]:
+    return sorted({getattr(a, "model", "chat") for a in analyzers})
+
+async def run_analyzers(inference, models: Dict[str, Any], text: str, analyzers: List[Any], mode: str = "combined",
+                        database: Optional[Database] = None, refresh: bool = False) -> Dict[str, Any]:
+    """
+    models: registry name -> loaded backend (see required_models). Analyzers served by the
+    same backend share the run; "combined": one generation for all their sections,
+    "separate": one per analyzer. Runs are submitted together: the scheduler serializes
+    them, a ModelWorkerPool spreads them over its worker processes.
+    """
+    by_llm: Dict[Any, Tuple[Any, List[Any]]] = {}
     for a in analyzers:
+        llm = models[getattr(a, "model", "chat")]
+        by_llm.setdefault(id(llm), (llm, []))[1].append(a)
+
+    async def _single(llm, a) -> Dict[str, Any]:
         try:
-            merged[a.name] = _run_single_analyzer(llm, text, a)
+            return {a.name: await _run_single_analyzer(inference, llm, text, a, database=database, refresh=refresh)}
         except Exception:
-            wants_array = False
-            try: wants_array = _shape_wants_array(a.json_shape())
-            except Exception: pass
-            merged[a.name] = [] if wants_array else {}
+            return {a.name: _empty_fragment(a)}
 
-    session_id = fetch_session_id(db, entry_id)
+    if mode == "combined":
+        runs = [_run_combined_analyzers(inference, llm, text, group, database=database, refresh=refresh)
+                for llm, group in by_llm.values()]
+    else:
+        runs = [_single(llm, a) for llm, group in by_llm.values() for a in group]
 
-    try:
-        for analyzer in analyzers:
-            section = merged.get(analyzer.name)
-            print(f"\n[DB] Processing section '{analyzer.name}'...")
+    merged: Dict[str, Any] = {}
+    for sections in await asyncio.gather(*runs):
+        merged.update(sections)
+    return merged
+
+def plan_analysis(db: sqlite3.Connection, entry_id: int, analyzers: List[Any],
+                  incremental: bool = False) -> Tuple[Optional[int], List[Tuple[Optional[int], List[Any]]]]:
+    """
+    -> (upto_id, [(after_id, analyzers), ...]): which slice of the entry each analyzer still has
+    to see. after_id None = the whole entry (first run or non-incremental), analyzers that are
+    already up to date are left out. Analyzers sharing a high-water mark share one text/run.
+    """
+    upto_id = fetch_last_user_message_id(db, entry_id)
+    if upto_id is None:
+        raise HTTPException(status_code=400, detail="No user messages for this entry_id")
+    if not incremental:
+        return upto_id, [(None, list(analyzers))]
 
-            # normalize ONLY Themeriver into list-of-rows
-            if str(getattr(analyzer, "name", "")).lower() in ("themeriver"):
-                section = _normalize_themeriver_rows(section)
+    marks = fetch_watermarks(db, entry_id)
+    groups: Dict[Optional[int], List[Any]] = {}
+    for a in analyzers:
+        after_id = marks.get(a.name)
+        if after_id is not None and after_id >= upto_id:
+            continue
+        groups.setdefault(after_id, []).append(a)
+    return upto_id, list(groups.items())
+
+def save_analyzer_section(db: sqlite3.Connection, analyzer: Any, section: Any,
+                          session_id: int, entry_id: int,
+                          upto_id: Optional[int] = None, merge: bool = False, replace: bool = False) -> None:
+    # parse + write one section, no commit (caller decides the transaction size)
+    # merge=True folds an incremental result into the rows stored for the entry,
+    # replace=True drops the entry's earlier ai rows first (full re-analysis)
+    print(f"\n[DB] Processing section '{analyzer.name}'...")
+
+    # normalize ONLY Themeriver into list-of-rows
+    if str(getattr(analyzer, "name", "")).lower() in ("themeriver"):
+        section = _normalize_themeriver_rows(section)
+
+    parsed = analyzer.parse_output(section)
+    if parsed:
+        if replace and not merge:
+            analyzer.clear_from_db(db, entry_id)
+        if merge:
+            analyzer.merge_to_db(db, session_id, entry_id, parsed)
+        else:
+            analyzer.save_to_db(db, session_id, entry_id, parsed)
+    if upto_id is not None:
+        set_watermark(db, entry_id, analyzer.name, upto_id)
+
+# ---------------------- POST: per-analyzer run ----------------------
+
+@analysis_router.post("/analyze-all")
+async def analyze_all_and_save(request: Request, payload: dict, db: sqlite3.Connection = Depends(get_db)):
+    # reads on the request's connection, the writes go in one short write block at the end
+    database: Database = request.app.state.database
+
+    entry_id = payload.get("entry_id")
+    if not entry_id:
+        raise HTTPException(status_code=400, detail="entry_id is required")
 
-            parsed = analyzer.parse_output(section)
-            if parsed:
-                analyzer.save_to_db(db, session_id, entry_id, parsed)
+    analyzers = build_analyzers()
+    inference, models = analysis_runtime(request.app, required_models(analyzers))
 
-        db.commit()
+    mode = payload.get("mode") or "combined"
+    if mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail="mode must be 'combined' or 'separate'")
+
+    # refresh=true ignores cached sections (results are still written back to the cache)
+    refresh = bool(payload.get("refresh", False))
+
+    # incremental=true: every analyzer only sees the messages added since its last run
+    incremental = bool(payload.get("incremental", False))
+
+    session_id = fetch_session_id(db, entry_id)
+    upto_id, plan = plan_analysis(db, entry_id, analyzers, incremental=incremental)
+
+    runs = []
+    merged: Dict[str, Any] = {}
+    for after_id, group in plan:
+        text = prepare_analysis_text(db, entry_id, after_id=after_id, upto_id=upto_id)
+        sections = await run_analyzers(inference, models, text, group, mode=mode, database=database, refresh=refresh)
+        merged.update(sections)
+        runs.append((after_id, group, sections))
+
+    try:
+        async with database.write() as wdb:
+            for after_id, group, sections in runs:
+                for analyzer in group:
+                    save_analyzer_section(wdb, analyzer, sections.get(analyzer.name), session_id, entry_id,
+                                          upto_id=upto_id, merge=after_id is not None)
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"DB write failed: {e}")
 
     return JSONResponse({
         "status": "ok",
         "entry_id": entry_id,
         "session_id": session_id,
+        "analyzed_upto_message_id": upto_id,
         **merged
     })
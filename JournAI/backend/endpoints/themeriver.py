@@ -2,12 +2,19 @@
 from __future__ import annotations
 from typing import Optional, List, Any, Dict, Literal
 import json, logging, sqlite3
-from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi import APIRouter, Depends, Request, HTTPException, Query
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
+from db import Database, get_db
 from graphs.base import fetch_user_text, fetch_session_id, _range_from_view
 from graphs.themeriver import ThemeriverAnalysis
+from graphs.cache import analysis_cache_key, cache_get, cache_put
+from inference.scheduler import PRIORITY_ANALYSIS
+from inference.grammar import grammar_kwargs
+from inference.prompts import PROMPTS
+from endpoints.inference import require_llm
+from endpoints.sentiment_analysis import _extract_parsable_json, _loads_or_none, _shape_wants_array
 
 logger = logging.getLogger("uvicorn.error")
 themeriver_router = APIRouter()
@@ -16,11 +23,9 @@ class ExtractBody(BaseModel):
     entry_id: int = Field(..., ge=1)
 
 @themeriver_router.post("/themeriver")
-async def extract_and_insert_themeriver(request: Request, body: ExtractBody):
-    db: sqlite3.Connection = request.app.state.db
-    llm = request.app.state.llm
-    if llm is None:
-        raise HTTPException(status_code=503, detail="LLM not available")
+async def extract_and_insert_themeriver(request: Request, body: ExtractBody,
+                                        db: sqlite3.Connection = Depends(get_db)):
+    database: Database = request.app.state.database
 
     session_id = fetch_session_id(db, body.entry_id)
     user_text = fetch_user_text(db, body.entry_id)
@@ -28,25 +33,38 @@ async def extract_and_insert_themeriver(request: Request, body: ExtractBody):
         raise HTTPException(status_code=400, detail="No user text for this entry")
 
     tr = ThemeriverAnalysis()
-    prompt = tr.build_prompt() + f"\nUser entry:\n\"\"\"{user_text}\"\"\"\n"
-
-    try:
-        resp = llm(prompt, max_tokens=800)
-        raw = resp["choices"][0]["text"]
-    except Exception as e:
-        logger.exception("LLM call failed")
-        raise HTTPException(status_code=500, detail=f"LLM failed: {e}")
-
-    json_block = _extract_json_array(raw)
-    if not json_block:
-        logger.error("No JSON array found in LLM output. raw=%r", raw[:400])
-        raise HTTPException(status_code=500, detail="No JSON array found in model output")
-
-    try:
-        section = json.loads(json_block)
-    except Exception:
-        logger.exception("Model JSON parse failed")
-        raise HTTPException(status_code=500, detail="Model JSON parse failed")
+    llm = require_llm(request.app, tr.model)
+    cache_version = f"post:{PROMPTS.version('analysis_section', 'analysis_single')}:{tr.prompt_version()}:{llm.model_id}"
+    cache_key = analysis_cache_key(user_text, tr.name, cache_version)
+    section = cache_get(db, cache_key)
+
+    if section is None:
+        prompt = tr.build_prompt(user_text)
+        # the shape is {"themeriver": [...]}: generation stops once that object closes
+        opener = "[" if _shape_wants_array(tr.json_shape()) else "{"
+
+        try:
+            resp = await request.app.state.inference.complete(llm, prompt, priority=PRIORITY_ANALYSIS, tag="themeriver",
+                                                              max_tokens=800, stop_at_json=opener,
+                                                              **grammar_kwargs(tr.json_schema()))
+            raw = resp["choices"][0]["text"]
+        except Exception as e:
+            logger.exception("LLM call failed")
+            raise HTTPException(status_code=500, detail=f"LLM failed: {e}")
+
+        parsed = _loads_or_none(raw)
+        if parsed is None:
+            # unconstrained backends: prose / code fences around the value
+            parsed = _loads_or_none(_extract_parsable_json(raw, prefer_last=False))
+        section = parsed.get("themeriver") if isinstance(parsed, dict) else parsed
+        if not isinstance(section, list):
+            logger.error("No themeriver array in LLM output. raw=%r", raw[:400])
+            raise HTTPException(status_code=500, detail="No themeriver array found in model output")
+
+        async with database.write() as wdb:
+            cache_put(wdb, cache_key, tr.name, cache_version, section)
+    else:
+        logger.info("ThemeRiver POST: cache hit for entry_id=%s", body.entry_id)
 
     items = tr.parse_output(section)
     if not items:
@@ -54,8 +72,8 @@ async def extract_and_insert_themeriver(request: Request, body: ExtractBody):
         return JSONResponse({"status": "ok", "entry_id": body.entry_id, "session_id": session_id,
                              "inserted_count": 0, "items": []})
 
-    tr.save_to_db(db, session_id, body.entry_id, items)
-    db.commit()
+    async with database.write() as wdb:
+        tr.save_to_db(wdb, session_id, body.entry_id, items)
     return JSONResponse({
         "status": "ok",
         "entry_id": body.entry_id,
@@ -71,8 +89,8 @@ async def get_theme_river(
     view: Literal["day","week","month"] = Query(default="day"),
     session_id: Optional[int] = Query(default=None),
     entry_id: Optional[int] = Query(default=None),
+    db: sqlite3.Connection = Depends(get_db),
 ):
-    db: sqlite3.Connection = request.app.state.db
 
     if entry_id is not None:
         rows = db.execute(
@@ -132,14 +150,3 @@ async def get_theme_river(
         })
 
     return JSONResponse({"items": items})
-
-def _extract_json_array(s: str) -> str:
-    start = s.find("[")
-    if start == -1: return ""
-    depth = 0
-    for i in range(start, len(s)):
-        if s[i] == "[": depth += 1
-        elif s[i] == "]":
-            depth -= 1
-            if depth == 0: return s[start:i+1]
-    return ""
\ No newline at end of file
@@ -1,8 +1,17 @@
+import asyncio
+import io
 import sqlite3
-from fastapi import APIRouter, Request, HTTPException
+import tempfile
+from datetime import datetime
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 
+from backup import JournalExists, export_lines, import_lines
+from db import get_db, get_or_create_session_id, get_write_db
+from graphs.activity_registry import ACTIVITIES
+
 user_router = APIRouter()
 
 class User(BaseModel):
@@ -11,31 +20,27 @@ class User(BaseModel):
     gender: Optional[str] = None
 
 @user_router.post("/User")
-async def create_user(request: Request, user: User):
+async def create_user(request: Request, user: User, db: sqlite3.Connection = Depends(get_write_db)):
     if user.age <= 0 or user.age > 100:
         raise HTTPException(status_code=400, detail="Age must be between 1 and 100")
 
-    db = request.app.state.db
     db.execute(
         "REPLACE INTO User (id, name, age, gender) VALUES (1, ?, ?, ?)",
         (user.name, user.age, user.gender)
     )
-    db.commit()
     return {"message": "User saved successfully"}
 
 
 #---------------------------------GET---------------------------------
 @user_router.get("/UserExists")
-async def user_exists(request: Request):
-    db = request.app.state.db
+async def user_exists(request: Request, db: sqlite3.Connection = Depends(get_db)):
     cursor = db.execute("SELECT COUNT(*) FROM User")
     count = cursor.fetchone()[0] #when you call execute, the results are computed and fetched, and you use fetchone/fetchmany/fetchall to retrieve them
     return {"userExists": count > 0}
 
 #GET
 @user_router.get("/UserData")
-async def user_data(request: Request):
-    db = request.app.state.db
+async def user_data(request: Request, db: sqlite3.Connection = Depends(get_db)):
     cursor = db.execute("SELECT name, age, gender FROM User LIMIT 1")
     row = cursor.fetchone()
     if row:
@@ -45,13 +50,16 @@ async def user_data(request: Request):
 
 #POST
 @user_router.delete("/DeleteAllData")
-async def delete_all_data(request: Request):
-    db = request.app.state.db
-    db.execute("PRAGMA foreign_keys = OFF;")
+async def delete_all_data(request: Request, db: sqlite3.Connection = Depends(get_write_db)):
     try:
-        db.execute("BEGIN")
-
-        # children first
+        # children first, so the foreign keys hold after every statement; get_write_db
+        # commits the whole deletion at once or rolls it back
+        db.execute("DELETE FROM analysis_job_steps")
+        db.execute("DELETE FROM analysis_jobs")
+        db.execute("DELETE FROM analysis_watermarks")
+        db.execute("DELETE FROM entry_summaries")
+        db.execute("DELETE FROM reanalysis_runs")
+        db.execute("DELETE FROM reanalysis_failures")
         db.execute("DELETE FROM plutchik_dyads")
         db.execute("DELETE FROM plutchik_events")
         db.execute("DELETE FROM Metrics")
@@ -66,15 +74,52 @@ async def delete_all_data(request: Request):
         db.execute("DELETE FROM User")
 
         for t in ("Messages","Conversations","Metrics","Sessions","Activities","User",
-                  "plutchik_events","plutchik_dyads","Notes"):
+                  "plutchik_events","plutchik_dyads","Notes","analysis_jobs"):
             db.execute("DELETE FROM sqlite_sequence WHERE name = ?", (t,))
-        
-        db.execute("PRAGMA foreign_keys = ON;")
-        db.commit()
+
+        ACTIVITIES.invalidate()
         return {"message": "All data deleted"}
     except sqlite3.IntegrityError as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Foreign key integrity error: {e}")
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Unexpected error during data deletion: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Unexpected error during data deletion: {e}")
+
+#---------------------------------EXPORT / IMPORT---------------------------------
+@user_router.get("/export")
+async def export_journal(request: Request):
+    database = request.app.state.database
+
+    def lines():
+        # own reader for the whole stream (a dependency's would be returned before the body is sent)
+        with database.read() as db:
+            yield from export_lines(db)
+
+    filename = f"journai-{datetime.now():%Y%m%d-%H%M%S}.ndjson"
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@user_router.post("/import")
+async def import_journal(request: Request, replace: bool = False):
+    database = request.app.state.database
+    # spool the upload first (to disk past 8 MB): the writer is only taken once the body is in,
+    # a slow upload never holds up chat inserts or job updates
+    with tempfile.SpooledTemporaryFile(max_size=8 << 20, mode="w+b") as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        # load it off the event loop; readers keep working meanwhile
+        async with database.write() as db:
+            try:
+                counts = await asyncio.to_thread(import_lines, db, io.TextIOWrapper(spool, encoding="utf-8"), replace)
+            except JournalExists as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            except (ValueError, KeyError) as e:
+                # BackupError, or a line that is not json / not an export line
+                raise HTTPException(status_code=400, detail=f"Import failed: {e!r}")
+
+            # the imported journal has its own sessions and entries
+            request.app.state.session_id = get_or_create_session_id(db)
+    request.app.state.chat_cache.clear()
+    ACTIVITIES.invalidate()
+    return {"message": "Journal imported", "rows": counts}
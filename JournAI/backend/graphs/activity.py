@@ -1,42 +1,12 @@
-import re
 from datetime import datetime
 from typing import Dict, Any, List, Optional
-from .base import BaseAnalysis
-
-# -------- normalizer-------------
-def _normalize_activity(name: str) -> str:
-    s = (name or "").strip().lower()
-    s = re.sub(r"\s+", " ", s)
-    return s
-
-def _resolve_activity_id(db, raw_name: str) -> int:
-#if new acitivity --> create a new row for it in Activities
-# if existing activity -> dont create new
-
-
-    norm = _normalize_activity(raw_name)
-
-    row = db.execute(
-        "SELECT id, alias_of FROM Activities WHERE lower(name) = ?",
-        (norm,)
-    ).fetchone()
-
-    if row:
-        act_id, alias_of = row
-        while alias_of is not None:
-            act_id, alias_of = db.execute(
-                "SELECT id, alias_of FROM Activities WHERE id = ?",
-                (alias_of,)
-            ).fetchone()
-        return act_id
-
-    cur = db.execute("INSERT INTO Activities (name, alias_of) VALUES (?, NULL)", (norm,))
-    return cur.lastrowid
-
+from .activity_registry import ACTIVITIES, normalize_activity
+from .base import BaseAnalysis, SCHEMA_RATING
 
 # --------------------- Analysis class ---------------------
 class ActivityAnalysis(BaseAnalysis):
     name = "activities"
+    model = "extract"
     
     def json_shape(self) -> str:
         return """{
@@ -44,6 +14,27 @@ class ActivityAnalysis(BaseAnalysis):
             { "name": "one word verb", "rating": "1-10", "comment": "" }
         ]
         }""".strip()
+
+    def json_schema(self) -> dict:
+        return {
+            "type": "object",
+            "properties": {
+                "activities": {
+                    "type": "array",
+                    "maxItems": 10,
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string"},
+                            "rating": SCHEMA_RATING,
+                            "comment": {"type": "string"},
+                        },
+                        "required": ["name", "rating", "comment"],
+                    },
+                },
+            },
+            "required": ["activities"],
+        }
     
     def instructions(self):
         return ("Analyse Journal Entry and extract any activities (one word verb, for e.g. working, hiking, gaming, etc.) they mention doing, along with a rating from 1 to 10 representing the mood afterwards, and optional comment. DO NOT invent activities! If no valid activity is present, then return nothing.")
@@ -78,20 +69,22 @@ class ActivityAnalysis(BaseAnalysis):
             })
         return {"activities": out}
 
+    def clear_from_db(self, db, entry_id: int):
+        db.execute("DELETE FROM Metrics WHERE entry_id = ? AND metric_type = 'activity' AND source = 'ai'", (entry_id,))
+
     def save_to_db(self, db, session_id: int, entry_id: int, result: Dict[str, Any]):
 
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        for act in result.get("activities", []):
-            name = act["name"]
-            rating = act["rating"]
-            comment = act["comment"]
-            activity_id = _resolve_activity_id(db, name)
-
-            db.execute("""
-                INSERT INTO Metrics
-                    (session_id, entry_id, metric_type, activity_id, description, rating, comment, source, timestamp)
-                VALUES (?, ?, 'activity', ?, ?, ?, ?, 'ai', ?)
-            """, (
-                session_id, entry_id,
-                activity_id, name, rating, comment, now
-            ))
\ No newline at end of file
+        acts = result.get("activities", [])
+        # names the registry already knows cost no query
+        activity_ids = ACTIVITIES.resolve(db, [act["name"] for act in acts])
+
+        db.executemany("""
+            INSERT INTO Metrics
+                (session_id, entry_id, metric_type, activity_id, description, rating, comment, source, timestamp)
+            VALUES (?, ?, 'activity', ?, ?, ?, ?, 'ai', ?)
+        """, [
+            (session_id, entry_id, activity_ids[normalize_activity(act["name"])],
+             act["name"], act["rating"], act["comment"], now)
+            for act in acts
+        ])
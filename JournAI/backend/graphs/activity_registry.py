@@ -0,0 +1,130 @@
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def normalize_activity(name: str) -> str:
+    # Activities.name is stored in this form (migration 2) -> plain lookups on the UNIQUE index
+    s = (name or "").strip().lower()
+    s = re.sub(r"\s+", " ", s)
+    return s
+
+
+def _placeholders(values: List) -> str:
+    return ",".join("?" * len(values))
+
+
+class ActivityRegistry:
+    """
+    Normalized activity name -> canonical Activities.id, held in memory for the writer
+    connection. The table is loaded once (alias chains collapsed to their root, union-find
+    style) and reloaded when another connection commits (PRAGMA data_version), so resolving
+    known activities costs no query per activity. merge() keeps the table flat: every alias
+    points straight at its canonical row.
+
+    Ids of activities created in a transaction that has not been seen to commit are kept
+    apart and re-checked (one query per call) until then, so a rollback cannot leave an id
+    of a row that does not exist in the map. Code that writes Activities behind the
+    registry's back (import, delete-all) calls invalidate().
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._pending: Dict[str, int] = {}     # created, commit not yet seen
+        self._conn: Optional[sqlite3.Connection] = None
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._conn = None
+            self._ids.clear()
+            self._pending.clear()
+
+    # ---------------------- lookups ----------------------
+    def resolve(self, db: sqlite3.Connection, raw_names: Iterable[str]) -> Dict[str, int]:
+        """normalized name -> canonical id for a batch of names; unknown names become new activities."""
+        norms = sorted({normalize_activity(n) for n in raw_names})
+        if not norms:
+            return {}
+        with self._lock:
+            self._sync(db)
+            if self._pending:
+                self._check_pending(db)
+            missing = [n for n in norms if n not in self._ids and n not in self._pending]
+            if missing:
+                db.executemany("INSERT OR IGNORE INTO Activities (name, alias_of) VALUES (?, NULL)",
+                               [(n,) for n in missing])
+                for name, act_id, alias_of in db.execute(
+                    f"SELECT name, id, alias_of FROM Activities WHERE name IN ({_placeholders(missing)})", missing
+                ):
+                    self._pending[name] = alias_of if alias_of is not None else act_id
+            return {n: self._ids.get(n) or self._pending[n] for n in norms}
+
+    def resolve_one(self, db: sqlite3.Connection, raw_name: str) -> int:
+        return self.resolve(db, [raw_name])[normalize_activity(raw_name)]
+
+    def _sync(self, db: sqlite3.Connection) -> None:
+        # data_version only moves when *another* connection commits (CLI tools, a second server)
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if db is self._conn and version == self._version:
+            return
+        rows = db.execute("SELECT id, name, alias_of FROM Activities").fetchall()
+        parent = {act_id: alias_of for act_id, _, alias_of in rows}
+
+        def root(act_id: int) -> int:
+            path = []
+            while parent.get(act_id) is not None and act_id not in path:
+                path.append(act_id)
+                act_id = parent[act_id]
+            for p in path:   # path compression
+                parent[p] = act_id if act_id != p else None
+            return act_id
+
+        pending_ids = set(self._pending.values()) if db is self._conn else set()
+        self._ids = {name: root(act_id) for act_id, name, _ in rows if act_id not in pending_ids}
+        if db is not self._conn:
+            self._pending.clear()
+        self._conn, self._version = db, version
+
+    def _check_pending(self, db: sqlite3.Connection) -> None:
+        ids = sorted(set(self._pending.values()))
+        present = {r[0] for r in db.execute(f"SELECT id FROM Activities WHERE id IN ({_placeholders(ids)})", ids)}
+        settled = not db.in_transaction   # rows seen outside a transaction are committed
+        for name, act_id in list(self._pending.items()):
+            if act_id not in present:
+                del self._pending[name]       # rolled back
+            elif settled:
+                self._ids[name] = self._pending.pop(name)
+
+    # ---------------------- writes ----------------------
+    def merge(self, db: sqlite3.Connection, sources: Iterable[str], target: str) -> Tuple[int, List[int]]:
+        """
+        Alias `sources` to `target` (created / made canonical as needed) and repoint their
+        metrics -> (target_id, ids now aliased). Rows that aliased a source are re-pointed at
+        the target too, so no chain gets longer than one hop. Runs in the caller's transaction.
+        """
+        norm_target = normalize_activity(target)
+        norm_sources = [n for n in dict.fromkeys(normalize_activity(s) for s in sources) if n and n != norm_target]
+
+        names = [norm_target, *norm_sources]
+        db.executemany("INSERT OR IGNORE INTO Activities (name, alias_of) VALUES (?, NULL)", [(n,) for n in names])
+        ids = dict(db.execute(f"SELECT name, id FROM Activities WHERE name IN ({_placeholders(names)})", names).fetchall())
+        target_id = ids[norm_target]
+        src_ids = [ids[n] for n in norm_sources]
+
+        db.execute("UPDATE Activities SET alias_of = NULL WHERE id = ?", (target_id,))
+        if src_ids:
+            marks = _placeholders(src_ids)
+            db.execute(f"UPDATE Activities SET alias_of = ? WHERE id IN ({marks}) OR alias_of IN ({marks})",
+                       (target_id, *src_ids, *src_ids))
+            db.execute(f"UPDATE Metrics SET activity_id = ? WHERE activity_id IN ({marks})", (target_id, *src_ids))
+
+        # the new shape is uncommitted: rebuild from the table on the next lookup
+        self.invalidate()
+        return target_id, src_ids
+
+
+# one registry per process, shared by the activity analyzer and the metrics routes
+ACTIVITIES = ActivityRegistry()
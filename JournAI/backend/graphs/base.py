@@ -1,11 +1,15 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
 from datetime import datetime, timezone, timedelta
+import hashlib
+import json
 import sqlite3
 from typing import Any, Literal, Optional, Union
 
 from fastapi import HTTPException
 
+from inference.prompts import PROMPTS, compact
+
 
 class BaseAnalysis(ABC):
     """
@@ -13,13 +17,22 @@ class BaseAnalysis(ABC):
       - name: str
       - instructions(): str            
       - json_shape(): str              
+      - json_schema(): dict | None     -> machine readable shape, compiled into a decoding grammar
       - parse_output(section): Any     -> normalize model output for DB 
       - save_to_db(db, session_id, entry_id, result)
+      - merge_to_db(db, session_id, entry_id, result) -> fold an incremental result into stored rows
+      - clear_from_db(db, entry_id)    -> drop the entry's ai rows before a full re-analysis
+      - prompt_version(): str          -> changes with instructions/shape, keys the analysis cache
+      - section_prompt() / build_prompt(text) -> its part of the prompt / its single-analyzer prompt
+      - model: str                     -> registry name of the model serving it ('chat' | 'extract')
     """
 
     #json key, e.g. 'spider', 'va'
     name: str
 
+    # simple extraction can run on the small model; unknown names fall back to the chat model
+    model: str = "chat"
+
     # --- prompt building stuff to expose by analyzers ------------------
     def instructions(self) -> str:
         #per analyer instrucions /rules
@@ -30,6 +43,27 @@ class BaseAnalysis(ABC):
         #give example of json object needed
         raise NotImplementedError
 
+    def json_schema(self) -> Optional[dict]:
+        # JSON schema of the section; None -> free text decoding + json recovery
+        return None
+
+    def prompt_version(self) -> str:
+        # editing the instructions, the shape or the schema invalidates cached results
+        schema = json.dumps(self.json_schema(), sort_keys=True)
+        raw = f"{self.instructions()}\n{self.json_shape()}\n{schema}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
+
+    def section_prompt(self) -> str:
+        # prompts/analysis_section.txt for this analyzer, rendered once per template + prompt version
+        shape = self.json_shape()
+        shape = compact(shape) if isinstance(shape, str) else json.dumps(shape, ensure_ascii=False)
+        return PROMPTS.cached((self.name, self.prompt_version()), "analysis_section",
+                              name=self.name, instructions=compact(self.instructions()), shape=shape)
+
+    def build_prompt(self, text: str) -> str:
+        # prompts/analysis_single.txt: this analyzer alone over the journal text
+        return PROMPTS.render("analysis_single", section=self.section_prompt(), text=text)
+
     # --- model output ------
     @abstractmethod
     def parse_output(self, section: Union[dict, list]) -> Any:
@@ -39,18 +73,62 @@ class BaseAnalysis(ABC):
     def save_to_db(self, db: sqlite3.Connection, session_id: int, entry_id: int, result: Any) -> None:
         raise NotImplementedError
 
+    def merge_to_db(self, db: sqlite3.Connection, session_id: int, entry_id: int, result: Any) -> None:
+        # result only covers messages added since the last run; default: append like a fresh save
+        self.save_to_db(db, session_id, entry_id, result)
+
+    def clear_from_db(self, db: sqlite3.Connection, entry_id: int) -> None:
+        # analyzers whose save_to_db appends rows must remove the old ones; upserts need nothing
+        return None
+
 
 # ------------------------------------- common methods -module level -------------------------------------
-def fetch_user_text(db: sqlite3.Connection, entry_id: int) -> str:
-    rows = db.execute("""
+def fetch_user_text(db: sqlite3.Connection, entry_id: int,
+                    after_id: Optional[int] = None, upto_id: Optional[int] = None) -> str:
+    # after_id / upto_id bound Messages.id -> only the slice an incremental run has not seen
+    q = """
         SELECT content
         FROM Messages
         WHERE entry_id = ? AND sender = 'user'
-        ORDER BY timestamp ASC
-    """, (entry_id,)).fetchall()
+    """
+    params: list = [entry_id]
+    if after_id is not None:
+        q += " AND id > ?"; params.append(after_id)
+    if upto_id is not None:
+        q += " AND id <= ?"; params.append(upto_id)
+    q += " ORDER BY timestamp ASC, id ASC"
+    rows = db.execute(q, tuple(params)).fetchall()
     return " ".join(r[0] for r in rows).strip()
 
 
+def fetch_last_user_message_id(db: sqlite3.Connection, entry_id: int) -> Optional[int]:
+    row = db.execute(
+        "SELECT MAX(id) FROM Messages WHERE entry_id = ? AND sender = 'user'", (entry_id,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+# high-water marks: last Messages.id each analyzer has already seen for an entry
+def fetch_watermarks(db: sqlite3.Connection, entry_id: int) -> dict[str, int]:
+    rows = db.execute(
+        "SELECT analyzer, last_message_id FROM analysis_watermarks WHERE entry_id = ?", (entry_id,)
+    ).fetchall()
+    return {name: int(mid) for name, mid in rows}
+
+
+def set_watermark(db: sqlite3.Connection, entry_id: int, analyzer: str, message_id: int) -> None:
+    db.execute(
+        """
+        INSERT INTO analysis_watermarks (entry_id, analyzer, last_message_id, updated_at)
+        VALUES (?, ?, ?, datetime('now'))
+        ON CONFLICT(entry_id, analyzer) DO UPDATE SET
+            last_message_id = excluded.last_message_id,
+            updated_at      = excluded.updated_at
+        """,
+        (entry_id, analyzer, message_id),
+    )
+
+
 def fetch_session_id(db: sqlite3.Connection, entry_id: int) -> int:
     row = db.execute("SELECT session_id FROM Conversations WHERE entry_id = ?", (entry_id,)).fetchone()
     if not row:
@@ -85,6 +163,11 @@ def _range_from_view(view: str) -> tuple[str, str]:
 
 PLUTCHIK_PRIMARIES = {"joy","trust","fear","surprise","sadness","disgust","anger","anticipation"}
 
+# json schema building blocks shared by the analyzers
+SCHEMA_UNIT = {"type": "number"}
+SCHEMA_RATING = {"type": "integer", "enum": list(range(1, 11))}
+SCHEMA_PRIMARY = {"type": "string", "enum": sorted(PLUTCHIK_PRIMARIES)}
+
 #synonym map
 _SYNONYM_TO_PRIMARY = {
     # positive
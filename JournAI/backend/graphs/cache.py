@@ -0,0 +1,63 @@
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+from typing import Any, Dict, Optional
+
+# content addressed cache of analyzer sections (table analysis_cache, see db.py)
+# key = sha256(entry text, analyzer name, prompt/shape version) -> same text never hits the llm twice
+CACHE_MAX_ROWS = 2000
+
+# keys hit since the last cache_put; their last_used_at is written there, right before the
+# eviction that reads it, so lookups stay on a reader and never wait for the writer
+_touched: Dict[str, None] = {}
+
+
+def analysis_cache_key(text: str, analyzer_name: str, version: str) -> str:
+    h = hashlib.sha256()
+    for part in (analyzer_name, version, text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def cache_get(db: sqlite3.Connection, key: str) -> Optional[Any]:
+    row = db.execute("SELECT result FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+    if not row:
+        return None
+    if len(_touched) < CACHE_MAX_ROWS:
+        _touched[key] = None
+    try:
+        return json.loads(row[0])
+    except Exception:
+        return None
+
+
+def cache_put(db: sqlite3.Connection, key: str, analyzer_name: str, version: str, result: Any) -> None:
+    # no commit: runs in the caller's write block
+    touched = list(_touched)
+    _touched.clear()
+    db.executemany("UPDATE analysis_cache SET last_used_at = datetime('now') WHERE key = ?",
+                   [(k,) for k in touched])
+    db.execute(
+        """
+        INSERT INTO analysis_cache (key, analyzer, version, result, created_at, last_used_at)
+        VALUES (?, ?, ?, ?, datetime('now'), datetime('now'))
+        ON CONFLICT(key) DO UPDATE SET
+            result       = excluded.result,
+            last_used_at = excluded.last_used_at
+        """,
+        (key, analyzer_name, version, json.dumps(result, ensure_ascii=False)),
+    )
+    # size bound: keep the most recently used rows only
+    db.execute(
+        """
+        DELETE FROM analysis_cache
+        WHERE key IN (
+            SELECT key FROM analysis_cache
+            ORDER BY last_used_at DESC, created_at DESC
+            LIMIT -1 OFFSET ?
+        )
+        """,
+        (CACHE_MAX_ROWS,),
+    )
@@ -3,7 +3,7 @@ from collections import defaultdict
 import logging
 from typing import Dict, List
 
-from .base import BaseAnalysis, normalize_to_plutchik
+from .base import BaseAnalysis, normalize_to_plutchik, SCHEMA_PRIMARY, SCHEMA_UNIT
 
 # ---------- constants / helpers ----------
 PLUTCHIK: Dict[str, Dict[int, str]] = {
@@ -87,6 +87,28 @@ class PlutchikAnalysis(BaseAnalysis):
         ]
         }""".strip()
 
+    def json_schema(self) -> dict:
+        return {
+            "type": "object",
+            "properties": {
+                "emotions": {
+                    "type": "array",
+                    "maxItems": 8,
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "primary_emotion": SCHEMA_PRIMARY,
+                            "intensity": SCHEMA_UNIT,
+                            "confidence": SCHEMA_UNIT,
+                            "level": {"type": "integer", "enum": [1, 2, 3]},
+                        },
+                        "required": ["primary_emotion", "intensity", "confidence", "level"],
+                    },
+                },
+            },
+            "required": ["emotions"],
+        }
+
     def parse_output(self, section: dict) -> dict:
         out = []
         for emo in section.get("emotions", []):
@@ -110,30 +132,56 @@ class PlutchikAnalysis(BaseAnalysis):
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         timestamps_touched: List[str] = []
 
-        # 1) insert events
+        # 1) insert events, one executemany
+        rows = []
         for emo in result["emotions"]:
-            primary = emo["primary_emotion"]
-            intensity = float(emo["intensity"])
-            confidence = float(emo.get("confidence", 1.0))
             ts = str(emo.get("timestamp") or now)
-
-            db.execute(
-                """
-                INSERT INTO plutchik_events
-                    (entry_id, session_id, source, primary_emotion, level, intensity, sub_label, confidence, timestamp)
-                VALUES (?, ?, 'ai', ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    entry_id, session_id,
-                    primary, emo["level"], intensity, emo["sub_label"],
-                    confidence, ts
-                )
-            )
+            rows.append((
+                entry_id, session_id,
+                emo["primary_emotion"], emo["level"], float(emo["intensity"]), emo["sub_label"],
+                float(emo.get("confidence", 1.0)), ts
+            ))
             timestamps_touched.append(ts)
+        db.executemany(
+            """
+            INSERT INTO plutchik_events
+                (entry_id, session_id, source, primary_emotion, level, intensity, sub_label, confidence, timestamp)
+            VALUES (?, ?, 'ai', ?, ?, ?, ?, ?, ?)
+            """,
+            rows
+        )
 
         # 2) re query exact timestamps we just touched and source = ai (manual is inside metrics.py)
         self._derive_dyads_from_db_for_timestamps(db, entry_id, session_id, timestamps_touched, source="ai")
 
+    def clear_from_db(self, db, entry_id: int):
+        db.execute("DELETE FROM plutchik_dyads WHERE entry_id = ? AND source = 'ai'", (entry_id,))
+        db.execute("DELETE FROM plutchik_events WHERE entry_id = ? AND source = 'ai'", (entry_id,))
+
+    def merge_to_db(self, db, session_id: int, entry_id: int, result: dict):
+        # keep the strongest reading per primary over old + new messages, then rewrite the
+        # entry's ai events under one timestamp so the dyads get derived over the merged set
+        rows = db.execute(
+            """
+            SELECT primary_emotion, level, intensity, sub_label, confidence
+            FROM plutchik_events
+            WHERE entry_id = ? AND source = 'ai'
+            """,
+            (entry_id,)
+        ).fetchall()
+        by_primary: Dict[str, dict] = {
+            r[0]: {"primary_emotion": r[0], "level": r[1], "intensity": float(r[2]),
+                   "sub_label": r[3], "confidence": float(r[4]) if r[4] is not None else 1.0}
+            for r in rows
+        }
+        for emo in result["emotions"]:
+            old = by_primary.get(emo["primary_emotion"])
+            if old is None or float(emo["intensity"]) >= old["intensity"]:
+                by_primary[emo["primary_emotion"]] = emo
+
+        merged = [{**e, "timestamp": None} for e in by_primary.values()]
+        self.save_to_db(db, session_id, entry_id, {"emotions": merged})
+
     # ---- dyad derivation from DB rows that share same timestamp ----
     def _derive_dyads_from_db_for_timestamps(self, db, entry_id: int, session_id: int,
                                              timestamps: List[str], source: str = "ai") -> None:
@@ -163,6 +211,7 @@ class PlutchikAnalysis(BaseAnalysis):
                 "confidence": float(confidence or 1.0),
             })
 
+        dyads = []
         for ts, evs in by_ts.items():
             logger.info("[plutchik] dyads@%s source=%s evs=%s",
                         ts, source, [(e["primary"], e["intensity"]) for e in evs])
@@ -187,22 +236,24 @@ class PlutchikAnalysis(BaseAnalysis):
                     ev1, ev2 = (a["id"], b["id"]) if a["id"] < b["id"] else (b["id"], a["id"])
                     weight = (a["intensity"] + b["intensity"]) / 2.0
 
-                    db.execute(
-                        """
-                        INSERT INTO plutchik_dyads
-                            (entry_id, session_id, source, event_a_id, event_b_id, dyad_label, weight, confidence, timestamp)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, 1.0, ?)
-                        ON CONFLICT(entry_id, source, event_a_id, event_b_id) DO UPDATE SET
-                            dyad_label = excluded.dyad_label,
-                            weight     = excluded.weight,
-                            confidence = excluded.confidence,
-                            timestamp  = excluded.timestamp
-                        """,
-                        (entry_id, session_id, source, ev1, ev2, label, weight, ts)
-                    )
-                    logger.info("[plutchik]     INSERT dyad=%s evs=(%s,%s) ts=%s weight=%.3f",
+                    dyads.append((entry_id, session_id, source, ev1, ev2, label, weight, ts))
+                    logger.info("[plutchik]     dyad=%s evs=(%s,%s) ts=%s weight=%.3f",
                                 label, ev1, ev2, ts, weight)
 
+        db.executemany(
+            """
+            INSERT INTO plutchik_dyads
+                (entry_id, session_id, source, event_a_id, event_b_id, dyad_label, weight, confidence, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1.0, ?)
+            ON CONFLICT(entry_id, source, event_a_id, event_b_id) DO UPDATE SET
+                dyad_label = excluded.dyad_label,
+                weight     = excluded.weight,
+                confidence = excluded.confidence,
+                timestamp  = excluded.timestamp
+            """,
+            dyads
+        )
+
     # ---------------------- getters--------------- ----
     @staticmethod
     def get_results(db, start=None, end=None, source=None, entry_id=None, session_id=None):
@@ -241,6 +292,30 @@ class PlutchikAnalysis(BaseAnalysis):
             "timestamp":  r[8],
         } for r in rows]
 
+    @staticmethod
+    def get_daily(db, start=None, end=None, source=None):
+        """per day and primary: event count + mean intensity, from plutchik_daily (rollups.py)"""
+        q = """
+        SELECT day, primary_emotion, SUM(n), SUM(intensity_sum) / SUM(n)
+        FROM plutchik_daily
+        """
+        where, params = [], []
+        if start and end:
+            where.append("day >= ? AND day < ?"); params += [start[:10], end[:10]]
+        if source in ("ai","user"):
+            where.append("source = ?"); params.append(source)
+        if where:
+            q += " WHERE " + " AND ".join(where)
+        q += " GROUP BY day, primary_emotion ORDER BY day ASC, primary_emotion ASC"
+
+        rows = db.execute(q, tuple(params)).fetchall()
+        return [{
+            "day":       r[0],
+            "primary":   r[1],
+            "count":     int(r[2]),
+            "intensity": round(float(r[3]), 3),
+        } for r in rows]
+
     @staticmethod
     def get_dyads(db, start=None, end=None, source=None, entry_id=None, session_id=None):
         q_base = """
@@ -1,6 +1,6 @@
 import logging
 from typing import Dict
-from .base import BaseAnalysis
+from .base import BaseAnalysis, SCHEMA_RATING
 
 logger = logging.getLogger("uvicorn.error")
 
@@ -8,6 +8,7 @@ _EMOTIONS = ["distressed","irritable","nervous","scared","unhappy","upset","lone
 
 class SpiderAnalysis(BaseAnalysis):
     name = "spider"
+    model = "extract"
 
 
     def json_shape(self) -> str:
@@ -21,6 +22,12 @@ class SpiderAnalysis(BaseAnalysis):
         "lonely": 1-10
         }""".strip()
 
+    def json_schema(self) -> dict:
+        return {
+            "type": "object",
+            "properties": {e: SCHEMA_RATING for e in _EMOTIONS},
+            "required": list(_EMOTIONS),
+        }
     
     def instructions(self):
         return (
@@ -46,6 +53,9 @@ class SpiderAnalysis(BaseAnalysis):
             raise ValueError("Spider: no valid ratings parsed")
         return out
 
+    def clear_from_db(self, db, entry_id: int):
+        db.execute("DELETE FROM Metrics WHERE entry_id = ? AND metric_type = 'quiz' AND source = 'ai'", (entry_id,))
+
     def save_to_db(self, db, session_id: int, entry_id: int, result: Dict[str, int]):
         desc_map = {
             "distressed": "f1",
@@ -56,14 +66,10 @@ class SpiderAnalysis(BaseAnalysis):
             "upset":      "f6",
             "lonely":     "f7",
         }
-        for k, v in result.items():
-            desc = desc_map.get(k)
-            if not desc:
-                continue
-            db.execute("""
-                INSERT INTO Metrics (session_id, entry_id, metric_type, description, comment, rating, source)
-                VALUES (?, ?, 'quiz', ?, ?, ?, 'ai')
-            """, (session_id, entry_id, desc, k, v))
+        db.executemany("""
+            INSERT INTO Metrics (session_id, entry_id, metric_type, description, comment, rating, source)
+            VALUES (?, ?, 'quiz', ?, ?, ?, 'ai')
+        """, [(session_id, entry_id, desc_map[k], k, v) for k, v in result.items() if k in desc_map])
 
 
 
@@ -71,23 +77,29 @@ class SpiderAnalysis(BaseAnalysis):
     @staticmethod
     def get_results(db, start: str | None = None, end: str | None = None,
                     entry_id: int|None=None, session_id:int |None=None):
-        q = """
-            SELECT description, source, AVG(rating) AS avg_rating
-            FROM Metrics
-            WHERE metric_type = 'quiz'
-        """
-        params: list[str] = []
+        params: list = []
+        if entry_id is not None or session_id is not None:
+            q = """
+                SELECT description, source, AVG(rating) AS avg_rating
+                FROM Metrics
+                WHERE metric_type = 'quiz'
+            """
+            if entry_id is not None:
+                q += " AND entry_id = ?"
+                params.append(entry_id)
+            else:
+                q += " AND session_id = ?"
+                params.append(session_id)
+        else:
+            # date views: sum up the daily rollup (rollups.py) instead of every quiz row
+            q = """
+                SELECT description, source, SUM(rating_sum) / NULLIF(SUM(rated_n), 0) AS avg_rating
+                FROM quiz_daily
+            """
+            if start and end:
+                q += " WHERE day >= ? AND day < ?"
+                params += [start[:10], end[:10]]
 
-        if entry_id is not None:
-            q += " AND entry_id = ?"
-            params.append(entry_id)
-        elif session_id is not None:
-            q += " AND session_id = ?"
-            params.append(session_id)
-        elif start and end:
-            q += " AND timestamp >= ? AND timestamp < ?"
-            params += [start, end]
-            
         q += " GROUP BY description, source ORDER BY description ASC, source ASC"
 
         rows = db.execute(q, tuple(params)).fetchall()
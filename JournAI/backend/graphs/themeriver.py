@@ -2,7 +2,7 @@ from __future__ import annotations
 from typing import List, Dict, Tuple, Optional
 import json, sqlite3
 from fastapi import HTTPException
-from .base import BaseAnalysis, normalize_to_plutchik
+from .base import BaseAnalysis, normalize_to_plutchik, SCHEMA_PRIMARY, SCHEMA_UNIT
 
 EMOTION_TO_VA: Dict[str, Tuple[float, float]] = {
     "joy": (+0.90, 0.60), "trust": (+0.60, 0.40), "anticipation": (+0.40, 0.60),
@@ -34,6 +34,28 @@ class ThemeriverAnalysis(BaseAnalysis):
                     { "emotion": "joy/ fear/ sadness...", "reasons": [""], "intensity": "0-1", "confidence": "0-1" }
                     ]}""".strip()
 
+    def json_schema(self) -> dict:
+        return {
+            "type": "object",
+            "properties": {
+                "themeriver": {
+                    "type": "array",
+                    "maxItems": 8,
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "emotion": SCHEMA_PRIMARY,
+                            "reasons": {"type": "array", "items": {"type": "string"}, "maxItems": 6},
+                            "intensity": SCHEMA_UNIT,
+                            "confidence": SCHEMA_UNIT,
+                        },
+                        "required": ["emotion", "reasons", "intensity", "confidence"],
+                    },
+                },
+            },
+            "required": ["themeriver"],
+        }
+
     
 
     def parse_output(self, section: dict | list) -> List[dict]:
@@ -71,13 +93,13 @@ class ThemeriverAnalysis(BaseAnalysis):
             raise HTTPException(status_code=404, detail="entry_id not found in Conversations")
         conv_ts = str(row[0])
 
-        for item in result:
-            db.execute(
-                """
-                INSERT INTO themeriver
-                    (entry_id, session_id, emotion, reasons, valence, arousal, intensity, confidence, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
+        db.executemany(
+            """
+            INSERT INTO themeriver
+                (entry_id, session_id, emotion, reasons, valence, arousal, intensity, confidence, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
                 (
                     entry_id, session_id, item["emotion"],
                     json.dumps(item["reasons"], ensure_ascii=False),
@@ -85,5 +107,45 @@ class ThemeriverAnalysis(BaseAnalysis):
                     float(item["intensity"]),
                     item["confidence"] if item["confidence"] is None else float(item["confidence"]),
                     conv_ts,
-                ),
-            )
\ No newline at end of file
+                )
+                for item in result
+            ],
+        )
+
+    def clear_from_db(self, db: sqlite3.Connection, entry_id: int):
+        db.execute("DELETE FROM themeriver WHERE entry_id = ?", (entry_id,))
+
+    def merge_to_db(self, db: sqlite3.Connection, session_id: int, entry_id: int, result: List[dict]):
+        # same emotion again -> extend its reasons and keep the stronger reading; new emotions are appended
+        existing: Dict[str, tuple] = {}
+        for rid, emo, reasons_json, intensity, confidence in db.execute(
+            "SELECT id, emotion, reasons, intensity, confidence FROM themeriver WHERE entry_id = ? ORDER BY id ASC",
+            (entry_id,),
+        ).fetchall():
+            existing.setdefault(emo, (rid, reasons_json, intensity, confidence))
+
+        new_rows: List[dict] = []
+        updates: List[tuple] = []
+        for item in result:
+            old = existing.get(item["emotion"])
+            if old is None:
+                new_rows.append(item)
+                continue
+            rid, reasons_json, intensity, confidence = old
+            try:
+                reasons = json.loads(reasons_json) if reasons_json else []
+            except Exception:
+                reasons = []
+            reasons += [r for r in item["reasons"] if r not in reasons]
+            confs = [c for c in (confidence, item["confidence"]) if c is not None]
+            updates.append((
+                json.dumps(reasons[:6], ensure_ascii=False),
+                max(float(intensity), float(item["intensity"])),
+                max(confs) if confs else None,
+                rid,
+            ))
+
+        if updates:
+            db.executemany("UPDATE themeriver SET reasons = ?, intensity = ?, confidence = ? WHERE id = ?", updates)
+        if new_rows:
+            self.save_to_db(db, session_id, entry_id, new_rows)
\ No newline at end of file
@@ -1,6 +1,6 @@
 from datetime import datetime
 import json
-from .base import BaseAnalysis
+from .base import BaseAnalysis, SCHEMA_UNIT
 
 class ValenceArousalAnalysis(BaseAnalysis):
     name = "va"
@@ -20,6 +20,19 @@ class ValenceArousalAnalysis(BaseAnalysis):
     "activity_tags": [""]
     }""".strip()
 
+    def json_schema(self) -> dict:
+        return {
+            "type": "object",
+            "properties": {
+                "valence": SCHEMA_UNIT,
+                "arousal": SCHEMA_UNIT,
+                "primary_emotion": {"type": "string"},
+                "secondary_emotion": {"type": "string"},
+                "activity_tags": {"type": "array", "items": {"type": "string"}, "maxItems": 10},
+            },
+            "required": ["valence", "arousal", "primary_emotion", "secondary_emotion", "activity_tags"],
+        }
+
     def parse_output(self, section: dict) -> dict:
         # normalization
         valence = float(section.get("valence", 0.0))
@@ -55,6 +68,25 @@ class ValenceArousalAnalysis(BaseAnalysis):
             result["primary_emotion"], result["secondary_emotion"], tags_str, now
         ))
 
+    def merge_to_db(self, db, session_id: int, entry_id: int, result: dict):
+        # blend with the reading of the earlier messages instead of overwriting it
+        row = db.execute(
+            "SELECT valence, arousal, activity_tags FROM analysis_results WHERE entry_id = ?",
+            (entry_id,)
+        ).fetchone()
+        if row and row[0] is not None and row[1] is not None:
+            try:
+                old_tags = json.loads(row[2]) if row[2] else []
+            except Exception:
+                old_tags = []
+            result = {
+                **result,
+                "valence": (float(row[0]) + result["valence"]) / 2.0,
+                "arousal": (float(row[1]) + result["arousal"]) / 2.0,
+                "activity_tags": old_tags + [t for t in result["activity_tags"] if t not in old_tags],
+            }
+        self.save_to_db(db, session_id, entry_id, result)
+
     # -------------------------------------GET:goes into sentiment_analysis-------------------------------------
     @staticmethod
     def get_results(db, start: str | None = None, end: str | None = None,
@@ -88,4 +120,18 @@ class ValenceArousalAnalysis(BaseAnalysis):
                 "activity_tags": json.loads(r[6]) if r[6] else [],
                 "timestamp": r[7],
             })
-        return out
\ No newline at end of file
+        return out
+
+    @staticmethod
+    def get_daily(db, start: str | None = None, end: str | None = None):
+        """per day: number of analyses + mean valence / arousal, from va_daily (rollups.py)"""
+        q = "SELECT day, n, valence_sum / n, arousal_sum / n FROM va_daily"
+        params: list = []
+        if start and end:
+            q += " WHERE day >= ? AND day < ?"
+            params = [start[:10], end[:10]]
+        rows = db.execute(q + " ORDER BY day ASC", tuple(params)).fetchall()
+        return [
+            {"day": r[0], "count": int(r[1]), "valence": round(float(r[2]), 3), "arousal": round(float(r[3]), 3)}
+            for r in rows
+        ]
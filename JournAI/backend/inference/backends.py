@@ -0,0 +1,418 @@
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional
+
+from inference.grammar import grammar_for_schema
+from inference.json_stop import JsonStop
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _completion(text: str, prompt_tokens: int = 0, completion_tokens: int = 0, finish_reason: str = "stop") -> dict:
+    # the llama_cpp response shape every call site reads (choices[0].text)
+    return {
+        "object": "text_completion",
+        "choices": [{"index": 0, "text": text, "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def _chunk(text: str, finish_reason: Optional[str] = None, timings: Optional[dict] = None) -> dict:
+    chunk = {"object": "text_completion", "choices": [{"index": 0, "text": text, "finish_reason": finish_reason}]}
+    if timings:
+        # prompt eval split, on the first chunk (or on the last one, llama-server)
+        chunk["timings"] = timings
+    return chunk
+
+
+class LLMBackend(ABC):
+    """
+    What the rest of the app needs from a model:
+      - complete(prompt, **kw) -> llama_cpp shaped response dict
+      - stream(prompt, **kw)   -> iterator of llama_cpp shaped chunks
+      - tokenize(text)         -> token ids (context budgeting)
+      - embed(text)            -> vector
+    Generation kwargs follow llama_cpp (max_tokens, temperature, top_p, repeat_penalty, stop)
+    plus json_schema=dict for constrained decoding. Backends are callable like a Llama,
+    so llm(prompt, stream=..., **kw) keeps working everywhere; llm(prompt, stop_at_json="{")
+    ends generation as soon as the answer's top-level JSON object / array closes.
+    """
+
+    name: str = ""
+    model: Any = None   # in-process model object if any (KV state caching needs it)
+    n_ctx: int = 4096   # context window in tokens, prompts are budgeted against it
+    model_id: str = ""  # which weights answer, part of the analysis cache key
+
+    def __call__(self, prompt: str, stream: bool = False, stop_at_json: Optional[str] = None, **kwargs):
+        if stream:
+            return self.stream(prompt, **kwargs)
+        if stop_at_json:
+            return self.complete_json(prompt, stop_at_json, **kwargs)
+        return self.complete(prompt, **kwargs)
+
+    def complete_json(self, prompt: str, opener: str = "{", **kwargs) -> dict:
+        # streams and cancels the generation once the top-level value closes, so trailing
+        # prose / a second JSON blob is never generated. The text is just that value
+        # (or everything, if it never closed).
+        scan = JsonStop(opener)
+        started = time.perf_counter()
+        first_s, n, finish = None, 0, "length"
+        reported: dict = {}
+        gen = self.stream(prompt, **kwargs)
+        try:
+            for chunk in gen:
+                ch = chunk["choices"][0]
+                if first_s is None:
+                    first_s = time.perf_counter() - started
+                n += 1
+                reported.update(chunk.get("timings") or {})
+                if scan.feed(ch.get("text") or ""):
+                    finish = "stop"
+                    break
+                finish = ch.get("finish_reason") or finish
+        finally:
+            if hasattr(gen, "close"):
+                gen.close()
+        resp = _completion(scan.value if scan.done else scan.text, len(self.tokenize(prompt)), n, finish)
+        if first_s is not None:
+            # prompt_n: tokens actually evaluated (less than the prompt when the KV cache had a prefix)
+            prompt_ms = reported.get("prompt_ms", first_s * 1000)
+            resp["timings"] = {"prompt_ms": prompt_ms, "prompt_n": reported.get("prompt_n"),
+                               "gen_ms": (time.perf_counter() - started) * 1000 - prompt_ms, "gen_n": n}
+        return resp
+
+    @staticmethod
+    def model_id_for(**options) -> str:
+        # model_id a backend built from these options will report, without loading it
+        return ""
+
+    @abstractmethod
+    def complete(self, prompt: str, **kwargs) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stream(self, prompt: str, **kwargs) -> Iterator[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def tokenize(self, text: str) -> List[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def embed(self, text: str) -> List[float]:
+        raise NotImplementedError
+
+
+# ------------------------------------- llama_cpp (in process) -------------------------------------
+class LlamaCppBackend(LLMBackend):
+    name = "llama_cpp"
+
+    def __init__(self, model_path: str, **llama_kwargs):
+        from llama_cpp import Llama   # lazy: stub/http setups do not need llama_cpp installed
+        self.model_path = model_path
+        self.model_id = self.model_id_for(model_path=model_path)
+        self.model = Llama(model_path=model_path, **llama_kwargs)
+        self.n_ctx = self.model.n_ctx()
+
+    @staticmethod
+    def model_id_for(model_path: str = "", **_) -> str:
+        return os.path.basename(model_path)
+
+    def _kwargs(self, kwargs: dict) -> dict:
+        kwargs = dict(kwargs)
+        schema = kwargs.pop("json_schema", None)
+        grammar = grammar_for_schema(schema)
+        if grammar is not None:
+            kwargs["grammar"] = grammar
+        return kwargs
+
+    def _perf(self) -> Any:
+        # llama.cpp's own counters: prompt eval vs generation split of the last call
+        try:
+            import llama_cpp
+            return llama_cpp.llama_perf_context(self.model._ctx.ctx)
+        except Exception:
+            return None
+
+    def complete(self, prompt: str, **kwargs) -> dict:
+        before = self._perf()
+        resp = self.model(prompt, stream=False, **self._kwargs(kwargs))
+        after = self._perf()
+        if before is not None and after is not None:
+            resp["timings"] = {
+                "prompt_ms": after.t_p_eval_ms - before.t_p_eval_ms,
+                "prompt_n": after.n_p_eval - before.n_p_eval,
+                "gen_ms": after.t_eval_ms - before.t_eval_ms,
+                "gen_n": after.n_eval - before.n_eval,
+            }
+        return resp
+
+    def stream(self, prompt: str, **kwargs) -> Iterator[dict]:
+        before = self._perf()
+        gen = self.model(prompt, stream=True, **self._kwargs(kwargs))
+        try:
+            for i, chunk in enumerate(gen):
+                after = self._perf() if i == 0 and before is not None else None
+                if after is not None:
+                    # the prompt is evaluated before the first token comes out
+                    chunk["timings"] = {"prompt_ms": after.t_p_eval_ms - before.t_p_eval_ms,
+                                        "prompt_n": after.n_p_eval - before.n_p_eval}
+                yield chunk
+        finally:
+            gen.close()   # stops llama_cpp from generating further tokens
+
+    def tokenize(self, text: str) -> List[int]:
+        return self.model.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+
+    def embed(self, text: str) -> List[float]:
+        # needs the model loaded with embedding=True
+        return self.model.embed(text)
+
+
+# ------------------------------------- OpenAI compatible HTTP -------------------------------------
+class OpenAICompatBackend(LLMBackend):
+    """
+    Local OpenAI compatible server, e.g. llama.cpp's llama-server:
+      /v1/completions, /v1/embeddings (+ /tokenize when the server has it)
+    """
+    name = "openai"
+
+    def __init__(self, base_url: str = "http://127.0.0.1:8080", model: str = "local",
+                 api_key: Optional[str] = None, timeout: float = 300.0, n_ctx: int = 4096):
+        import requests   # lazy, only this backend talks http
+        self._requests = requests
+        self.base_url = base_url.rstrip("/")
+        self.model_name = model
+        self.model_id = self.model_id_for(base_url=base_url, model=model)
+        self.timeout = timeout
+        self.n_ctx = n_ctx
+        self._session = requests.Session()
+        if api_key:
+            self._session.headers["Authorization"] = f"Bearer {api_key}"
+
+    @staticmethod
+    def model_id_for(base_url: str = "http://127.0.0.1:8080", model: str = "local", **_) -> str:
+        return f"{base_url.rstrip('/')}/{model}"
+
+    def _body(self, prompt: str, kwargs: dict, stream: bool) -> dict:
+        body = {"model": self.model_name, "prompt": prompt, "stream": stream}
+        for k in ("max_tokens", "temperature", "top_p", "stop", "repeat_penalty", "seed"):
+            if kwargs.get(k) is not None:
+                body[k] = kwargs[k]
+        if kwargs.get("json_schema"):
+            body["json_schema"] = kwargs["json_schema"]   # llama-server extension
+        return body
+
+    def complete(self, prompt: str, **kwargs) -> dict:
+        r = self._session.post(f"{self.base_url}/v1/completions",
+                               json=self._body(prompt, kwargs, stream=False), timeout=self.timeout)
+        r.raise_for_status()
+        data = r.json()
+        usage = data.get("usage") or {}
+        ch = (data.get("choices") or [{}])[0]
+        resp = _completion(ch.get("text", ""), usage.get("prompt_tokens", 0),
+                           usage.get("completion_tokens", 0), ch.get("finish_reason") or "stop")
+        t = data.get("timings")   # llama-server extension
+        if t:
+            resp["timings"] = {"prompt_ms": t.get("prompt_ms"), "prompt_n": t.get("prompt_n"),
+                               "gen_ms": t.get("predicted_ms"), "gen_n": t.get("predicted_n")}
+        return resp
+
+    def stream(self, prompt: str, **kwargs) -> Iterator[dict]:
+        with self._session.post(f"{self.base_url}/v1/completions", json=self._body(prompt, kwargs, stream=True),
+                                stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                data = json.loads(payload)
+                ch = (data.get("choices") or [{}])[0]
+                t = data.get("timings")   # llama-server, final chunk
+                yield _chunk(ch.get("text", ""), ch.get("finish_reason"),
+                             {"prompt_ms": t.get("prompt_ms"), "prompt_n": t.get("prompt_n")} if t else None)
+
+    def tokenize(self, text: str) -> List[int]:
+        try:
+            r = self._session.post(f"{self.base_url}/tokenize", json={"content": text}, timeout=self.timeout)
+            r.raise_for_status()
+            return list(r.json()["tokens"])
+        except Exception:
+            return _approx_tokens(text)   # server without /tokenize
+
+    def embed(self, text: str) -> List[float]:
+        r = self._session.post(f"{self.base_url}/v1/embeddings",
+                               json={"model": self.model_name, "input": text}, timeout=self.timeout)
+        r.raise_for_status()
+        return list(r.json()["data"][0]["embedding"])
+
+
+# ------------------------------------- deterministic stub -------------------------------------
+def _approx_tokens(text: str) -> List[int]:
+    # words + punctuation, stable ids -> roughly llama sized counts without a tokenizer
+    return [zlib.crc32(t.encode("utf-8")) & 0x7FFF for t in re.findall(r"\w+|[^\w\s]", text)]
+
+
+def _instance_from_schema(schema: dict) -> Any:
+    # smallest deterministic value valid for the (subset of) json schema the analyzers use
+    if "enum" in schema:
+        return schema["enum"][len(schema["enum"]) // 2]
+    t = schema.get("type")
+    if t == "object":
+        return {k: _instance_from_schema(v) for k, v in (schema.get("properties") or {}).items()}
+    if t == "array":
+        return [_instance_from_schema(schema.get("items") or {"type": "string"})]
+    if t == "integer":
+        return 5
+    if t == "number":
+        return 0.5
+    if t == "boolean":
+        return True
+    return "stub"
+
+
+class StubBackend(LLMBackend):
+    """
+    No model at all: canned answers with configurable latency, for benchmarking and load
+    testing the API layer. Calls with a json_schema get a schema-valid JSON document,
+    everything else (chat) gets a fixed reply.
+    """
+    name = "stub"
+    model_id = "stub"
+
+    @staticmethod
+    def model_id_for(**_) -> str:
+        return "stub"
+
+    def __init__(self, latency_s: float = 0.0, token_latency_s: float = 0.0,
+                 reply: str = "Thank you for sharing that. How did it make you feel?"):
+        self.latency_s = latency_s
+        self.token_latency_s = token_latency_s
+        self.reply = reply
+
+    def _answer(self, kwargs: dict) -> str:
+        schema = kwargs.get("json_schema")
+        if schema:
+            return json.dumps(_instance_from_schema(schema), ensure_ascii=False)
+        return self.reply
+
+    def complete(self, prompt: str, **kwargs) -> dict:
+        text = self._answer(kwargs)
+        n = len(self.tokenize(text))
+        time.sleep(self.latency_s + self.token_latency_s * n)
+        resp = _completion(text, len(self.tokenize(prompt)), n)
+        resp["timings"] = {"prompt_ms": self.latency_s * 1000, "prompt_n": resp["usage"]["prompt_tokens"],
+                           "gen_ms": self.token_latency_s * n * 1000, "gen_n": n}
+        return resp
+
+    def stream(self, prompt: str, **kwargs) -> Iterator[dict]:
+        time.sleep(self.latency_s)
+        pieces = re.findall(r"\s*\S+", self._answer(kwargs))
+        timings = {"prompt_ms": self.latency_s * 1000, "prompt_n": len(self.tokenize(prompt))}
+        for i, piece in enumerate(pieces):
+            time.sleep(self.token_latency_s)
+            yield _chunk(piece, "stop" if i == len(pieces) - 1 else None, timings if i == 0 else None)
+
+    def tokenize(self, text: str) -> List[int]:
+        return _approx_tokens(text)
+
+    def embed(self, text: str, dim: int = 64) -> List[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        vec = [(digest[i % len(digest)] - 127.5) / 127.5 for i in range(dim)]
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+
+# ------------------------------------- factory -------------------------------------
+def backend_class(kind: str) -> type:
+    kind = (kind or "llama_cpp").lower()
+    if kind in ("llama_cpp", "llama"):
+        return LlamaCppBackend
+    if kind in ("openai", "http", "llama-server"):
+        return OpenAICompatBackend
+    if kind == "stub":
+        return StubBackend
+    raise ValueError(f"unknown llm backend: {kind}")
+
+
+def create_backend(kind: str, **options) -> LLMBackend:
+    return backend_class(kind)(**options)
+
+
+def default_llama_kwargs(n_threads: Optional[int] = None) -> Dict[str, Any]:
+    # optimized for M1 performance
+    return dict(
+        n_ctx=4096,
+        n_threads=n_threads or min(multiprocessing.cpu_count(), 6),
+        f16_kv=True,
+        use_mlock=True,
+        n_gpu_layers=-1,
+        n_batch=512, #256
+        use_metal=False
+    )
+
+
+MODEL_ROLES = ("chat", "extract")
+
+# default weights per registry name; the small extraction model is optional
+DEFAULT_MODEL_PATHS = {
+    "chat": "./model/mistral-7b-instruct-v0.1.Q6_K_M.gguf",
+    "extract": "./model/qwen2.5-1.5b-instruct-q4_k_m.gguf",
+}
+
+
+def backend_options_from_env(kind: str, llama_kwargs: Optional[Dict[str, Any]] = None,
+                             role: str = "chat") -> Optional[Dict[str, Any]]:
+    """
+    JOURNAI_LLM_BACKEND = llama_cpp (default) | openai | stub
+      llama_cpp: JOURNAI_MODEL_PATH
+      openai:    JOURNAI_LLM_URL, JOURNAI_LLM_MODEL, JOURNAI_LLM_API_KEY, JOURNAI_LLM_N_CTX
+      stub:      JOURNAI_STUB_LATENCY, JOURNAI_STUB_TOKEN_LATENCY (seconds)
+    Other roles read the same variables with the role inserted, e.g. JOURNAI_EXTRACT_MODEL_PATH,
+    JOURNAI_EXTRACT_LLM_URL; None when that role has no model of its own (-> served by chat).
+    """
+    kind = (kind or "llama_cpp").lower()
+    prefix = "JOURNAI_" if role == "chat" else f"JOURNAI_{role.upper()}_"
+    if kind in ("llama_cpp", "llama"):
+        path = os.getenv(f"{prefix}MODEL_PATH") or DEFAULT_MODEL_PATHS.get(role)
+        if role != "chat" and (not path or not os.path.exists(path)):
+            return None
+        return {"model_path": path, **(llama_kwargs or {})}
+    if kind in ("openai", "http", "llama-server"):
+        url = os.getenv(f"{prefix}LLM_URL")
+        if role != "chat" and not url:
+            return None
+        return {
+            "base_url": url or "http://127.0.0.1:8080",
+            "model": os.getenv(f"{prefix}LLM_MODEL", "local"),
+            "api_key": os.getenv(f"{prefix}LLM_API_KEY") or None,
+            "n_ctx": int(os.getenv(f"{prefix}LLM_N_CTX", "4096")),
+        }
+    if role != "chat":
+        return None
+    if kind == "stub":
+        return {
+            "latency_s": float(os.getenv("JOURNAI_STUB_LATENCY", "0")),
+            "token_latency_s": float(os.getenv("JOURNAI_STUB_TOKEN_LATENCY", "0")),
+        }
+    return {}
+
+
+def model_options_from_env(kind: str, llama_kwargs: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, Any]]:
+    # role -> backend options, for every role that has a model of its own
+    roles = {role: backend_options_from_env(kind, llama_kwargs, role=role) for role in MODEL_ROLES}
+    return {role: options for role, options in roles.items() if options is not None}
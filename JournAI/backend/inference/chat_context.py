@@ -0,0 +1,130 @@
+import logging
+import sqlite3
+from typing import List, Sequence, Tuple
+
+from inference.prompts import PROMPTS
+from inference.scheduler import PRIORITY_CHAT
+
+logger = logging.getLogger("uvicorn.error")
+
+PROMPT_MARGIN = 64        # template glue / tokenizer drift between pieces counted separately
+SUMMARY_MAX_TOKENS = 200
+KEEP_RATIO = 0.5          # after folding, recent turns take at most this share of the budget
+
+# Chat history is kept inside a token budget:
+#   [running summary of older turns] + [most recent turns, verbatim]
+# Once the verbatim part overflows, the oldest turns are folded into the summary in one go
+# (down to KEEP_RATIO of the budget), so folding is rare and the prompt prefix stays stable
+# between folds (good for the KV prefix cache). Only messages after the summary watermark are
+# read and tokenized, which keeps per-turn work bounded however long the entry gets.
+
+
+def count_tokens(llm, text: str) -> int:
+    if not text:
+        return 0
+    try:
+        return len(llm.tokenize(text))
+    except Exception:
+        return max(1, len(text) // 4)
+
+
+def format_turn(sender: str, content: str) -> str:
+    return f"{'User' if sender == 'user' else 'Bot'}: {content}"
+
+
+def load_summary(db: sqlite3.Connection, entry_id: int) -> Tuple[str, int]:
+    row = db.execute(
+        "SELECT summary, upto_message_id FROM entry_summaries WHERE entry_id = ?", (entry_id,)
+    ).fetchone()
+    return (row[0], row[1]) if row else ("", 0)
+
+
+def save_summary(db: sqlite3.Connection, entry_id: int, summary: str, upto_message_id: int) -> None:
+    # no commit: runs in the caller's write block
+    db.execute("""
+        INSERT INTO entry_summaries (entry_id, summary, upto_message_id, updated_at)
+        VALUES (?, ?, ?, datetime('now'))
+        ON CONFLICT(entry_id) DO UPDATE SET
+            summary = excluded.summary,
+            upto_message_id = excluded.upto_message_id,
+            updated_at = excluded.updated_at
+    """, (entry_id, summary, upto_message_id))
+
+
+def _summary_prompt(summary: str, turns: Sequence[str]) -> str:
+    # prompts/chat_summary.txt
+    previous = f"Summary so far: {summary}\n" if summary else ""
+    return PROMPTS.render("chat_summary", previous=previous, conversation="\n".join(turns))
+
+
+async def _fold(inference, llm, summary: str, turns: Sequence[str], counts: Sequence[int]) -> str:
+    # the turns to fold may not fit one prompt themselves (long entry seen for the first time)
+    room = llm.n_ctx - SUMMARY_MAX_TOKENS - PROMPT_MARGIN - count_tokens(llm, _summary_prompt("", []))
+    chunk: List[str] = []
+    used = 0
+    for turn, n in zip(turns, counts):
+        if chunk and used + n > room - count_tokens(llm, summary):
+            summary = await _summarize(inference, llm, summary, chunk)
+            chunk, used = [], 0
+        chunk.append(turn)
+        used += n
+    if chunk:
+        summary = await _summarize(inference, llm, summary, chunk)
+    return summary
+
+
+async def _summarize(inference, llm, summary: str, turns: Sequence[str]) -> str:
+    result = await inference.complete(
+        llm, _summary_prompt(summary, turns), priority=PRIORITY_CHAT, tag="chat_summary",
+        max_tokens=SUMMARY_MAX_TOKENS, temperature=0.2, stop=["User:", "Bot:", "System:"],
+    )
+    return result["choices"][0]["text"].strip() or summary
+
+
+def _trim(llm, text: str, max_tokens: int) -> str:
+    # keeps the start of the text, cut at a word boundary
+    while text and count_tokens(llm, text) > max_tokens:
+        cut = int(len(text) * max(max_tokens, 0) / count_tokens(llm, text))
+        text = text[:min(cut, len(text) - 1)].rsplit(" ", 1)[0] if cut > 0 else ""
+    return text
+
+
+async def fit_history(database, inference, llm, entry_id: int,
+                      before_id: int, budget: int) -> Tuple[str, List[str]]:
+    """
+    -> (summary, recent turns) for the messages of entry_id older than before_id, together
+       within `budget` tokens. Updates the stored summary when turns have to be folded.
+    """
+    with database.read() as db:
+        summary, upto = load_summary(db, entry_id)
+        rows = db.execute("""
+            SELECT id, sender, content FROM Messages
+            WHERE entry_id = ? AND id > ? AND id < ?
+            ORDER BY id ASC
+        """, (entry_id, upto, before_id)).fetchall()
+
+    turns = [format_turn(sender, content) for _, sender, content in rows]
+    counts = [count_tokens(llm, t) + 1 for t in turns]   # +1 newline
+    if sum(counts) + count_tokens(llm, summary) <= budget:
+        return summary, turns
+
+    # overflow -> keep the newest turns within KEEP_RATIO of the budget, fold the rest
+    keep_budget = int(budget * KEEP_RATIO)
+    cut, kept = len(turns), 0
+    while cut > 0 and kept + counts[cut - 1] <= keep_budget:
+        cut -= 1
+        kept += counts[cut]
+
+    if cut == 0:
+        # every turn fits, the summary alone is too long: shorten it for this prompt only,
+        # the watermark stays where it is (no turn was folded)
+        return _trim(llm, summary, budget - kept), turns
+
+    try:
+        summary = await _fold(inference, llm, summary, turns[:cut], counts[:cut])
+        async with database.write() as db:
+            save_summary(db, entry_id, summary, rows[cut - 1][0])
+    except Exception as e:
+        # turns are still left out of this prompt, folding is retried next turn
+        logger.warning("[chat-context] summary update failed for entry %s: %s", entry_id, e)
+    return summary, turns[cut:]
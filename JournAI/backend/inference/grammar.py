@@ -0,0 +1,51 @@
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("uvicorn.error")
+
+# compiled LlamaGrammar per schema (compiling GBNF is not free, schemas never change at runtime)
+_GRAMMARS: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def grammar_for_schema(schema: Optional[dict]) -> Any:
+    """
+    JSON schema -> llama_cpp grammar. With it the model can only emit JSON matching the
+    schema and generation ends as soon as the top-level value closes.
+    Returns None when there is no schema or llama_cpp cannot compile it.
+    """
+    if not schema:
+        return None
+    key = json.dumps(schema, sort_keys=True)
+    with _lock:
+        if key in _GRAMMARS:
+            return _GRAMMARS[key]
+    try:
+        from llama_cpp import LlamaGrammar
+        grammar = LlamaGrammar.from_json_schema(key, verbose=False)
+    except Exception as e:
+        logger.warning("[grammar] schema not compiled, decoding unconstrained: %s", e)
+        grammar = None
+    with _lock:
+        _GRAMMARS[key] = grammar
+    return grammar
+
+
+def grammar_kwargs(schema: Optional[dict]) -> dict:
+    # extra llm kwargs for constrained decoding, each backend turns the schema into its own
+    # constraint (llama_cpp: compiled grammar, llama-server: json_schema field)
+    return {"json_schema": schema} if schema else {}
+
+
+def combined_schema(sections: Dict[str, Optional[dict]]) -> Optional[dict]:
+    # one object with a property per analyzer; None if any section has no schema
+    if not sections or any(v is None for v in sections.values()):
+        return None
+    return {
+        "type": "object",
+        "properties": dict(sections),
+        "required": list(sections),
+        "additionalProperties": False,
+    }
@@ -0,0 +1,70 @@
+import json
+from typing import Optional
+
+OPENERS = {"{": "}", "[": "]"}
+
+
+class JsonStop:
+    """
+    Incremental scanner over streamed model output. Tracks bracket depth (quotes and
+    backslash escapes inside strings included) and reports when a top-level JSON value
+    starting with `opener` has closed and parses (arrays: rows of objects, so a "[1]" in
+    the prose does not count). Prose / ```json fences before it and
+    top-level values of the other kind are skipped.
+    """
+
+    def __init__(self, opener: str = "{"):
+        if opener not in OPENERS:
+            raise ValueError(f"opener must be one of {list(OPENERS)}")
+        self.opener = opener
+        self.text = ""                      # everything fed so far
+        self.value: Optional[str] = None    # the completed top-level value
+        self._pos = 0
+        self._stack: list = []
+        self._start = 0
+        self._in_str = False
+        self._esc = False
+
+    @property
+    def done(self) -> bool:
+        return self.value is not None
+
+    def feed(self, piece: str) -> bool:
+        # -> True once the wanted value is complete (the caller stops generating)
+        if self.done:
+            return True
+        self.text += piece
+        s = self.text
+        for i in range(self._pos, len(s)):
+            c = s[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+            elif c == '"' and self._stack:
+                # quotes outside a value are prose ("Here's the JSON"), not strings
+                self._in_str = True
+            elif c in OPENERS:
+                if not self._stack:
+                    self._start = i
+                self._stack.append(OPENERS[c])
+            elif self._stack and c == self._stack[-1]:
+                self._stack.pop()
+                if not self._stack and s[self._start] == self.opener and self._parses(s[self._start:i + 1]):
+                    self.value = s[self._start:i + 1]
+                    self._pos = i + 1
+                    return True
+            elif self._stack and c in "}]":
+                self._stack.clear()   # mismatched closer: not JSON after all, drop the partial value
+        self._pos = len(s)
+        return False
+
+    def _parses(self, candidate: str) -> bool:
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            return False
+        return isinstance(value, dict) or all(isinstance(x, dict) for x in value)
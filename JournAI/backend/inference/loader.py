@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger("uvicorn.error")
+
+WARMUP_PROMPT = "System: warm-up\nUser: hello\nBot:"
+
+
+class ModelLoader:
+    """
+    Loads a model backend off the event loop so the app starts serving DB-only routes
+    right away. After the load a one-token generation pages the weights in and allocates
+    the compute buffers, so the first real request does not pay for it.
+
+    state: pending -> loading -> warming -> ready | failed
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any], warmup: bool = True):
+        self.name = name
+        self.factory = factory
+        self.warmup = warmup
+        self.state = "pending"
+        self.backend: Any = None
+        self.error: Optional[str] = None
+        self.load_ms: Optional[float] = None
+        self.warmup_ms: Optional[float] = None
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"load-model-{self.name}")
+
+    async def _run(self) -> None:
+        try:
+            self.state = "loading"
+            started = time.perf_counter()
+            self.backend = await asyncio.to_thread(self.factory)
+            self.load_ms = (time.perf_counter() - started) * 1000
+            logger.info("[models] %s loaded in %.0f ms", self.name, self.load_ms)
+
+            if self.warmup:
+                self.state = "warming"
+                started = time.perf_counter()
+                try:
+                    await asyncio.to_thread(self.backend.complete, WARMUP_PROMPT, max_tokens=1)
+                except Exception as e:
+                    logger.warning("[models] %s warm-up failed: %s", self.name, e)   # model is still usable
+                self.warmup_ms = (time.perf_counter() - started) * 1000
+            self.state = "ready"
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.warning("[models] failed to load %s: %s", self.name, e)
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def wait(self) -> Any:
+        # -> backend once loaded, None when loading failed
+        await self._ready.wait()
+        return self.backend if self.ready else None
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "backend": getattr(self.backend, "name", None),
+            "load_ms": round(self.load_ms, 1) if self.load_ms is not None else None,
+            "warmup_ms": round(self.warmup_ms, 1) if self.warmup_ms is not None else None,
+            "error": self.error,
+        }
+
+
+class ModelRegistry:
+    """
+    Named models, each with its own ModelLoader: 'chat' = the large conversational model,
+    'extract' = a small one for structured analysis. A name without a model of its own is
+    served by the default one, so a single-model setup keeps working unchanged.
+    """
+
+    def __init__(self, default: str = "chat"):
+        self.default = default
+        self.loaders: Dict[str, ModelLoader] = {}
+
+    def add(self, loader: ModelLoader) -> None:
+        self.loaders[loader.name] = loader
+
+    def loader(self, name: Optional[str] = None) -> ModelLoader:
+        return self.loaders.get(name or self.default) or self.loaders[self.default]
+
+    def start(self) -> None:
+        for loader in self.loaders.values():
+            loader.start()
+
+    async def wait(self, name: Optional[str] = None) -> Any:
+        return await self.loader(name).wait()
+
+    @property
+    def ready(self) -> bool:
+        return all(loader.ready for loader in self.loaders.values())
+
+    def status(self) -> dict:
+        return {name: loader.status() for name, loader in self.loaders.items()}
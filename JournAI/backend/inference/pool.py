@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import telemetry
+from inference.backends import backend_class, create_backend
+
+logger = logging.getLogger("uvicorn.error")
+
+# ---------------------- worker process side ----------------------
+_WORKER_MODELS: Dict[str, Any] = {}
+
+
+def _init_worker(kind: str, options_by_role: Dict[str, dict], n_threads: Optional[int]) -> None:
+    # runs once per worker process: each one loads its own copy of the models
+    for role, options in options_by_role.items():
+        if n_threads and "n_threads" in options:
+            options = {**options, "n_threads": n_threads}
+        _WORKER_MODELS[role] = create_backend(kind, **options)
+
+
+def _worker_complete(role: str, prompt: str, kwargs: dict) -> Tuple[float, float, dict]:
+    # -> (wall clock start, seconds, response): the parent derives the queue wait from it
+    started_wall, started = time.time(), time.perf_counter()
+    resp = _WORKER_MODELS[role](prompt, **kwargs)
+    return started_wall, time.perf_counter() - started, resp
+
+
+def _worker_ping() -> int:
+    return os.getpid()
+
+
+# ---------------------- parent side ----------------------
+@dataclass(frozen=True)
+class PooledModel:
+    # stands in for a backend in the analysis pipeline; generation happens in a worker
+    role: str
+    model_id: str
+    n_ctx: int = 4096
+
+
+class ModelWorkerPool:
+    """
+    Analysis across several model worker processes. Every worker loads the models itself
+    (n_threads each) and takes one generation at a time; results come back to the parent,
+    which keeps doing all DB reads/writes. Drop-in for InferenceScheduler.complete() in
+    the analysis pipeline, with PooledModel handles in place of the loaded backends:
+        models = {name: pool.handle(name) for name in required_models(analyzers)}
+        await run_analyzers(pool, models, text, analyzers, ...)
+    Workers are spawned (not forked): llama_cpp state and threads do not survive a fork.
+    """
+
+    def __init__(self, kind: str, options_by_role: Dict[str, dict], workers: int,
+                 threads_per_worker: Optional[int] = None, default: str = "chat"):
+        self.kind = kind
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.default = default
+        cls = backend_class(kind)
+        self._handles = {role: PooledModel(role, cls.model_id_for(**opts), int(opts.get("n_ctx") or 4096))
+                         for role, opts in options_by_role.items()}
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(kind, options_by_role, threads_per_worker),
+        )
+        self._in_flight = 0
+        self._served: Dict[str, int] = defaultdict(int)
+        self._busy_s: Dict[str, float] = defaultdict(float)
+
+    def handle(self, role: Optional[str] = None) -> PooledModel:
+        return self._handles.get(role or self.default) or self._handles[self.default]
+
+    def start(self) -> None:
+        # spawn + load every worker now instead of on the first analysis
+        for _ in range(self.workers):
+            self._executor.submit(_worker_ping)
+
+    async def complete(self, llm: PooledModel, prompt: str, priority: int = 0, tag: str = "", **kwargs) -> dict:
+        # priority is accepted for InferenceScheduler compatibility, the pool is analysis only
+        loop = asyncio.get_running_loop()
+        submitted_wall, started = time.time(), time.perf_counter()
+        self._in_flight += 1
+        try:
+            began_wall, seconds, resp = await loop.run_in_executor(
+                self._executor, _worker_complete, llm.role, prompt, kwargs)
+        except Exception:
+            telemetry.observe_llm_call(llm, tag or "analysis", time.perf_counter() - started, 0.0, ok=False)
+            raise
+        finally:
+            self._in_flight -= 1
+            self._served[llm.role] += 1
+            self._busy_s[llm.role] += time.perf_counter() - started
+        telemetry.observe_llm_call(llm, tag or "analysis", max(0.0, began_wall - submitted_wall), seconds, resp)
+        return resp
+
+    def status(self) -> dict:
+        return {
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "in_flight": self._in_flight,
+            "served": {
+                role: {"count": n, "avg_ms": round(self._busy_s[role] / n * 1000, 1)}
+                for role, n in self._served.items()
+            },
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,110 @@
+import logging
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Any, List, Optional, Sequence
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _common_prefix_len(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class ChatPrefixCache:
+    """
+    Keeps the llama state (KV cache) reached after each chat turn, keyed by entry_id.
+    Before the next turn of the same entry the state is loaded back, so llama_cpp only
+    evaluates the tokens after the longest common prefix (roughly the newest message)
+    instead of the system prompt + whole history. Entries without a state of their own
+    start from whichever cached state shares the longest prefix (the system prompt).
+
+    Needed because analysis calls run on the same Llama in between chat turns and
+    overwrite its context. Size bounded by capacity_bytes, least recently used out first.
+    """
+
+    def __init__(self, capacity_bytes: int = 2 << 30):
+        self.capacity_bytes = capacity_bytes
+        self._states: "OrderedDict[int, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # callable with the llm signature -> can be handed to the inference scheduler as is
+    def for_entry(self, llm, entry_id: int):
+        # only in-process llama models expose their state (http/stub backends pass through)
+        if not hasattr(getattr(llm, "model", None), "save_state"):
+            return llm
+        call = partial(self._call, llm, entry_id)
+        # what callers read off a backend besides calling it: telemetry label, token counting
+        call.model_id = getattr(llm, "model_id", "")
+        call.tokenize = llm.tokenize
+        call.n_ctx = llm.n_ctx
+        return call
+
+    def forget(self, entry_id: int) -> None:
+        with self._lock:
+            self._states.pop(entry_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._states.clear()
+
+    # ---------------------- runs on the inference worker ----------------------
+    def _call(self, llm, entry_id: int, prompt: str, stream: bool = False, **kwargs):
+        self._restore(llm.model, entry_id, prompt)
+        if stream:
+            return self._stream(llm, entry_id, prompt, **kwargs)
+        try:
+            return llm(prompt, **kwargs)
+        finally:
+            self._save(llm.model, entry_id)
+
+    def _stream(self, llm, entry_id: int, prompt: str, **kwargs):
+        try:
+            yield from llm(prompt, stream=True, **kwargs)
+        finally:
+            self._save(llm.model, entry_id)
+
+    # llm below = the llama_cpp.Llama inside the backend
+    def _restore(self, llm, entry_id: int, prompt: str) -> None:
+        try:
+            tokens: List[int] = llm.tokenize(prompt.encode("utf-8"), special=True)
+        except Exception:
+            return
+        with self._lock:
+            if entry_id in self._states:
+                self._states.move_to_end(entry_id)
+                candidates = [self._states[entry_id]]
+            else:
+                candidates = list(self._states.values())
+
+        best, best_len = None, 0
+        for state in candidates:
+            n = _common_prefix_len(state.input_ids[: state.n_tokens].tolist(), tokens)
+            if n > best_len:
+                best, best_len = state, n
+
+        # the live context may already be the better starting point (no analysis in between)
+        current_len = _common_prefix_len(llm.input_ids[: llm.n_tokens].tolist(), tokens)
+        if best is not None and best_len > current_len:
+            llm.load_state(best)
+            logger.info("[chat-cache] entry=%s reuse %d/%d prompt tokens", entry_id, best_len, len(tokens))
+
+    def _save(self, llm, entry_id: int) -> None:
+        try:
+            state = llm.save_state()
+        except Exception as e:
+            logger.warning("[chat-cache] save_state failed: %s", e)
+            return
+        with self._lock:
+            self._states[entry_id] = state
+            self._states.move_to_end(entry_id)
+            while len(self._states) > 1 and self._size() > self.capacity_bytes:
+                self._states.popitem(last=False)
+
+    def _size(self) -> int:
+        return sum(getattr(s, "llama_state_size", 0) for s in self._states.values())
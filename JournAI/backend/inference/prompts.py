@@ -0,0 +1,130 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from string import Template
+from typing import Any, Dict, Hashable, Tuple
+
+logger = logging.getLogger("uvicorn.error")
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts")
+
+
+def compact(text: str) -> str:
+    # indentation / trailing spaces / stacked blank lines are prompt tokens too -> drop them
+    lines = [line.strip() for line in str(text).strip().splitlines()]
+    out = []
+    for line in lines:
+        if line or (out and out[-1]):
+            out.append(line)
+    return "\n".join(out)
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    name: str
+    text: str
+    version: str    # sha of the compacted text, feeds the analysis cache keys
+    mtime: float
+
+    def render(self, /, **values: Any) -> str:
+        # $name placeholders: the JSON braces in the prompts need no escaping
+        return Template(self.text).substitute({k: str(v) for k, v in values.items()})
+
+
+class PromptRegistry:
+    """
+    prompts/<name>.txt, loaded and compacted once at startup. Every template has a version
+    (hash of its text). Files are re-checked at most every check_interval seconds and
+    reloaded when their mtime changes, so prompt edits apply without a restart. Static
+    renders (system prompt, analyzer sections) are memoized per template version.
+    """
+
+    def __init__(self, directory: str = PROMPTS_DIR, check_interval: float = 1.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._checked: Dict[str, float] = {}
+        self._rendered: Dict[Tuple[Hashable, ...], str] = {}
+        self._bound: Dict[Tuple[Hashable, ...], PromptTemplate] = {}
+        self._lock = threading.Lock()
+
+    def load_all(self) -> Dict[str, str]:
+        for fname in sorted(os.listdir(self.directory)):
+            if fname.endswith(".txt"):
+                self.get(fname[:-4])
+        logger.info("[prompts] loaded %s", self.versions())
+        return self.versions()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.txt")
+
+    def _load(self, name: str) -> PromptTemplate:
+        path = self._path(name)
+        mtime = os.path.getmtime(path)
+        with open(path, "r", encoding="utf-8") as f:
+            text = compact(f.read())
+        version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+        return PromptTemplate(name, text, version, mtime)
+
+    def get(self, name: str) -> PromptTemplate:
+        now = time.monotonic()
+        tpl = self._templates.get(name)
+        if tpl is not None and now - self._checked.get(name, 0.0) < self.check_interval:
+            return tpl
+        with self._lock:
+            self._checked[name] = now
+            try:
+                if tpl is not None and os.path.getmtime(self._path(name)) == tpl.mtime:
+                    return tpl
+                fresh = self._load(name)
+            except OSError:
+                if tpl is None:
+                    raise
+                return tpl   # file briefly missing mid-save -> keep serving the old text
+            if tpl is not None and fresh.version != tpl.version:
+                logger.info("[prompts] %s reloaded: %s -> %s", name, tpl.version, fresh.version)
+                # renders of the old text are never asked for again
+                for memo in (self._rendered, self._bound):
+                    for slot in [s for s in memo if s[0] == name]:
+                        del memo[slot]
+            self._templates[name] = fresh
+            return fresh
+
+    def render(self, name: str, /, **values: Any) -> str:
+        return self.get(name).render(**values)
+
+    def cached(self, key: Hashable, name: str, /, **values: Any) -> str:
+        # render once per (key, template version); for parts that only change with the template
+        tpl = self.get(name)
+        slot = (name, tpl.version, key)
+        text = self._rendered.get(slot)
+        if text is None:
+            text = self._rendered[slot] = tpl.render(**values)
+        return text
+
+    def bind(self, key: Hashable, name: str, /, **static: Any) -> PromptTemplate:
+        # pre-render the static placeholders once (per key + template version), the rest stays $open
+        tpl = self.get(name)
+        slot = (name, tpl.version, key)
+        bound = self._bound.get(slot)
+        if bound is None:
+            escaped = {k: str(v).replace("$", "$$") for k, v in static.items()}
+            bound = self._bound[slot] = PromptTemplate(name, Template(tpl.text).safe_substitute(escaped),
+                                                       tpl.version, tpl.mtime)
+        return bound
+
+    def version(self, *names: str) -> str:
+        if len(names) == 1:
+            return self.get(names[0]).version
+        joined = ":".join(self.get(n).version for n in names)
+        return hashlib.sha256(joined.encode("utf-8")).hexdigest()[:12]
+
+    def versions(self) -> Dict[str, str]:
+        return {name: tpl.version for name, tpl in sorted(self._templates.items())}
+
+
+# one registry per process, shared by chat, analyzers and the CLI
+PROMPTS = PromptRegistry()
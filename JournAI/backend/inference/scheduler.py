@@ -0,0 +1,213 @@
+import asyncio
+import itertools
+import queue
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import telemetry
+
+
+# lower number = served first
+PRIORITY_CHAT = 0
+PRIORITY_ANALYSIS = 10
+
+_DONE = object()
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    fn: Optional[Callable[[], Any]] = field(compare=False, default=None)
+    loop: Optional[asyncio.AbstractEventLoop] = field(compare=False, default=None)
+    future: Optional[asyncio.Future] = field(compare=False, default=None)
+    kind: str = field(compare=False, default="")
+    enqueued_at: float = field(compare=False, default=0.0)
+
+
+def _resolve(fut: asyncio.Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+    if fut.cancelled():
+        return
+    if error is not None:
+        fut.set_exception(error)
+    else:
+        fut.set_result(result)
+
+
+class InferenceScheduler:
+    """
+    Single entry point for every model call. Jobs are queued (never rejected) and run
+    one at a time on a dedicated worker thread, so two generations never share the one
+    Llama instance and the event loop stays free. Interactive chat (PRIORITY_CHAT) is
+    picked ahead of background analysis (PRIORITY_ANALYSIS); equal priorities are FIFO.
+      - complete(llm, prompt, priority=..., **kw) -> llama response dict
+      - stream(llm, prompt, priority=..., **kw)   -> async iterator of llama stream chunks
+      - run(fn, *args, priority=..., **kw)        -> any other blocking model call
+      - status()                                  -> queue depth + wait times
+    """
+
+    def __init__(self):
+        self._queue: "queue.PriorityQueue[_Job]" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._running: Optional[str] = None
+        self._served: Dict[str, int] = defaultdict(int)
+        self._wait_total: Dict[str, float] = defaultdict(float)
+        self._wait_max: Dict[str, float] = defaultdict(float)
+        self._last_wait: Optional[float] = None
+        self._worker = threading.Thread(target=self._work, name="llm-scheduler", daemon=True)
+        self._worker.start()
+
+    # ---------------------- submit ----------------------
+    async def run(self, fn: Callable[..., Any], *args, priority: int = PRIORITY_ANALYSIS,
+                  kind: str = "", **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        job = _Job(
+            priority=priority, seq=next(self._seq), fn=partial(fn, *args, **kwargs),
+            loop=loop, future=fut, kind=kind or _kind_for(priority), enqueued_at=time.perf_counter(),
+        )
+        self._queue.put(job)
+        return await fut
+
+    async def complete(self, llm, prompt: str, priority: int = PRIORITY_ANALYSIS, tag: str = "", **kwargs) -> Any:
+        # tag names the call site in the telemetry (e.g. "chat", "analysis:spider")
+        enqueued = time.perf_counter()
+
+        def _call():
+            started = time.perf_counter()
+            ok, resp = False, None
+            try:
+                resp = llm(prompt, **kwargs)
+                ok = True
+                return resp
+            finally:
+                telemetry.observe_llm_call(llm, tag or _kind_for(priority), started - enqueued,
+                                           time.perf_counter() - started, resp, ok=ok)
+
+        return await self.run(_call, priority=priority)
+
+    async def stream(self, llm, prompt: str, priority: int = PRIORITY_CHAT, tag: str = "",
+                     **kwargs) -> AsyncIterator[dict]:
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+        enqueued = time.perf_counter()
+
+        def _produce():
+            # holds the model for the whole stream, hands chunks back to the loop as they come
+            if cancelled.is_set():
+                return
+            started = time.perf_counter()
+            first, n, ok = None, 0, False
+            timings: dict = {}
+            gen = llm(prompt, stream=True, **kwargs)
+            try:
+                for chunk in gen:
+                    if first is None:
+                        first = time.perf_counter() - started
+                    n += 1
+                    timings.update(chunk.get("timings") or {})   # prompt eval split, if the backend sends it
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+                ok = True
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+            finally:
+                if hasattr(gen, "close"):
+                    gen.close()   # stops llama_cpp from generating further tokens
+                loop.call_soon_threadsafe(chunks.put_nowait, _DONE)
+                elapsed = time.perf_counter() - started
+                # counted after the last chunk went out, so it never delays the first token
+                try:
+                    prompt_tokens = len(llm.tokenize(prompt))
+                except (RuntimeError, ValueError):   # the tokenizer failed, not a missing method
+                    prompt_tokens = None
+                telemetry.observe_llm_call(llm, tag or _kind_for(priority), started - enqueued, elapsed,
+                                           {"timings": timings}, ok=ok, ttft_s=first, gen_tokens=n,
+                                           prompt_tokens=prompt_tokens)
+
+        producer = asyncio.ensure_future(self.run(_produce, priority=priority))
+        try:
+            while True:
+                getter = asyncio.ensure_future(chunks.get())
+                done, _ = await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    producer.result()   # producer died before streaming anything -> raise
+                    continue
+                item = getter.result()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # consumer stopped early (client disconnect, error) -> let the worker bail out
+            cancelled.set()
+            if not producer.done():
+                producer.cancel()
+
+    # ---------------------- worker ----------------------
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job.fn is None:   # shutdown sentinel
+                break
+            if job.future.cancelled():
+                continue
+
+            wait = time.perf_counter() - job.enqueued_at
+            with self._lock:
+                self._running = job.kind
+                self._served[job.kind] += 1
+                self._wait_total[job.kind] += wait
+                self._wait_max[job.kind] = max(self._wait_max[job.kind], wait)
+                self._last_wait = wait
+            try:
+                result = job.fn()
+                job.loop.call_soon_threadsafe(_resolve, job.future, result, None)
+            except Exception as e:
+                job.loop.call_soon_threadsafe(_resolve, job.future, None, e)
+            finally:
+                with self._lock:
+                    self._running = None
+
+    # ---------------------- introspection ----------------------
+    def status(self) -> dict:
+        with self._queue.mutex:
+            pending = [j for j in self._queue.queue if j.fn is not None]
+        now = time.perf_counter()
+        by_kind: Dict[str, int] = defaultdict(int)
+        for j in pending:
+            by_kind[j.kind] += 1
+
+        with self._lock:
+            served = {
+                k: {
+                    "count": n,
+                    "avg_wait_ms": round(self._wait_total[k] / n * 1000, 1),
+                    "max_wait_ms": round(self._wait_max[k] * 1000, 1),
+                }
+                for k, n in self._served.items()
+            }
+            return {
+                "queue_depth": len(pending),
+                "queued_by_kind": dict(by_kind),
+                "oldest_wait_ms": round(max((now - j.enqueued_at for j in pending), default=0.0) * 1000, 1),
+                "running": self._running,
+                "last_wait_ms": None if self._last_wait is None else round(self._last_wait * 1000, 1),
+                "served": served,
+            }
+
+    def shutdown(self) -> None:
+        self._queue.put(_Job(priority=2**31, seq=next(self._seq)))
+
+
+def _kind_for(priority: int) -> str:
+    return "chat" if priority <= PRIORITY_CHAT else "analysis"
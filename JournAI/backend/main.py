@@ -1,14 +1,22 @@
 #-------------------------FastAPI app--------------------------------
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import multiprocessing
-from llama_cpp import Llama
 import logging
+import os
+import time
 
+import telemetry
 
-from db import get_or_create_session_id, init_db, close_db, create_tables
+from db import Database, get_or_create_session_id, create_tables
+from inference.backends import create_backend, default_llama_kwargs, model_options_from_env
+from inference.loader import ModelLoader, ModelRegistry
+from inference.pool import ModelWorkerPool
+from inference.prompts import PROMPTS
+from inference.scheduler import InferenceScheduler
+from inference.prefix_cache import ChatPrefixCache
 from endpoints.chat import chat_router
 from endpoints.user import user_router
 from endpoints.mood import mood_router
@@ -17,6 +25,8 @@ from endpoints.notes import notes_router
 from endpoints.chat import entries_router
 from endpoints.sentiment_analysis import analysis_router
 from endpoints.themeriver import themeriver_router
+from endpoints.inference import inference_router
+from endpoints.jobs import jobs_router, resume_unfinished_jobs
 
 
 
@@ -37,33 +47,51 @@ async def lifespan(app: FastAPI):
     # )
  #---------------------------------------------------------
     # load mac model (optimized for M1 performance)
-    try:
-        app.state.llm = Llama(
-            model_path="./model/mistral-7b-instruct-v0.1.Q6_K_M.gguf",
-            n_ctx=4096,
-            n_threads=min(multiprocessing.cpu_count(), 6),
-            f16_kv=True,
-            use_mlock=True,
-            n_gpu_layers=-1,
-            n_batch=512, #256
-            use_metal=False
-        )
-        logging.info("Llama model loaded successfully.")
-    except Exception as e:
-        logging.warning(f"Failed to load Llama model: {e}")
-        app.state.llm = None
-
-    #  DB init
-    app.state.db = init_db()
-    db = app.state.db                     
-    db.execute("PRAGMA foreign_keys = ON")  # enable foreign key (off by default for sqlite)
-    create_tables(db)
-
-    app.state.session_id = get_or_create_session_id(db)
+    # JOURNAI_LLM_BACKEND=openai talks to a llama-server instead, =stub answers without a model
+    backend = os.getenv("JOURNAI_LLM_BACKEND", "llama_cpp")
+    llama_kwargs = default_llama_kwargs()
+    # loaded + warmed up in the background: DB-only routes are served meanwhile,
+    # llm routes answer 503 until /readyz reports the model ready.
+    # 'chat' = 7B for conversation, 'extract' = optional 1-3B model for the analyzers that
+    # pick it (BaseAnalysis.model); without one they are served by the chat model
+    app.state.models = ModelRegistry(default="chat")
+    for role, options in model_options_from_env(backend, llama_kwargs).items():
+        app.state.models.add(ModelLoader(role, lambda options=options: create_backend(backend, **options)))
+    app.state.models.start()
+
+    # JOURNAI_ANALYSIS_WORKERS=N: analysis runs on N model worker processes (each with its own
+    # copy of the models and JOURNAI_WORKER_THREADS threads) instead of the shared scheduler
+    workers = int(os.getenv("JOURNAI_ANALYSIS_WORKERS", "0"))
+    app.state.analysis_pool = None
+    if workers > 0:
+        threads = int(os.getenv("JOURNAI_WORKER_THREADS", "0")) or None
+        app.state.analysis_pool = ModelWorkerPool(backend, model_options_from_env(backend, llama_kwargs),
+                                                  workers=workers, threads_per_worker=threads)
+        app.state.analysis_pool.start()
+
+    # every llm call is queued here: off the event loop, one generation at a time, chat first
+    app.state.inference = InferenceScheduler()
+    # per-entry KV states so a chat turn only evaluates the newest message
+    app.state.chat_cache = ChatPrefixCache()
+
+    # prompts/*.txt compacted + versioned once here, reloaded when a file changes
+    PROMPTS.load_all()
+
+    #  DB init: WAL, one writer + a pool of readers; routes get theirs through db.get_db / get_write_db
+    app.state.database = Database(readers=int(os.getenv("JOURNAI_DB_READERS", "4")))
+    async with app.state.database.write() as db:
+        create_tables(db)
+        app.state.session_id = get_or_create_session_id(db)
+
+    # analysis jobs cut off by the last shutdown pick up where they stopped
+    resume_unfinished_jobs(app)
     
     yield
 
-    close_db(db)
+    app.state.inference.shutdown()
+    if app.state.analysis_pool is not None:
+        app.state.analysis_pool.shutdown()
+    app.state.database.close()
 
 app = FastAPI(lifespan=lifespan, debug=True)
 app.include_router(session_router)
@@ -77,6 +105,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def http_metrics(request: Request, call_next):
+    # labelled by route template (/entries/{entry_id}), not the raw path -> bounded label set
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        telemetry.observe_http(request.method, getattr(route, "path", "unmatched"), status,
+                               time.perf_counter() - started)
+
 # routers
 app.include_router(chat_router)
 app.include_router(user_router)
@@ -86,4 +128,6 @@ app.include_router(notes_router)
 app.include_router(entries_router)
 app.include_router(analysis_router) # for AI input of metrics
 app.include_router(themeriver_router)
+app.include_router(inference_router)
+app.include_router(jobs_router) # background analysis with status polling
 
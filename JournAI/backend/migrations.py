@@ -0,0 +1,94 @@
+#-------------------------Schema migrations--------------------------------
+# create_tables() creates what is missing, the migrations below upgrade existing databases in
+# place. The version reached is stored in the file itself (PRAGMA user_version); every step
+# runs at most once, in its own transaction.
+import logging
+import sqlite3
+from typing import List, Tuple
+
+from rollups import REBUILD_SQL, ROLLUP_SCHEMA
+
+logger = logging.getLogger("uvicorn.error")
+
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (1, "indexes for the router filters", """
+        CREATE INDEX IF NOT EXISTS idx_messages_entry_time         ON Messages(entry_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_conversations_time          ON Conversations(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_metrics_type_time           ON Metrics(metric_type, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_metrics_session_entry_time  ON Metrics(session_id, entry_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_metrics_entry               ON Metrics(entry_id);
+        CREATE INDEX IF NOT EXISTS idx_plutchik_events_time_source ON plutchik_events(timestamp, source);
+        CREATE INDEX IF NOT EXISTS idx_plutchik_events_source_time ON plutchik_events(source, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_plutchik_events_session     ON plutchik_events(session_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_plutchik_dyads_time         ON plutchik_dyads(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_plutchik_dyads_source_time  ON plutchik_dyads(source, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_plutchik_dyads_session      ON plutchik_dyads(session_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_analysis_results_time       ON analysis_results(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_analysis_results_session    ON analysis_results(session_id, timestamp);
+        -- activities are looked up by lower(name), the UNIQUE(name) index cannot serve that
+        CREATE INDEX IF NOT EXISTS idx_activities_lower_name       ON Activities(lower(name));
+    """),
+    (2, "normalized activity names, flat alias chains", """
+        -- names differing only in case/outer spaces collapse onto the lowest id
+        CREATE TEMP TABLE activity_dupes AS
+            SELECT a.id AS old_id, k.keep_id
+            FROM Activities a
+            JOIN (SELECT lower(trim(name)) AS norm, MIN(id) AS keep_id FROM Activities GROUP BY 1) k
+              ON lower(trim(a.name)) = k.norm
+            WHERE a.id != k.keep_id;
+        UPDATE Metrics SET activity_id = (SELECT keep_id FROM activity_dupes WHERE old_id = activity_id)
+            WHERE activity_id IN (SELECT old_id FROM activity_dupes);
+        UPDATE Activities SET alias_of = (SELECT keep_id FROM activity_dupes WHERE old_id = alias_of)
+            WHERE alias_of IN (SELECT old_id FROM activity_dupes);
+        DELETE FROM Activities WHERE id IN (SELECT old_id FROM activity_dupes);
+        DROP TABLE activity_dupes;
+        UPDATE Activities SET alias_of = NULL WHERE alias_of = id;
+        UPDATE Activities SET name = lower(trim(name)) WHERE name != lower(trim(name));
+
+        -- every alias points at its root (rows on a cycle become canonical)
+        WITH RECURSIVE chain(id, root, depth) AS (
+            SELECT id, id, 0 FROM Activities WHERE alias_of IS NULL
+            UNION ALL
+            SELECT a.id, chain.root, chain.depth + 1 FROM Activities a JOIN chain ON a.alias_of = chain.id
+            WHERE chain.depth < 100
+        )
+        UPDATE Activities SET alias_of = (SELECT root FROM chain WHERE chain.id = Activities.id)
+            WHERE alias_of IS NOT NULL;
+        UPDATE Metrics SET activity_id = (SELECT alias_of FROM Activities WHERE id = Metrics.activity_id)
+            WHERE activity_id IN (SELECT id FROM Activities WHERE alias_of IS NOT NULL);
+
+        -- lookups go through UNIQUE(name) now; merges re-point by alias_of / activity_id
+        DROP INDEX IF EXISTS idx_activities_lower_name;
+        CREATE INDEX IF NOT EXISTS idx_activities_alias_of ON Activities(alias_of);
+        CREATE INDEX IF NOT EXISTS idx_metrics_activity    ON Metrics(activity_id);
+    """),
+    (3, "daily rollups maintained by triggers, Sessions.mood_avg", ROLLUP_SCHEMA + REBUILD_SQL),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(db: sqlite3.Connection) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db: sqlite3.Connection) -> int:
+    """Apply the migrations newer than the database's user_version, -> the version reached."""
+    current = schema_version(db)
+    if current > SCHEMA_VERSION:
+        logger.warning("[db] schema version %s is newer than this code (%s)", current, SCHEMA_VERSION)
+        return current
+    for version, description, sql in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("[db] migration %s: %s", version, description)
+        db.commit()
+        try:
+            # executescript would commit after each statement, BEGIN keeps the step atomic
+            db.executescript(f"BEGIN; {sql}; PRAGMA user_version = {version}; COMMIT;")
+        except Exception:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        current = version
+    return current
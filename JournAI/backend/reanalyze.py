@@ -0,0 +1,226 @@
+"""
+Offline re-analysis of the whole journal, no web server needed:
+
+    python reanalyze.py                      # every entry, results replace the earlier ai rows
+    python reanalyze.py --incremental        # only messages added since each analyzer's last run
+    python reanalyze.py --run after-prompt-v2 --commit-every 50 --mode separate
+    python reanalyze.py --workers 4 --threads-per-worker 4   # entries in parallel on 4 model processes
+
+Entries are walked in entry_id order, N at a time: the batch is analyzed first, then its
+DB writes and the checkpoint are committed together. A killed run resumes after the last
+committed batch when started again with the same --run name (--restart starts over).
+Entries that failed are recorded with the run and retried first when it is resumed.
+Unchanged prompt + model + text is answered from the analysis cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from db import Database, create_tables
+from graphs.base import fetch_session_id
+from inference.backends import create_backend, default_llama_kwargs, model_options_from_env
+from inference.pool import ModelWorkerPool
+from inference.scheduler import InferenceScheduler
+from endpoints.sentiment_analysis import (
+    ANALYSIS_MODES, build_analyzers, plan_analysis, prepare_analysis_text, required_models,
+    run_analyzers, save_analyzer_section,
+)
+
+
+def _load_run(db: sqlite3.Connection, name: str, params: dict, restart: bool) -> Tuple[int, int, int, bool]:
+    # -> (last_entry_id, done, failed, finished)
+    if restart:
+        db.execute("DELETE FROM reanalysis_runs WHERE name = ?", (name,))
+        db.execute("DELETE FROM reanalysis_failures WHERE run = ?", (name,))
+    row = db.execute(
+        "SELECT params, last_entry_id, entries_done, entries_failed, finished_at FROM reanalysis_runs WHERE name = ?",
+        (name,)
+    ).fetchone()
+    if row is None:
+        db.execute("INSERT INTO reanalysis_runs (name, params) VALUES (?, ?)", (name, json.dumps(params, sort_keys=True)))
+        db.commit()
+        return 0, 0, 0, False
+    if json.loads(row[0]) != params:
+        print(f"[reanalyze] note: run '{name}' was started with {row[0]}, continuing with {json.dumps(params, sort_keys=True)}")
+    return row[1], row[2], row[3], row[4] is not None
+
+
+def _checkpoint(db: sqlite3.Connection, name: str, last_entry_id: int, done: int, failed: int,
+                finished: bool = False) -> None:
+    db.execute("""
+        UPDATE reanalysis_runs
+        SET last_entry_id = ?, entries_done = ?, entries_failed = ?, updated_at = datetime('now'),
+            finished_at = CASE WHEN ? THEN datetime('now') ELSE finished_at END
+        WHERE name = ?
+    """, (last_entry_id, done, failed, finished, name))
+
+
+def _failed_entries(db: sqlite3.Connection, name: str) -> List[int]:
+    return [r[0] for r in db.execute(
+        "SELECT entry_id FROM reanalysis_failures WHERE run = ? ORDER BY entry_id", (name,)
+    ).fetchall()]
+
+
+def _next_entries(db: sqlite3.Connection, after_entry_id: int, limit: int, since: Optional[str]) -> List[int]:
+    # keyset paging: only one batch of ids in memory at a time
+    q = "SELECT entry_id FROM Conversations WHERE entry_id > ?"
+    args: List[Any] = [after_entry_id]
+    if since:
+        q += " AND timestamp >= ?"
+        args.append(since)
+    q += " ORDER BY entry_id ASC LIMIT ?"
+    args.append(limit)
+    return [r[0] for r in db.execute(q, args).fetchall()]
+
+
+async def _analyze_entry(database: Database, inference, models: Dict[str, Any], entry_id: int,
+                         mode: str, refresh: bool, incremental: bool) -> list:
+    # llm work only; -> pending writes [(analyzer, section, session_id, upto_id, merge)]
+    analyzers = build_analyzers()
+    with database.read() as db:
+        session_id = fetch_session_id(db, entry_id)
+        upto_id, plan = plan_analysis(db, entry_id, analyzers, incremental=incremental)
+    writes = []
+    for after_id, group in plan:
+        with database.read() as db:
+            text = prepare_analysis_text(db, entry_id, after_id=after_id, upto_id=upto_id)
+        sections = await run_analyzers(inference, models, text, group, mode=mode, database=database, refresh=refresh)
+        for a in group:
+            writes.append((a, sections.get(a.name), session_id, upto_id, after_id is not None))
+    return writes
+
+
+async def reanalyze(database: Database, inference, models: Dict[str, Any], run: str = "default",
+                    mode: str = "combined", refresh: bool = False, incremental: bool = False,
+                    commit_every: int = 20, since: Optional[str] = None, limit: Optional[int] = None,
+                    restart: bool = False) -> dict:
+    params = {"mode": mode, "refresh": refresh, "incremental": incremental, "since": since}
+    async with database.write() as db:
+        last_id, done, failed, finished = _load_run(db, run, params, restart)
+        retry = _failed_entries(db, run)
+    if finished and not retry:
+        print(f"[reanalyze] run '{run}' already finished ({done} entries), use --restart to run it again")
+        return {"run": run, "entries_done": done, "entries_failed": failed}
+    if last_id:
+        print(f"[reanalyze] resuming run '{run}' after entry {last_id} ({done} done)")
+    if retry:
+        print(f"[reanalyze] retrying {len(retry)} entries that failed before")
+
+    started = time.perf_counter()
+    processed = 0
+    while limit is None or processed < limit:
+        size = commit_every if limit is None else min(commit_every, limit - processed)
+        # failures of earlier invocations first, then the entries after the checkpoint
+        retrying = bool(retry)
+        if retrying:
+            batch, retry = retry[:size], retry[size:]
+        else:
+            with database.read() as db:
+                batch = _next_entries(db, last_id, size, since)
+        if not batch:
+            break
+
+        # the batch's entries are analyzed concurrently (parallel with a worker pool)
+        results = await asyncio.gather(
+            *(_analyze_entry(database, inference, models, entry_id, mode, refresh, incremental) for entry_id in batch),
+            return_exceptions=True,
+        )
+        pending, errors = [], []
+        for entry_id, result in zip(batch, results):
+            if isinstance(result, HTTPException):
+                print(f"[reanalyze] entry {entry_id} skipped: {result.detail}")   # e.g. no user messages
+                pending.append((entry_id, []))
+            elif isinstance(result, Exception):
+                print(f"[reanalyze] entry {entry_id} failed: {result}")
+                errors.append((run, entry_id, repr(result)))
+            else:
+                pending.append((entry_id, result))
+        if not retrying:
+            failed += len(errors)
+        else:
+            failed -= len(pending)   # retried entries that went through this time
+
+        # one transaction per batch: the analyzer writes + the failures + the checkpoint
+        async with database.write() as db:
+            for entry_id, writes in pending:
+                for a, section, session_id, upto_id, merge in writes:
+                    save_analyzer_section(db, a, section, session_id, entry_id,
+                                          upto_id=upto_id, merge=merge, replace=not merge)
+            db.executemany("DELETE FROM reanalysis_failures WHERE run = ? AND entry_id = ?",
+                           [(run, entry_id) for entry_id, _ in pending])
+            db.executemany("""
+                INSERT INTO reanalysis_failures (run, entry_id, error) VALUES (?, ?, ?)
+                ON CONFLICT(run, entry_id) DO UPDATE SET error = excluded.error, failed_at = datetime('now')
+            """, errors)
+            if not retrying:
+                last_id = batch[-1]
+            _checkpoint(db, run, last_id, done + len(pending), failed)
+        done += len(pending)
+
+        processed += len(batch)
+        minutes = (time.perf_counter() - started) / 60
+        print(f"[reanalyze] {processed} entries this run ({done} total, {failed} failed), "
+              f"last entry {last_id}, {processed / minutes if minutes else 0:.1f} entries/min")
+
+    if limit is None or processed < limit:
+        async with database.write() as db:
+            _checkpoint(db, run, last_id, done, failed, finished=True)
+    return {"run": run, "entries_done": done, "entries_failed": failed, "processed": processed}
+
+
+def _load_models(backend: str) -> Dict[str, Any]:
+    # synchronous load, roles without a model of their own are served by the chat model
+    options = model_options_from_env(backend, default_llama_kwargs())
+    models = {role: create_backend(backend, **opts) for role, opts in options.items()}
+    for a in build_analyzers():
+        models.setdefault(a.model, models["chat"])
+    return models
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    p = argparse.ArgumentParser(description="Re-run the analyzers over all journal entries.")
+    p.add_argument("--run", default="default", help="checkpoint name; the same name resumes a killed run")
+    p.add_argument("--restart", action="store_true", help="forget the checkpoint of --run and start over")
+    p.add_argument("--mode", choices=ANALYSIS_MODES, default="combined")
+    p.add_argument("--incremental", action="store_true", help="only analyze messages added since the last run")
+    p.add_argument("--refresh", action="store_true", help="ignore the analysis cache")
+    p.add_argument("--commit-every", type=int, default=20, help="entries per transaction/checkpoint")
+    p.add_argument("--since", help="only entries from this date on (YYYY-MM-DD)")
+    p.add_argument("--limit", type=int, help="stop after this many entries (resume later)")
+    p.add_argument("--backend", default=os.getenv("JOURNAI_LLM_BACKEND", "llama_cpp"))
+    p.add_argument("--workers", type=int, default=0, help="model worker processes (0 = one in-process model)")
+    p.add_argument("--threads-per-worker", type=int, help="llama threads of each worker process")
+    args = p.parse_args(argv)
+
+    # WAL: the server can keep running (and reading) while this writes
+    database = Database(readers=1)
+    create_tables(database.writer)
+    if args.workers > 0:
+        # workers take whole entries, --commit-every should be >= --workers to keep them busy
+        options = model_options_from_env(args.backend, default_llama_kwargs())
+        inference = ModelWorkerPool(args.backend, options, workers=args.workers,
+                                    threads_per_worker=args.threads_per_worker)
+        models = {a.model: inference.handle(a.model) for a in build_analyzers()}
+    else:
+        models = _load_models(args.backend)
+        inference = InferenceScheduler()
+    try:
+        summary = asyncio.run(reanalyze(
+            database, inference, models, run=args.run, mode=args.mode, refresh=args.refresh,
+            incremental=args.incremental, commit_every=max(1, args.commit_every),
+            since=args.since, limit=args.limit, restart=args.restart,
+        ))
+        print(f"[reanalyze] {summary}")
+    finally:
+        inference.shutdown()
+        database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Per-day rollups of the dashboard aggregates, kept up to date by triggers in the same
+transaction as the rows they summarize (insert, delete, update, merge re-pointing):
+
+    activity_daily   day x activity: count, rated count, rating sum
+    quiz_daily       day x quiz description x source: count, rated count, rating sum
+    plutchik_daily   day x source x primary: count, intensity sum
+    va_daily         day: count, valence sum, arousal sum
+    session_mood     session: rated activity count + rating sum -> Sessions.mood_avg
+
+Month / all-time views read a few rows per day from these instead of grouping every raw row.
+The tables are derived data (not exported, see backup.py) and can be rebuilt at any time:
+
+    python rollups.py            # rebuild from the raw tables
+    python rollups.py --check    # compare the stored rollups with a fresh rebuild, change nothing
+"""
+import argparse
+import sqlite3
+import sys
+from typing import Dict, List
+
+ROLLUP_TABLES = ("activity_daily", "quiz_daily", "plutchik_daily", "va_daily", "session_mood")
+
+_TABLES = """
+CREATE TABLE IF NOT EXISTS activity_daily (
+    day         TEXT NOT NULL,
+    activity_id INTEGER NOT NULL,
+    n           INTEGER NOT NULL,
+    rated_n     INTEGER NOT NULL,
+    rating_sum  REAL NOT NULL,
+    PRIMARY KEY (day, activity_id)
+);
+CREATE TABLE IF NOT EXISTS quiz_daily (
+    day         TEXT NOT NULL,
+    description TEXT NOT NULL,
+    source      TEXT NOT NULL,
+    n           INTEGER NOT NULL,
+    rated_n     INTEGER NOT NULL,
+    rating_sum  REAL NOT NULL,
+    PRIMARY KEY (day, description, source)
+);
+CREATE TABLE IF NOT EXISTS plutchik_daily (
+    day             TEXT NOT NULL,
+    source          TEXT NOT NULL,
+    primary_emotion TEXT NOT NULL,
+    n               INTEGER NOT NULL,
+    intensity_sum   REAL NOT NULL,
+    PRIMARY KEY (day, source, primary_emotion)
+);
+CREATE INDEX IF NOT EXISTS idx_plutchik_daily_source ON plutchik_daily(source, day);
+CREATE TABLE IF NOT EXISTS va_daily (
+    day         TEXT PRIMARY KEY,
+    n           INTEGER NOT NULL,
+    valence_sum REAL NOT NULL,
+    arousal_sum REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS session_mood (
+    session_id  INTEGER PRIMARY KEY,
+    rated_n     INTEGER NOT NULL,
+    rating_sum  REAL NOT NULL
+);
+"""
+
+# ---- trigger bodies: {r} is NEW (add the row) or OLD (take it back out) ----
+# mood_avg: mean activity rating of the session ("mood afterwards", 1-10)
+_SESSION_MOOD = """
+    UPDATE Sessions SET mood_avg = (
+        SELECT MIN(10.0, MAX(1.0, rating_sum * 1.0 / rated_n)) FROM session_mood WHERE session_id = {r}.session_id
+    ) WHERE id = {r}.session_id AND {r}.metric_type = 'activity' AND {r}.rating IS NOT NULL;
+"""
+
+_METRICS_ADD = """
+    INSERT INTO activity_daily (day, activity_id, n, rated_n, rating_sum)
+        SELECT date({r}.timestamp), {r}.activity_id, 1, {r}.rating IS NOT NULL, COALESCE({r}.rating, 0)
+        WHERE {r}.metric_type = 'activity' AND {r}.activity_id IS NOT NULL AND date({r}.timestamp) IS NOT NULL
+        ON CONFLICT (day, activity_id) DO UPDATE SET
+            n = n + 1, rated_n = rated_n + excluded.rated_n, rating_sum = rating_sum + excluded.rating_sum;
+    INSERT INTO quiz_daily (day, description, source, n, rated_n, rating_sum)
+        SELECT date({r}.timestamp), {r}.description, {r}.source, 1, {r}.rating IS NOT NULL, COALESCE({r}.rating, 0)
+        WHERE {r}.metric_type = 'quiz' AND date({r}.timestamp) IS NOT NULL
+        ON CONFLICT (day, description, source) DO UPDATE SET
+            n = n + 1, rated_n = rated_n + excluded.rated_n, rating_sum = rating_sum + excluded.rating_sum;
+    INSERT INTO session_mood (session_id, rated_n, rating_sum)
+        SELECT {r}.session_id, 1, {r}.rating
+        WHERE {r}.metric_type = 'activity' AND {r}.rating IS NOT NULL AND {r}.session_id IS NOT NULL
+        ON CONFLICT (session_id) DO UPDATE SET rated_n = rated_n + 1, rating_sum = rating_sum + excluded.rating_sum;
+""" + _SESSION_MOOD
+
+_METRICS_SUB = """
+    UPDATE activity_daily
+        SET n = n - 1, rated_n = rated_n - ({r}.rating IS NOT NULL), rating_sum = rating_sum - COALESCE({r}.rating, 0)
+        WHERE {r}.metric_type = 'activity' AND day = date({r}.timestamp) AND activity_id = {r}.activity_id;
+    DELETE FROM activity_daily WHERE day = date({r}.timestamp) AND activity_id = {r}.activity_id AND n <= 0;
+    UPDATE quiz_daily
+        SET n = n - 1, rated_n = rated_n - ({r}.rating IS NOT NULL), rating_sum = rating_sum - COALESCE({r}.rating, 0)
+        WHERE {r}.metric_type = 'quiz' AND day = date({r}.timestamp) AND description = {r}.description AND source = {r}.source;
+    DELETE FROM quiz_daily
+        WHERE day = date({r}.timestamp) AND description = {r}.description AND source = {r}.source AND n <= 0;
+    UPDATE session_mood SET rated_n = rated_n - 1, rating_sum = rating_sum - {r}.rating
+        WHERE {r}.metric_type = 'activity' AND {r}.rating IS NOT NULL AND session_id = {r}.session_id;
+    DELETE FROM session_mood WHERE session_id = {r}.session_id AND rated_n <= 0;
+""" + _SESSION_MOOD
+
+_PLUTCHIK_ADD = """
+    INSERT INTO plutchik_daily (day, source, primary_emotion, n, intensity_sum)
+        SELECT date({r}.timestamp), {r}.source, {r}.primary_emotion, 1, {r}.intensity
+        WHERE date({r}.timestamp) IS NOT NULL
+        ON CONFLICT (day, source, primary_emotion) DO UPDATE SET
+            n = n + 1, intensity_sum = intensity_sum + excluded.intensity_sum;
+"""
+
+_PLUTCHIK_SUB = """
+    UPDATE plutchik_daily SET n = n - 1, intensity_sum = intensity_sum - {r}.intensity
+        WHERE day = date({r}.timestamp) AND source = {r}.source AND primary_emotion = {r}.primary_emotion;
+    DELETE FROM plutchik_daily
+        WHERE day = date({r}.timestamp) AND source = {r}.source AND primary_emotion = {r}.primary_emotion AND n <= 0;
+"""
+
+_VA_ADD = """
+    INSERT INTO va_daily (day, n, valence_sum, arousal_sum)
+        SELECT date({r}.timestamp), 1, {r}.valence, {r}.arousal
+        WHERE {r}.valence IS NOT NULL AND {r}.arousal IS NOT NULL AND date({r}.timestamp) IS NOT NULL
+        ON CONFLICT (day) DO UPDATE SET
+            n = n + 1, valence_sum = valence_sum + excluded.valence_sum, arousal_sum = arousal_sum + excluded.arousal_sum;
+"""
+
+_VA_SUB = """
+    UPDATE va_daily SET n = n - 1, valence_sum = valence_sum - {r}.valence, arousal_sum = arousal_sum - {r}.arousal
+        WHERE {r}.valence IS NOT NULL AND {r}.arousal IS NOT NULL AND day = date({r}.timestamp);
+    DELETE FROM va_daily WHERE day = date({r}.timestamp) AND n <= 0;
+"""
+
+
+def _triggers(table: str, name: str, add: str, sub: str, watched: str) -> str:
+    # an update is the old row taken out and the new one added; only for the columns the rollups use
+    return f"""
+CREATE TRIGGER IF NOT EXISTS rollup_{name}_insert AFTER INSERT ON {table} BEGIN {add.format(r="NEW")} END;
+CREATE TRIGGER IF NOT EXISTS rollup_{name}_delete AFTER DELETE ON {table} BEGIN {sub.format(r="OLD")} END;
+CREATE TRIGGER IF NOT EXISTS rollup_{name}_update AFTER UPDATE OF {watched} ON {table}
+BEGIN {sub.format(r="OLD")} {add.format(r="NEW")} END;
+"""
+
+
+# tables + triggers (migration 3); plutchik_events replaces rows ON CONFLICT, those deletes
+# only reach the triggers with PRAGMA recursive_triggers = ON (db.connect sets it)
+ROLLUP_SCHEMA = _TABLES + "".join((
+    _triggers("Metrics", "metrics", _METRICS_ADD, _METRICS_SUB,
+              "metric_type, activity_id, description, rating, source, timestamp, session_id"),
+    _triggers("plutchik_events", "plutchik", _PLUTCHIK_ADD, _PLUTCHIK_SUB,
+              "source, primary_emotion, intensity, timestamp"),
+    _triggers("analysis_results", "va", _VA_ADD, _VA_SUB, "valence, arousal, timestamp"),
+))
+
+REBUILD_STATEMENTS: List[str] = [
+    *(f"DELETE FROM {t}" for t in ROLLUP_TABLES),
+    """INSERT INTO activity_daily (day, activity_id, n, rated_n, rating_sum)
+       SELECT date(timestamp), activity_id, COUNT(*), COUNT(rating), COALESCE(SUM(rating), 0)
+       FROM Metrics
+       WHERE metric_type = 'activity' AND activity_id IS NOT NULL AND date(timestamp) IS NOT NULL
+       GROUP BY 1, 2""",
+    """INSERT INTO quiz_daily (day, description, source, n, rated_n, rating_sum)
+       SELECT date(timestamp), description, source, COUNT(*), COUNT(rating), COALESCE(SUM(rating), 0)
+       FROM Metrics
+       WHERE metric_type = 'quiz' AND date(timestamp) IS NOT NULL
+       GROUP BY 1, 2, 3""",
+    """INSERT INTO plutchik_daily (day, source, primary_emotion, n, intensity_sum)
+       SELECT date(timestamp), source, primary_emotion, COUNT(*), SUM(intensity)
+       FROM plutchik_events
+       WHERE date(timestamp) IS NOT NULL
+       GROUP BY 1, 2, 3""",
+    """INSERT INTO va_daily (day, n, valence_sum, arousal_sum)
+       SELECT date(timestamp), COUNT(*), SUM(valence), SUM(arousal)
+       FROM analysis_results
+       WHERE valence IS NOT NULL AND arousal IS NOT NULL AND date(timestamp) IS NOT NULL
+       GROUP BY 1""",
+    """INSERT INTO session_mood (session_id, rated_n, rating_sum)
+       SELECT session_id, COUNT(*), SUM(rating)
+       FROM Metrics
+       WHERE metric_type = 'activity' AND rating IS NOT NULL AND session_id IS NOT NULL
+       GROUP BY 1""",
+    """UPDATE Sessions SET mood_avg = (
+           SELECT MIN(10.0, MAX(1.0, rating_sum * 1.0 / rated_n)) FROM session_mood WHERE session_id = Sessions.id)""",
+]
+REBUILD_SQL = ";\n".join(REBUILD_STATEMENTS) + ";"
+
+
+def rebuild(db: sqlite3.Connection) -> Dict[str, int]:
+    """Recompute every rollup from the raw tables (in the caller's transaction) -> rows per table."""
+    for sql in REBUILD_STATEMENTS:
+        db.execute(sql)
+    return {t: db.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ROLLUP_TABLES}
+
+
+def _snapshot(db: sqlite3.Connection) -> Dict[str, set]:
+    # sums rounded: incremental and fresh float sums may differ in the last bits
+    snap = {t: {tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+                for row in db.execute(f"SELECT * FROM {t}")} for t in ROLLUP_TABLES}
+    snap["Sessions.mood_avg"] = {(i, None if m is None else round(m, 6))
+                                 for i, m in db.execute("SELECT id, mood_avg FROM Sessions")}
+    return snap
+
+
+def check(db: sqlite3.Connection) -> List[str]:
+    """-> the rollups that differ from a fresh rebuild; the database is left as it was."""
+    if db.in_transaction:
+        db.commit()
+    db.execute("BEGIN")
+    try:
+        stored = _snapshot(db)
+        rebuild(db)
+        fresh = _snapshot(db)
+    finally:
+        db.rollback()
+    return [name for name in stored if stored[name] != fresh[name]]
+
+
+def main(argv=None) -> None:
+    from db import DB_PATH, connect, create_tables
+
+    p = argparse.ArgumentParser(description="Rebuild or verify the daily rollup tables.")
+    p.add_argument("--db", default=DB_PATH)
+    p.add_argument("--check", action="store_true", help="only report rollups that are out of date")
+    args = p.parse_args(argv)
+
+    db = connect(args.db)
+    create_tables(db)
+    try:
+        if args.check:
+            stale = check(db)
+            print(f"[rollups] {'out of date: ' + ', '.join(stale) if stale else 'up to date'}")
+            sys.exit(1 if stale else 0)
+        counts = rebuild(db)
+        db.commit()
+        print(f"[rollups] rebuilt {counts}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 import datetime
-from fastapi import APIRouter, Request
+import sqlite3
+from fastapi import APIRouter, Depends, Request
+
+from db import get_write_db
 
 
 session_router = APIRouter()
 
-async def start_journaling(request: Request):
-    db = request.app.state.db
+async def start_journaling(request: Request, db: sqlite3.Connection = Depends(get_write_db)):
     journal = request.app.state.journal        
     session_id = journal.get_or_create_session_id(db)
     entry_id = journal.start_new_entry(db)
@@ -19,6 +21,7 @@ class sessionMemory:
         self.current_entry_id = None
         self.current_session_id = None
 
+    # both run in the caller's write block (get_write_db), which commits
     def get_or_create_session_id(self, db):
         today = datetime.date.today().isoformat()
         cursor = db.execute("SELECT id FROM Sessions WHERE date = ?", (today,))
@@ -28,7 +31,6 @@ class sessionMemory:
         else:
             cursor = db.execute("INSERT INTO Sessions (date) VALUES (?)", (today,))
             self.current_session_id = cursor.lastrowid
-            db.commit()
         return self.current_session_id
 
     #TODO: implement 
@@ -38,7 +40,6 @@ class sessionMemory:
             VALUES (?)
         """, ("empty_entry",))
         self.current_entry_id = cursor.lastrowid
-        db.commit()
         return self.current_entry_id
 
     def end_session(self):
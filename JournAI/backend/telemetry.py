@@ -0,0 +1,207 @@
+#-------------------------Telemetry (Prometheus text format)--------------------------------
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        key = tuple(str(v) for v in labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {v:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}   # per-bucket counts + [sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        key = tuple(str(v) for v in labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, s in sorted(self._series.items()):
+                running = 0.0
+                for b, n in zip(self.buckets, s):
+                    running += n
+                    le = _labels(self.labelnames, key, 'le="%g"' % b)
+                    lines.append(f"{self.name}_bucket{le} {running:g}")
+                le = _labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{le} {s[-1]:g}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {s[-2]:.6g}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {s[-1]:g}")
+        return lines
+
+
+# ---------------------- metrics ----------------------
+LLM_CALLS = Counter("journai_llm_calls_total", "Model calls by outcome.", ("model", "tag", "outcome"))
+LLM_QUEUE_WAIT = Histogram("journai_llm_queue_wait_seconds", "Time a call waited for the model.", ("model", "tag"))
+LLM_DURATION = Histogram("journai_llm_call_seconds", "Wall time of a model call (after the queue).", ("model", "tag"))
+LLM_PROMPT_EVAL = Histogram("journai_llm_prompt_eval_seconds", "Prompt evaluation time (time to first token when streaming).", ("model", "tag"))
+LLM_GENERATION = Histogram("journai_llm_generation_seconds", "Token generation time.", ("model", "tag"))
+LLM_PROMPT_TOKENS = Histogram("journai_llm_prompt_tokens", "Prompt size in tokens.", ("model", "tag"), TOKEN_BUCKETS)
+LLM_EVAL_TOKENS = Histogram("journai_llm_prompt_eval_tokens", "Prompt tokens actually evaluated (after KV reuse).", ("model", "tag"), TOKEN_BUCKETS)
+LLM_GEN_TOKENS = Histogram("journai_llm_generated_tokens", "Generated tokens per call.", ("model", "tag"), TOKEN_BUCKETS)
+LLM_TOKENS_PER_S = Histogram("journai_llm_generation_tokens_per_second", "Generation speed.", ("model", "tag"), RATE_BUCKETS)
+ANALYSIS_SECTIONS = Counter("journai_analysis_sections_total", "Analyzer sections by how they were obtained.", ("analyzer", "outcome"))
+HTTP_REQUESTS = Counter("journai_http_requests_total", "HTTP requests.", ("method", "route", "status"))
+HTTP_DURATION = Histogram("journai_http_request_seconds", "HTTP request time until the response starts.", ("method", "route"))
+SQL_DURATION = Histogram("journai_sqlite_query_seconds", "SQLite statement execution time.", ("op", "table"), SQL_BUCKETS)
+
+ALL_METRICS = (
+    LLM_CALLS, LLM_QUEUE_WAIT, LLM_DURATION, LLM_PROMPT_EVAL, LLM_GENERATION, LLM_PROMPT_TOKENS,
+    LLM_EVAL_TOKENS, LLM_GEN_TOKENS, LLM_TOKENS_PER_S, ANALYSIS_SECTIONS, HTTP_REQUESTS, HTTP_DURATION, SQL_DURATION,
+)
+
+
+def render() -> str:
+    return "\n".join(line for m in ALL_METRICS for line in m.render()) + "\n"
+
+
+# ---------------------- recording helpers ----------------------
+def model_label(llm) -> str:
+    return str(getattr(llm, "model_id", "") or getattr(llm, "role", "") or "unknown")
+
+
+def observe_llm_call(llm, tag: str, wait_s: float, elapsed_s: float, response: Optional[dict] = None,
+                     ok: bool = True, ttft_s: Optional[float] = None, gen_tokens: Optional[int] = None,
+                     prompt_tokens: Optional[int] = None) -> None:
+    """
+    One finished model call. Token counts come from response["usage"], the prompt/generation
+    split from response["timings"] when the backend reports it (else ttft_s when streaming).
+    Streams have no usage: the caller passes the counts (and timings, as a response) itself.
+    """
+    model = model_label(llm)
+    LLM_CALLS.inc(model, tag, "ok" if ok else "error")
+    LLM_QUEUE_WAIT.observe(wait_s, model, tag)
+    LLM_DURATION.observe(elapsed_s, model, tag)
+    if not ok:
+        return
+
+    usage = (response or {}).get("usage") or {}
+    timings = (response or {}).get("timings") or {}
+    prompt_tokens = usage.get("prompt_tokens") or prompt_tokens
+    gen_tokens = usage.get("completion_tokens", gen_tokens)
+    if prompt_tokens:
+        LLM_PROMPT_TOKENS.observe(prompt_tokens, model, tag)
+    if timings.get("prompt_n") is not None:
+        LLM_EVAL_TOKENS.observe(timings["prompt_n"], model, tag)
+    if gen_tokens is not None:
+        LLM_GEN_TOKENS.observe(gen_tokens, model, tag)
+
+    prompt_s = timings["prompt_ms"] / 1000 if timings.get("prompt_ms") is not None else ttft_s
+    gen_s = timings["gen_ms"] / 1000 if timings.get("gen_ms") is not None else (
+        elapsed_s - prompt_s if prompt_s is not None else None)
+    if prompt_s is not None:
+        LLM_PROMPT_EVAL.observe(prompt_s, model, tag)
+    if gen_s is not None:
+        LLM_GENERATION.observe(gen_s, model, tag)
+        if gen_tokens and gen_s > 0:
+            LLM_TOKENS_PER_S.observe(gen_tokens / gen_s, model, tag)
+
+
+def observe_section(analyzer: str, outcome: str) -> None:
+    # outcome: cache_hit | json | recovered | failed | combined | fallback
+    ANALYSIS_SECTIONS.inc(analyzer, outcome)
+
+
+def observe_http(method: str, route: str, status: int, seconds: float) -> None:
+    HTTP_REQUESTS.inc(method, route, str(status))
+    HTTP_DURATION.observe(seconds, method, route)
+
+
+# ---------------------- sqlite ----------------------
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?|JOIN)\s+([\"\w]+)", re.I)
+
+
+@lru_cache(maxsize=1024)
+def _sql_labels(sql: str) -> Tuple[str, str]:
+    stripped = sql.lstrip()
+    op = stripped.split(None, 1)[0].upper() if stripped else ""
+    m = _SQL_TABLE.search(sql)
+    return op, (m.group(1).strip('"') if m else "")
+
+
+def observe_sql(sql: str, seconds: float) -> None:
+    SQL_DURATION.observe(seconds, *_sql_labels(sql))
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    sqlite3.connect(..., factory=TimedConnection): every execute / executemany /
+    executescript / commit on the connection is timed per statement kind and table.
+    SELECT time covers stepping to the first row, fetching the rest is not included.
+    """
+
+    def execute(self, sql, parameters=(), /):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_sql(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters, /):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            observe_sql(sql, time.perf_counter() - started)
+
+    def executescript(self, sql_script, /):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            SQL_DURATION.observe(time.perf_counter() - started, "SCRIPT", "")
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            SQL_DURATION.observe(time.perf_counter() - started, "COMMIT", "")
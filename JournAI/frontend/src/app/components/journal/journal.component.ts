@@ -112,34 +112,66 @@ export class JournalComponent extends BaseComponent {
     });
     return;
   }
-  // -------------------bot mode enabled ------------------
-    this.http.post<{ user: string, bot: string, entry_id: number }>(
-      'http://127.0.0.1:8000/chat',
-      payload
-    ).subscribe({
-      next: (res) => {
-        // save entry_id from first response if not already set
-        if (!this.entryId) {
-          this.entryId = res.entry_id;
-        }
+  // -------------------bot mode enabled (streamed) ------------------
+    payload.stream = true;
+    this.streamBotReply(payload).finally(() => {
+      // unlock sending when finished (yes or error)
+      this.isWaitingForBot = false;
+    });
+  }
 
-        // update last message with bot reply
-        const lastIndex = this.chatHistory.length - 1;
-        this.chatHistory[lastIndex].bot = res.bot;
-        this.scrollToBottom();
-      },
-      error: (err) => {
-        const lastIndex = this.chatHistory.length - 1;  
-        this.chatHistory[lastIndex].bot = 'Failed to contact the AI.';
-        this.errorMessage = 'Failed to contact the AI. Please make sure the backend server is running.';
-        
-        console.error('Chat error:', err);
-      },
-      complete: () => {
-        // unlock sending when finished (yes or error)
-        this.isWaitingForBot = false;
+  // reads the /chat Server-Sent Events stream and grows the last bot bubble token by token
+  private async streamBotReply(payload: any) {
+    const lastIndex = this.chatHistory.length - 1;
+    try {
+      const res = await fetch('http://127.0.0.1:8000/chat', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload)
+      });
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // frames are separated by a blank line
+        let sep: number;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+          const frame = buffer.slice(0, sep);
+          buffer = buffer.slice(sep + 2);
+
+          let event = 'message';
+          let data = '';
+          for (const line of frame.split('\n')) {
+            if (line.startsWith('event:')) event = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+          }
+          if (!data) continue;
+          const msg = JSON.parse(data);
+
+          if (event === 'start' && !this.entryId) {
+            this.entryId = msg.entry_id; // get entry_id from first msg
+          } else if (event === 'token') {
+            this.chatHistory[lastIndex].bot = (this.chatHistory[lastIndex].bot || '') + msg.text;
+            this.scrollToBottom();
+          } else if (event === 'done') {
+            this.chatHistory[lastIndex].bot = msg.bot;
+          } else if (event === 'error') {
+            throw new Error(msg.detail);
+          }
+        }
       }
-    });
+    } catch (err) {
+      this.chatHistory[lastIndex].bot = 'Failed to contact the AI.';
+      this.errorMessage = 'Failed to contact the AI. Please make sure the backend server is running.';
+      console.error('Chat error:', err);
+    }
   }
 
 
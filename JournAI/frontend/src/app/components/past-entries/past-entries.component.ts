@@ -16,7 +16,14 @@ interface Entry {
   entry_id: number;
   title: string;
   timestamp: string;
-  messages: Message[];
+  message_count: number;
+  last_message: { sender: 'user' | 'bot'; preview: string } | null;
+  messages?: Message[]; // loaded from /history when the entry is opened
+}
+
+interface EntriesPage {
+  entries: Entry[];
+  next_cursor: string | null;
 }
 
 @Component({
@@ -30,6 +37,8 @@ export class PastEntriesComponent implements OnInit {
   constructor(private http: HttpClient, private router: Router) {}
 
   chatEntries: Entry[] = [];
+  nextCursor: string | null = null;
+  loadingEntries = false;
   selectedEntry: Entry | null = null;
   showConfirmDialog = false;
   entryToDelete: Entry | null = null;
@@ -43,18 +52,39 @@ export class PastEntriesComponent implements OnInit {
     this.router.navigate(['/dashboard']);
   }
 
-  fetchEntries() {
-    this.http.get<Entry[]>('http://localhost:8000/entries').subscribe(
-      (data) => {
-        // keep only non-empty titles
-        this.chatEntries = (data || []).filter(e => e.title !== 'empty_entry');
+  fetchEntries(cursor: string | null = null) {
+    // one page at a time (empty entries are left out by the backend), next_cursor -> "Load more"
+    const params: Record<string, string> = { limit: '20' };
+    if (cursor) params['cursor'] = cursor;
+
+    this.loadingEntries = true;
+    this.http.get<EntriesPage>('http://localhost:8000/entries', { params }).subscribe(
+      (page) => {
+        this.chatEntries = cursor ? [...this.chatEntries, ...page.entries] : page.entries;
+        this.nextCursor = page.next_cursor;
+        this.loadingEntries = false;
       },
-      (error) => console.error('Error fetching entries:', error)
+      (error) => {
+        console.error('Error fetching entries:', error);
+        this.loadingEntries = false;
+      }
     );
   }
 
+  loadMore() {
+    if (this.nextCursor && !this.loadingEntries) this.fetchEntries(this.nextCursor);
+  }
+
   openPopup(entry: Entry) {
     this.selectedEntry = entry;
+    if (entry.messages) return;
+
+    // messages are only fetched when the entry is opened
+    this.http.get<{ history: Message[] }>('http://localhost:8000/history', { params: { entry_id: entry.entry_id } })
+      .subscribe(
+        (data) => entry.messages = data.history || [],
+        (error) => console.error('Error fetching entry messages:', error)
+      );
   }
 
   closePopup() {